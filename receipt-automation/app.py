@@ -7,10 +7,20 @@ import os
 from pathlib import Path
 from datetime import datetime
 import shutil
+import uuid
 from dotenv import load_dotenv
 
-from excel_handler import ExpenseExcelHandler
+from excel_handler import get_summary
+from excel_writer import get_writer
 from receipt_processor import ReceiptProcessor
+from receipt_cache import ReceiptCache
+from duplicate_index import DuplicateIndex
+from job_queue import JobQueue
+from ledger_index import LedgerIndex, find_workbooks
+from image_preprocessor import ImagePreprocessor
+from metrics import (
+    JsonLinesExporter, Metrics, PrometheusTextfileExporter, RecentEvents, summarize_requests
+)
 
 # 環境変数読み込み
 load_dotenv()
@@ -23,12 +33,321 @@ st.set_page_config(
 )
 
 # セッション状態の初期化
-if "processed_data" not in st.session_state:
-    st.session_state.processed_data = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "submitted_uploads" not in st.session_state:
+    st.session_state.submitted_uploads = set()
+if "review_state" not in st.session_state:
+    st.session_state.review_state = (0, 0)
 if "excel_path" not in st.session_state:
     st.session_state.excel_path = None
 
 
+@st.cache_resource
+def get_receipt_cache():
+    """抽出結果キャッシュ（再実行・セッション間で共有）"""
+    return ReceiptCache(".cache/receipts")
+
+
+@st.cache_resource
+def get_duplicate_index():
+    """処理済みレシートの知覚ハッシュの索引（撮り直した同じレシートの検出用）"""
+    return DuplicateIndex(".cache/duplicates.jsonl")
+
+
+@st.cache_resource
+def get_recent_events():
+    """デバッグ表示用に保持する直近の計測イベント"""
+    return RecentEvents(maxlen=1000)
+
+
+@st.cache_resource
+def get_metrics():
+    """処理時間の計測（環境変数で指定された場合はファイルにも出力）"""
+    metrics = Metrics()
+    metrics.add_hook(get_recent_events())
+
+    jsonl_path = os.getenv("RECEIPT_METRICS_JSONL")
+    if jsonl_path:
+        metrics.add_hook(JsonLinesExporter(jsonl_path))
+
+    prom_path = os.getenv("RECEIPT_METRICS_PROM")
+    if prom_path:
+        metrics.add_hook(PrometheusTextfileExporter(prom_path))
+
+    return metrics
+
+
+@st.cache_resource
+def get_receipt_processor(api_key: str):
+    """レシート処理クラス（APIキーごとに1つ生成し、接続を使い回す）"""
+    return ReceiptProcessor(
+        api_key=api_key,
+        cache=get_receipt_cache(),
+        preprocessor=ImagePreprocessor(),
+        metrics=get_metrics(),
+        duplicate_index=get_duplicate_index()
+    )
+
+
+@st.cache_resource
+def get_job_queue():
+    """抽出ジョブのワーカープール（全セッションで共有）"""
+    return JobQueue(max_workers=int(os.getenv("RECEIPT_JOB_WORKERS", "4")))
+
+
+@st.cache_resource
+def get_ledger():
+    """全ての月次ブックの明細索引（起動時に、前回から変更のあったブックを取り込む）"""
+    ledger = LedgerIndex(".cache/ledger.sqlite3")
+    ledger.backfill(find_workbooks())
+    return ledger
+
+
+def get_excel_writer(excel_path: str):
+    """Excelファイルの書き込みキュー（全セッションで共有）"""
+    return get_writer(excel_path, overflow=True, fast_save=True, metrics=get_metrics(), ledger=get_ledger())
+
+
+# 抽出結果の表示項目
+FIELD_LABELS = {
+    "date": "日付",
+    "payee": "支払先",
+    "content": "支払内容",
+    "amount": "金額",
+}
+
+
+def format_field(field: str, value) -> str:
+    """抽出結果の表示用文字列（ストリーミング中の正規化前の値にも対応）"""
+    if field == "amount" and isinstance(value, (int, float)):
+        return f"¥{value:,.0f}"
+    return str(value)
+
+
+# ジョブの状態の表示
+JOB_STATUS_LABELS = {
+    "queued": "⏳ 待機中",
+    "running": "🔍 解析中",
+    "done": "✅ 完了",
+    "failed": "❌ 失敗",
+}
+
+
+def upload_key(uploaded_file) -> str:
+    """アップロードされたファイルの識別子（同じファイルを二重に登録しないため）"""
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+@st.fragment(run_every=1.0)
+def show_job_progress():
+    """抽出ジョブの進捗（この部分だけを1秒ごとに再描画）"""
+    jobs = get_job_queue().jobs(st.session_state.session_id)
+    if not jobs:
+        return
+
+    import pandas as pd
+
+    finished = sum(job.finished for job in jobs)
+    st.progress(finished / len(jobs), text=f"抽出済み {finished}/{len(jobs)}件")
+
+    rows = []
+    for job in jobs:
+        fields = job.result if job.status == "done" else job.fields
+        rows.append({
+            "ファイル": job.name,
+            "状態": JOB_STATUS_LABELS[job.status],
+            **{label: format_field(field, fields[field]) if field in fields else "" for field, label in FIELD_LABELS.items()},
+            "秒": round(job.elapsed, 1),
+            "メッセージ": job.message
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+    # 新しく終わった・必須フィールドが揃ったジョブがあれば、確認欄を更新するため画面全体を再実行
+    review_state = (finished, sum(job.reviewable for job in jobs))
+    if review_state != st.session_state.review_state:
+        st.session_state.review_state = review_state
+        st.rerun()
+
+
+def clear_job_widgets(job_ids):
+    """確認欄の入力値をセッション状態から削除"""
+    for job_id in job_ids:
+        for field in ("selected", "extracted", *FIELD_LABELS):
+            st.session_state.pop(f"{job_id}_{field}", None)
+
+
+def review_values(job) -> dict:
+    """
+    確認欄に表示する値（抽出中は確定済みのフィールド、完了後は正規化済みの結果）
+
+    Args:
+        job: 抽出ジョブ
+
+    Returns:
+        フィールド -> 入力欄の値
+    """
+    data = job.result if job.status == "done" else job.fields
+    try:
+        amount = float(data.get("amount") or 0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    return {
+        "date": str(data.get("date") or ""),
+        "payee": str(data.get("payee") or ""),
+        "content": str(data.get("content") or ""),
+        "amount": amount,
+    }
+
+
+def sync_review_widgets(job):
+    """
+    入力欄のうち、利用者が編集していないものを最新の抽出結果に合わせる
+
+    ストリーミング中に開いた確認欄を、後から届いた支払内容や完了時の正規化済みの値で更新する。
+    ウィジェットの生成前に呼ぶこと
+
+    Args:
+        job: 抽出ジョブ
+    """
+    values = review_values(job)
+    extracted_key = f"{job.job_id}_extracted"
+    extracted = st.session_state.get(extracted_key, {})
+    for field, value in values.items():
+        key = f"{job.job_id}_{field}"
+        if key not in st.session_state or st.session_state[key] == extracted.get(field):
+            st.session_state[key] = value
+    st.session_state[extracted_key] = values
+
+
+def show_review():
+    """抽出が終わったレシートの確認・編集と一括登録"""
+    queue = get_job_queue()
+    jobs = queue.jobs(st.session_state.session_id)
+    reviewable = [job for job in jobs if job.reviewable]
+    failed = [job for job in jobs if job.status == "failed"]
+
+    # 前回の登録結果
+    commit_result = st.session_state.pop("commit_result", None)
+    if commit_result:
+        count, errors = commit_result
+        if count:
+            st.success(f"✅ {count}件をExcelに登録しました")
+        for error in errors:
+            st.error(error)
+
+    if failed:
+        with st.expander(f"❌ 抽出に失敗したレシート（{len(failed)}件）"):
+            for job in failed:
+                st.write(f"**{job.name}**: {job.message}")
+            if st.button("🗑️ 失敗したレシートを一覧から削除"):
+                queue.remove(job.job_id for job in failed)
+                st.rerun()
+
+    if not reviewable:
+        return
+
+    st.markdown("---")
+    st.subheader(f"✏️ データの確認・編集（{len(reviewable)}件）")
+
+    with st.form("review_form"):
+        widths = [1, 2, 2, 3, 3, 2]
+        for column, label in zip(st.columns(widths), ["登録", "画像", *FIELD_LABELS.values()]):
+            column.caption(label)
+
+        for job in reviewable:
+            sync_review_widgets(job)
+            streaming = job.status != "done"
+            cols = st.columns(widths)
+            cols[0].checkbox("登録", value=True, key=f"{job.job_id}_selected", label_visibility="collapsed")
+            cols[1].image(job.data, caption=f"{job.name}（解析中）" if streaming else job.name, use_column_width=True)
+            cols[2].text_input("日付", key=f"{job.job_id}_date", label_visibility="collapsed")
+            cols[3].text_input("支払先", key=f"{job.job_id}_payee", label_visibility="collapsed")
+            # 支払内容は必須フィールドの後に届くため、抽出が終わるまで編集できない
+            cols[4].text_input(
+                "支払内容", key=f"{job.job_id}_content", disabled=streaming, label_visibility="collapsed"
+            )
+            cols[5].number_input(
+                "金額",
+                min_value=0.0,
+                step=1.0,
+                key=f"{job.job_id}_amount",
+                label_visibility="collapsed"
+            )
+            if job.result.get("duplicate_of"):
+                st.warning(f"⚠️ {job.name}: {job.message}")
+
+        col_btn1, col_btn2 = st.columns(2)
+        with col_btn1:
+            submit = st.form_submit_button("💾 選択したレシートをExcelに登録", type="primary")
+        with col_btn2:
+            discard = st.form_submit_button("🗑️ 選択したレシートを破棄")
+
+    selected = [job for job in reviewable if st.session_state.get(f"{job.job_id}_selected")]
+
+    # 抽出中のレシートは重複検出用のハッシュなどが揃っていないため、完了後に登録する
+    streaming = [job for job in selected if job.status != "done"]
+    if submit and streaming:
+        st.info(f"⏳ 解析中の{len(streaming)}件は、抽出が終わってから登録してください")
+        selected = [job for job in selected if job.status == "done"]
+
+    if submit and selected:
+        try:
+            # 登録（バリデーションを含む。他のセッションと同じ書き込みキューでまとめて保存）
+            entries = [
+                {field: st.session_state[f"{job.job_id}_{field}"] for field in FIELD_LABELS}
+                for job in selected
+            ]
+            results = get_excel_writer(st.session_state.excel_path).add_expense_entries(entries)
+
+            # 登録できたレシートだけを重複の索引に登録（破棄・登録失敗したものは次回も重複扱いしない）
+            get_duplicate_index().add_entries(
+                {**entry, "image_hash": job.result.get("image_hash")}
+                for job, entry, (success, _) in zip(selected, entries, results) if success
+            )
+
+            committed = [job.job_id for job, (success, _) in zip(selected, results) if success]
+            errors = [f"{job.name}: {message}" for job, (success, message) in zip(selected, results) if not success]
+            queue.remove(committed)
+            clear_job_widgets(committed)
+            st.session_state.commit_result = (len(committed), errors)
+            st.rerun()
+
+        except Exception as e:
+            st.error(f"登録エラー: {str(e)}")
+
+    if discard and selected:
+        discarded = [job.job_id for job in selected]
+        queue.remove(discarded)
+        clear_job_widgets(discarded)
+        st.rerun()
+
+
+def show_debug_panel():
+    """処理段階ごとの所要時間・トークン数を表示（サイドバー）"""
+    events = get_recent_events().events()
+
+    with st.sidebar:
+        st.markdown("---")
+        with st.expander("🛠️ デバッグ: 処理時間"):
+            if not events:
+                st.caption("まだ計測データがありません")
+                return
+
+            import pandas as pd
+
+            st.caption("レシートごとの段階別の所要時間・送信サイズ・トークン数（新しい順）")
+            st.dataframe(pd.DataFrame(summarize_requests(events)), use_container_width=True)
+
+            st.caption("直近のイベント")
+            recent = pd.DataFrame(events[-30:][::-1])
+            recent["value"] = recent.apply(
+                lambda e: f"{e['value'] * 1000:.1f} ms" if e["type"] == "timing" else f"{e['value']:,}",
+                axis=1
+            )
+            st.dataframe(recent[["name", "value", "request_id"]], use_container_width=True)
+
+
 def initialize_excel():
     """Excelファイルの初期化"""
     template_path = Path("templates/立替経費精算書.xlsx")
@@ -80,19 +399,26 @@ def main():
 
             # 既存データの表示
             try:
-                handler = ExpenseExcelHandler(excel_path)
-                handler.load()
-                entries = handler.get_existing_entries()
-                total = handler.get_total_amount()
-                handler.close()
+                summary = get_summary(excel_path, metrics=get_metrics())
 
-                st.metric("登録済み件数", f"{len(entries)}件")
-                st.metric("合計金額", f"¥{total:,.0f}")
-                st.metric("残り登録可能", f"{16 - len(entries)}件")
+                st.metric("登録済み件数", f"{summary['count']}件")
+                st.metric("合計金額", f"¥{summary['total']:,.0f}")
+                st.metric("残り登録可能", f"{summary['remaining']}件")
+                if summary["pages"] > 1:
+                    st.caption(f"続きシートを含む{summary['pages']}ページで管理中")
 
             except Exception as e:
                 st.error(f"エラー: {str(e)}")
 
+        # キャッシュの状態
+        st.markdown("---")
+        st.subheader("🗂️ 抽出キャッシュ")
+        cache_stats = get_receipt_cache().stats()
+        st.caption(
+            f"ヒット {cache_stats['hits']}回 / ミス {cache_stats['misses']}回"
+            f"（{cache_stats['entries']}件保存）"
+        )
+
     # メインエリア
     if not api_key:
         st.warning("⚠️ OpenAI APIキーを設定してください（サイドバー）")
@@ -112,144 +438,69 @@ def main():
     with tab1:
         st.header("レシート画像をアップロード")
 
-        uploaded_file = st.file_uploader(
-            "レシート画像を選択",
+        uploaded_files = st.file_uploader(
+            "レシート画像を選択（複数可）",
             type=["jpg", "jpeg", "png"],
-            help="対応形式: JPG, PNG（最大10MB）"
+            accept_multiple_files=True,
+            help="対応形式: JPG, PNG（1枚あたり最大10MB）"
         )
 
-        if uploaded_file:
-            col1, col2 = st.columns([1, 1])
-
-            with col1:
-                st.subheader("📸 アップロード画像")
-                st.image(uploaded_file, use_container_width=True)
-
-            with col2:
-                st.subheader("🔍 抽出結果")
-
-                if st.button("🚀 レシート情報を抽出", type="primary"):
-                    with st.spinner("画像を解析中..."):
-                        # 一時ファイルとして保存
-                        temp_dir = Path("uploads")
-                        temp_dir.mkdir(exist_ok=True)
-                        temp_file = temp_dir / uploaded_file.name
-
-                        with open(temp_file, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-
-                        try:
-                            # レシート処理
-                            processor = ReceiptProcessor(api_key=api_key)
-                            success, data, message = processor.process_receipt_to_expense(str(temp_file))
-
-                            if success:
-                                st.session_state.processed_data = data
-                                st.success(message)
-
-                                # 抽出データを表示
-                                st.write("**日付:**", data["date"])
-                                st.write("**支払先:**", data["payee"])
-                                st.write("**支払内容:**", data["content"])
-                                st.write("**金額:**", f"¥{data['amount']:,.0f}")
-
-                            else:
-                                st.error(message)
-
-                        except Exception as e:
-                            st.error(f"エラーが発生しました: {str(e)}")
-
-                        finally:
-                            # 一時ファイルを削除
-                            if temp_file.exists():
-                                temp_file.unlink()
-
-                # データが抽出されている場合、編集・登録
-                if st.session_state.processed_data:
-                    st.markdown("---")
-                    st.subheader("✏️ データの確認・編集")
-
-                    data = st.session_state.processed_data
-
-                    # 編集フォーム
-                    with st.form("edit_form"):
-                        edited_date = st.text_input("日付", value=data["date"])
-                        edited_payee = st.text_input("支払先", value=data["payee"])
-                        edited_content = st.text_input("支払内容", value=data["content"])
-                        edited_amount = st.number_input(
-                            "金額",
-                            value=float(data["amount"]),
-                            min_value=0.0,
-                            step=1.0
-                        )
-
-                        col_btn1, col_btn2 = st.columns(2)
-                        with col_btn1:
-                            submit = st.form_submit_button("💾 Excelに登録", type="primary")
-                        with col_btn2:
-                            cancel = st.form_submit_button("❌ キャンセル")
-
-                        if submit:
-                            try:
-                                handler = ExpenseExcelHandler(st.session_state.excel_path)
-                                handler.load()
-
-                                # バリデーション
-                                is_valid, error_msg = handler.validate_data(
-                                    edited_date,
-                                    edited_payee,
-                                    edited_content,
-                                    edited_amount
-                                )
-
-                                if not is_valid:
-                                    st.error(error_msg)
-                                else:
-                                    # 登録
-                                    success, message = handler.add_expense_entry(
-                                        edited_date,
-                                        edited_payee,
-                                        edited_content,
-                                        edited_amount
-                                    )
-
-                                    if success:
-                                        handler.save()
-                                        st.success(f"✅ {message}")
-                                        st.session_state.processed_data = None
-                                        st.rerun()
-                                    else:
-                                        st.error(message)
-
-                                handler.close()
-
-                            except Exception as e:
-                                st.error(f"登録エラー: {str(e)}")
-
-                        if cancel:
-                            st.session_state.processed_data = None
-                            st.rerun()
-
-    # タブ2: 登録済みデータ
+        # まだ抽出していないファイルだけをジョブとして登録（抽出はバックグラウンドで実行）
+        new_files = [f for f in uploaded_files or [] if upload_key(f) not in st.session_state.submitted_uploads]
+        if new_files and st.button(f"🚀 レシート情報を抽出（{len(new_files)}件）", type="primary"):
+            processor = get_receipt_processor(api_key)
+            for uploaded_file in new_files:
+                get_job_queue().submit(
+                    processor,
+                    uploaded_file.name,
+                    uploaded_file.getvalue(),
+                    st.session_state.session_id
+                )
+                st.session_state.submitted_uploads.add(upload_key(uploaded_file))
+            st.rerun()
+
+        show_job_progress()
+        show_review()
+
+    # タブ2: 登録済みデータ（Excelを開かずに明細索引から検索・集計）
     with tab2:
         st.header("登録済みデータ一覧")
 
         if st.session_state.excel_path:
             try:
-                handler = ExpenseExcelHandler(st.session_state.excel_path)
-                handler.load()
-                entries = handler.get_existing_entries()
-                total = handler.get_total_amount()
-                handler.close()
+                ledger = get_ledger()
+                # 今月のファイルがExcelで直接編集された場合などは取り込み直す（変更がなければ読み込まない）
+                ledger.backfill([st.session_state.excel_path])
+
+                scope = st.radio("対象", ["今月のファイル", "すべてのファイル"], horizontal=True)
+                col_f1, col_f2, col_f3 = st.columns(3)
+                with col_f1:
+                    payee = st.text_input("支払先（部分一致）")
+                with col_f2:
+                    date_from = st.date_input("開始日", value=None)
+                with col_f3:
+                    date_to = st.date_input("終了日", value=None)
+
+                filters = {
+                    "source_file": st.session_state.excel_path if scope == "今月のファイル" else None,
+                    "payee": payee or None,
+                    "date_from": date_from.strftime("%Y/%m/%d") if date_from else None,
+                    "date_to": date_to.strftime("%Y/%m/%d") if date_to else None
+                }
+                entries = ledger.entries(**filters)
+                narrowed = bool(payee or date_from or date_to)
 
                 if entries:
                     # データフレームで表示
                     import pandas as pd
 
                     df = pd.DataFrame(entries)
+                    df["ファイル"] = df["source_file"].apply(lambda x: Path(x).name)
                     df["金額"] = df["amount"].apply(lambda x: f"¥{x:,.0f}")
-                    df_display = df[["date", "payee", "content", "金額"]]
-                    df_display.columns = ["日付", "支払先", "支払内容", "金額"]
+                    df_display = df[["ファイル", "sheet", "date", "payee", "content", "金額"]]
+                    df_display.columns = ["ファイル", "シート", "日付", "支払先", "支払内容", "金額"]
+                    if filters["source_file"] is not None:
+                        df_display = df_display.drop(columns=["ファイル"])
 
                     st.dataframe(df_display, use_container_width=True)
 
@@ -258,16 +509,34 @@ def main():
                     with col1:
                         st.metric("総件数", f"{len(entries)}件")
                     with col2:
-                        st.metric("合計金額", f"¥{total:,.0f}")
-                    with col3:
-                        st.metric("残り登録可能", f"{16 - len(entries)}件")
+                        st.metric("合計金額", f"¥{df['amount'].sum():,.0f}")
+                    if filters["source_file"] is not None and not narrowed:
+                        with col3:
+                            summary = get_summary(st.session_state.excel_path, metrics=get_metrics())
+                            st.metric("残り登録可能", f"{summary['remaining']}件")
+
+                    with st.expander("📊 支払先別・月別の集計"):
+                        col_t1, col_t2 = st.columns(2)
+                        for column, group_by, label in [(col_t1, "payee", "支払先"), (col_t2, "month", "月")]:
+                            totals = pd.DataFrame(ledger.totals(group_by, **filters))
+                            totals["total"] = totals["total"].apply(lambda x: f"¥{x:,.0f}")
+                            totals.columns = [label, "件数", "合計金額"]
+                            column.dataframe(totals, use_container_width=True, hide_index=True)
 
                 else:
-                    st.info("まだデータが登録されていません")
+                    st.info("条件に一致するデータがありません" if narrowed else "まだデータが登録されていません")
+
+                if st.button("🔄 Excelから索引を作り直す", help="すべての月次ブックを読み込み直します"):
+                    stats = ledger.backfill(find_workbooks(), force=True)
+                    ledger.prune(find_workbooks())
+                    st.success(f"{stats['scanned']}ファイル・{stats['entries']}件を取り込みました")
 
             except Exception as e:
                 st.error(f"データの読み込みエラー: {str(e)}")
 
+    # 今回の実行で記録された計測値も含めて表示するため最後に描画
+    show_debug_panel()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+バッチAPIによる夜間一括取り込みツール
+レシート画像をバッチAPIのリクエストファイル（JSONL）にまとめて投入し、完了後に結果を取り込んでExcelへ一括登録する
+
+同期APIのレート制限を使わず、応答まで最大24時間待つ代わりに料金が安い。
+--local を付けると、バッチAPIのライフサイクル（validating → in_progress → completed）を
+ローカルで模擬する代替を使う（課金・ネットワーク不要）
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from bulk_ingest import IMAGE_EXTENSIONS, iter_source_files
+from duplicate_index import DuplicateIndex
+from excel_writer import get_writer
+from image_preprocessor import ImagePreprocessor
+from mock_server import MockServer
+from openai_client import ClientConfig
+from receipt_cache import ReceiptCache
+from receipt_processor import ReceiptProcessor
+
+DEFAULT_TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+# 重複レシートの索引（アプリと共有）
+DUPLICATE_INDEX_PATH = ".cache/duplicates.jsonl"
+
+# 終了状態（これ以上変化しない）
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchStatus(NamedTuple):
+    """バッチジョブの状態"""
+    batch_id: str
+    status: str                    # validating / in_progress / finalizing / completed / failed / expired / cancelled
+    output_file_id: Optional[str]  # 成功したリクエストの結果ファイル
+    error_file_id: Optional[str]   # 失敗したリクエストの結果ファイル
+    completed: int
+    failed: int
+    total: int
+
+
+class BatchClient(ABC):
+    """バッチAPIの操作（ファイルのアップロード・ジョブの作成・状態の取得・結果のダウンロード）"""
+
+    @abstractmethod
+    def upload(self, path: str) -> str:
+        """
+        リクエストファイルをアップロード
+
+        Args:
+            path: JSONLファイルのパス
+
+        Returns:
+            ファイルID
+        """
+
+    @abstractmethod
+    def create(self, input_file_id: str) -> str:
+        """
+        バッチジョブを作成
+
+        Args:
+            input_file_id: アップロードしたリクエストファイルのID
+
+        Returns:
+            バッチID
+        """
+
+    @abstractmethod
+    def retrieve(self, batch_id: str) -> BatchStatus:
+        """
+        バッチジョブの状態を取得
+
+        Args:
+            batch_id: バッチID
+
+        Returns:
+            状態
+        """
+
+    @abstractmethod
+    def download(self, file_id: str) -> str:
+        """
+        結果ファイルの内容を取得
+
+        Args:
+            file_id: ファイルID
+
+        Returns:
+            JSONLの本文
+        """
+
+
+class OpenAIBatchClient(BatchClient):
+    """OpenAIのバッチAPI"""
+
+    def __init__(self, api_key: str, client_config: Optional[ClientConfig] = None):
+        """
+        初期化
+
+        Args:
+            api_key: OpenAI APIキー
+            client_config: 接続設定（Noneの場合はデフォルト）
+        """
+        self.client = (client_config or ClientConfig()).create_client(api_key)
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id: str) -> str:
+        batch = self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=ReceiptProcessor.BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> BatchStatus:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return BatchStatus(
+            batch_id=batch.id,
+            status=batch.status,
+            output_file_id=batch.output_file_id,
+            error_file_id=batch.error_file_id,
+            completed=getattr(counts, "completed", 0),
+            failed=getattr(counts, "failed", 0),
+            total=getattr(counts, "total", 0)
+        )
+
+    def download(self, file_id: str) -> str:
+        return self.client.files.content(file_id).text
+
+
+class LocalBatchClient(BatchClient):
+    """
+    バッチAPIのローカル代替
+
+    アップロードしたファイル・ジョブをディレクトリに保存し、作成からの経過時間で状態を進める。
+    処理時間を過ぎて最初に状態を取得したときに、モックサーバーと同じ応答で結果ファイルを作成する
+    """
+
+    def __init__(
+        self,
+        root: str = ".cache/local_batches",
+        processing_time: float = 5.0,
+        failure_rate: float = 0.0,
+        seed: int = 0
+    ):
+        """
+        初期化
+
+        Args:
+            root: ファイル・ジョブの保存先ディレクトリ
+            processing_time: ジョブの作成から完了までの時間（秒、最初の1割は validating）
+            failure_rate: リクエストが500エラーになる確率
+            seed: 乱数シード
+        """
+        self.root = Path(root)
+        self.processing_time = processing_time
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        (self.root / "files").mkdir(parents=True, exist_ok=True)
+        (self.root / "batches").mkdir(parents=True, exist_ok=True)
+
+    def _file_path(self, file_id: str) -> Path:
+        return self.root / "files" / f"{file_id}.jsonl"
+
+    def _batch_path(self, batch_id: str) -> Path:
+        return self.root / "batches" / f"{batch_id}.json"
+
+    def upload(self, path: str) -> str:
+        file_id = "file-local-" + uuid.uuid4().hex[:12]
+        shutil.copyfile(path, self._file_path(file_id))
+        return file_id
+
+    def create(self, input_file_id: str) -> str:
+        if not self._file_path(input_file_id).exists():
+            raise ValueError(f"ファイルが見つかりません: {input_file_id}")
+
+        batch_id = "batch-local-" + uuid.uuid4().hex[:12]
+        with open(self._file_path(input_file_id), "r", encoding="utf-8") as f:
+            total = sum(1 for line in f if line.strip())
+        batch = {
+            "id": batch_id,
+            "input_file_id": input_file_id,
+            "created_at": time.time(),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"completed": 0, "failed": 0, "total": total}
+        }
+        self._batch_path(batch_id).write_text(json.dumps(batch), encoding="utf-8")
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> BatchStatus:
+        path = self._batch_path(batch_id)
+        batch = json.loads(path.read_text(encoding="utf-8"))
+
+        if batch["status"] not in TERMINAL_STATUSES:
+            elapsed = time.time() - batch["created_at"]
+            if elapsed >= self.processing_time:
+                self._finish(batch)
+            elif elapsed >= self.processing_time * 0.1:
+                batch["status"] = "in_progress"
+            path.write_text(json.dumps(batch), encoding="utf-8")
+
+        counts = batch["request_counts"]
+        return BatchStatus(
+            batch_id=batch["id"],
+            status=batch["status"],
+            output_file_id=batch["output_file_id"],
+            error_file_id=batch["error_file_id"],
+            completed=counts["completed"],
+            failed=counts["failed"],
+            total=counts["total"]
+        )
+
+    def _finish(self, batch: Dict):
+        """リクエストを処理して出力・エラーの結果ファイルを作成し、ジョブを完了にする"""
+        outputs: List[Dict] = []
+        errors: List[Dict] = []
+
+        with open(self._file_path(batch["input_file_id"]), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                record = {"id": "batch_req_" + uuid.uuid4().hex[:12], "custom_id": request["custom_id"], "error": None}
+
+                if request.get("url") != ReceiptProcessor.BATCH_ENDPOINT:
+                    record["response"] = {"status_code": 400, "body": {"error": {
+                        "message": f"対応していないエンドポイントです: {request.get('url')}",
+                        "type": "invalid_request_error"
+                    }}}
+                    errors.append(record)
+                elif self._random.random() < self.failure_rate:
+                    record["response"] = {"status_code": 500, "body": {"error": {
+                        "message": "Internal server error (local batch)", "type": "server_error"
+                    }}}
+                    errors.append(record)
+                else:
+                    record["response"] = {"status_code": 200, "body": MockServer.completion_body(request["body"])}
+                    outputs.append(record)
+
+        for key, records in (("output_file_id", outputs), ("error_file_id", errors)):
+            if records:
+                file_id = "file-local-" + uuid.uuid4().hex[:12]
+                with open(self._file_path(file_id), "w", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                batch[key] = file_id
+
+        batch["status"] = "completed"
+        batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+
+    def download(self, file_id: str) -> str:
+        return self._file_path(file_id).read_text(encoding="utf-8")
+
+
+class BatchJob:
+    """投入したバッチジョブの記録（JSONファイル）"""
+
+    def __init__(self, state_path: str):
+        """
+        初期化
+
+        Args:
+            state_path: 記録ファイルのパス
+        """
+        self.state_path = Path(state_path)
+        self.state: Dict = {}
+
+    def load(self) -> "BatchJob":
+        """記録を読み込む"""
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            self.state = json.load(f)
+        return self
+
+    @property
+    def finished(self) -> bool:
+        """結果を取り出し済みか（Excelへ登録済み、または結果ファイルへ書き出し済み）"""
+        return bool(self.state.get("collected") or self.state.get("results_path"))
+
+    def save(self):
+        """記録を保存（一時ファイルからの置き換え）"""
+        temp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_path)
+
+
+def submit(
+    processor: ReceiptProcessor,
+    client: BatchClient,
+    image_paths: List[str],
+    job: BatchJob,
+    chunk_size: int,
+    local: bool
+):
+    """
+    リクエストファイルを作成してバッチジョブを投入
+
+    Args:
+        processor: レシート処理クラス
+        client: バッチAPIの操作
+        image_paths: 画像ファイルのパスのリスト
+        job: 記録先
+        chunk_size: 1つのリクエストファイルに入れる画像の枚数（ファイルサイズの上限に収めるため）
+        local: ローカル代替を使うか（記録に残し、取り込み時に同じ代替を使う）
+    """
+    work_dir = job.state_path.with_name(job.state_path.stem + "_requests")
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    job.state = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "local": local,
+        "batches": [],
+        "paths": {},
+        "requests": {},
+        "resolved": {},
+        "collected": False
+    }
+
+    for start in range(0, len(image_paths), chunk_size):
+        chunk = image_paths[start:start + chunk_size]
+        batch_path = work_dir / f"requests_{start // chunk_size + 1:03d}.jsonl"
+        requests, resolved = processor.write_batch_file(chunk, str(batch_path), first_index=start)
+        job.state["paths"].update({
+            processor.batch_custom_id(index): path for index, path in enumerate(chunk, start=start)
+        })
+        job.state["requests"].update(requests)
+        job.state["resolved"].update({custom_id: list(result) for custom_id, result in resolved.items()})
+
+        if not requests:
+            continue
+        file_id = client.upload(str(batch_path))
+        batch_id = client.create(file_id)
+        job.state["batches"].append({
+            "batch_id": batch_id,
+            "input_file": str(batch_path),
+            "requests": len(requests),
+            "status": "validating"
+        })
+        print(f"  📤 {batch_id}: {len(requests)}件（{batch_path.name}）")
+        job.save()
+
+    job.save()
+
+
+def refresh(client: BatchClient, job: BatchJob) -> List[BatchStatus]:
+    """
+    全バッチの状態を取得して記録を更新
+
+    Args:
+        client: バッチAPIの操作
+        job: 記録
+
+    Returns:
+        バッチごとの状態
+    """
+    statuses = []
+    for batch in job.state["batches"]:
+        status = client.retrieve(batch["batch_id"])
+        batch["status"] = status.status
+        statuses.append(status)
+    job.save()
+    return statuses
+
+
+def collect(
+    processor: ReceiptProcessor,
+    client: BatchClient,
+    job: BatchJob,
+    statuses: List[BatchStatus]
+) -> Dict[str, Tuple[bool, Dict, str]]:
+    """
+    終了したバッチの結果ファイルを取り込む
+
+    Args:
+        processor: レシート処理クラス
+        client: バッチAPIの操作
+        job: 記録
+        statuses: refresh が返した状態（すべて終了状態であること）
+
+    Returns:
+        custom_id → (成功フラグ, 経費データ, メッセージ)（送信せずに確定したものを含む）
+    """
+    lines: List[str] = []
+    for status in statuses:
+        for file_id in (status.output_file_id, status.error_file_id):
+            if file_id:
+                lines.extend(client.download(file_id).splitlines())
+
+    results = {custom_id: tuple(result) for custom_id, result in job.state["resolved"].items()}
+    results.update(processor.read_batch_results(lines, job.state["requests"]))
+    return results
+
+
+def create_client(local: bool) -> BatchClient:
+    """バッチAPIの操作を作成（--local の場合はローカル代替）"""
+    if local:
+        processing_time = float(os.getenv("LOCAL_BATCH_PROCESSING_TIME", "5"))
+        return LocalBatchClient(processing_time=processing_time)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OpenAI APIキーが設定されていません")
+    return OpenAIBatchClient(api_key)
+
+
+def create_processor(local: bool, use_cache: bool, duplicate_index: DuplicateIndex) -> ReceiptProcessor:
+    """リクエストの作成・結果の解析に使うレシート処理クラス（APIは呼ばない）"""
+    return ReceiptProcessor(
+        api_key="local-batch" if local else None,
+        cache=ReceiptCache(".cache/receipts") if use_cache else None,
+        preprocessor=ImagePreprocessor(),
+        duplicate_index=duplicate_index
+    )
+
+
+def print_statuses(statuses: List[BatchStatus]):
+    """バッチごとの状態を表示"""
+    for status in statuses:
+        mark = "✅" if status.status == "completed" else ("❌" if status.status in TERMINAL_STATUSES else "⏳")
+        print(f"  {mark} {status.batch_id}: {status.status}（完了 {status.completed} / 失敗 {status.failed} / 全 {status.total}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バッチAPIによる夜間一括取り込み")
+    parser.add_argument("--state", default="batch_job.json", help="投入したバッチジョブの記録ファイル")
+    parser.add_argument("--local", action="store_true", help="バッチAPIのローカル代替を使う（投入時のみ指定）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="リクエストファイルを作成してバッチジョブを投入")
+    submit_parser.add_argument("sources", nargs="*", help="レシート画像、またはそれらを含むディレクトリ")
+    submit_parser.add_argument("--manifest", help="処理対象のパスを1行1件で列挙したファイル")
+    submit_parser.add_argument("--chunk-size", type=int, default=250,
+                               help="1つのリクエストファイルに入れる画像の枚数（ファイルサイズ200MBの上限に収める）")
+    submit_parser.add_argument("--no-cache", action="store_true", help="抽出結果キャッシュを使わない")
+    submit_parser.add_argument("--force", action="store_true", help="結果を取り込んでいない前回のジョブの記録を上書きする")
+
+    subparsers.add_parser("status", help="バッチジョブの状態を表示")
+
+    collect_parser = subparsers.add_parser("collect", help="結果を取り込んでExcelへ一括登録")
+    collect_parser.add_argument("--excel", help="登録先のExcelファイル（なければテンプレートから作成）")
+    collect_parser.add_argument("--results", default="batch_results.jsonl", help="結果を記録するJSONLファイル")
+    collect_parser.add_argument("--wait", action="store_true", help="すべてのバッチが終了するまで待つ")
+    collect_parser.add_argument("--poll-interval", type=float, default=60.0, help="--wait 時の確認間隔（秒）")
+    args = parser.parse_args()
+
+    load_dotenv()
+    job = BatchJob(args.state)
+    duplicate_index = DuplicateIndex(DUPLICATE_INDEX_PATH)
+
+    if args.command == "submit":
+        if not args.sources and not args.manifest:
+            parser.error("処理対象（ディレクトリ・ファイル・--manifest）を指定してください")
+        paths = list(iter_source_files(args.sources, args.manifest))
+        image_paths = [str(path) for path in paths if path.suffix.lower() in IMAGE_EXTENSIONS]
+        if len(image_paths) < len(paths):
+            print(f"⚠️  PDF {len(paths) - len(image_paths)}件はバッチの対象外です（bulk_ingest.py で取り込んでください）")
+
+        # 取り込む前に記録を上書きすると、投入済み（課金済み）のバッチの結果を取り出せなくなる
+        if job.state_path.exists() and not args.force:
+            try:
+                overwritable = job.load().finished
+            except ValueError:
+                overwritable = False  # 読めない記録も黙って上書きしない
+            if not overwritable:
+                print(f"❌ 結果を取り込んでいないバッチジョブがあります: {job.state_path}")
+                print("   collect で取り込むか、破棄してよい場合は --force を付けて再実行してください")
+                return 1
+
+        print(f"📦 {len(image_paths)}件のリクエストファイルを作成して投入します")
+        with create_processor(args.local, not args.no_cache, duplicate_index) as processor:
+            submit(processor, create_client(args.local), image_paths, job, args.chunk_size, args.local)
+
+        resolved = len(job.state["resolved"])
+        print(f"\n✅ 投入しました: バッチ {len(job.state['batches'])}件 / リクエスト {len(job.state['requests'])}件"
+              f"（送信不要 {resolved}件） → {job.state_path}")
+        return 0
+
+    job.load()
+    client = create_client(job.state["local"])
+    statuses = refresh(client, job)
+
+    if args.command == "status":
+        print_statuses(statuses)
+        return 0
+
+    if job.state["collected"]:
+        print("✅ 取り込み済みです")
+        return 0
+
+    while args.wait and any(status.status not in TERMINAL_STATUSES for status in statuses):
+        time.sleep(args.poll_interval)
+        statuses = refresh(client, job)
+
+    print_statuses(statuses)
+    if any(status.status not in TERMINAL_STATUSES for status in statuses):
+        print("\n⏳ 処理中のバッチがあります。終了後にもう一度実行してください")
+        return 2
+
+    with create_processor(job.state["local"], True, duplicate_index) as processor:
+        results = collect(processor, client, job, statuses)
+
+    paths = job.state["paths"]
+    with open(args.results, "w", encoding="utf-8") as f:
+        for custom_id in sorted(results):
+            success, data, message = results[custom_id]
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "path": paths.get(custom_id),
+                "success": success,
+                "data": data,
+                "message": message
+            }, ensure_ascii=False) + "\n")
+
+    job.state["results_path"] = str(Path(args.results).resolve())
+    job.save()
+
+    succeeded = [custom_id for custom_id in sorted(results) if results[custom_id][0]]
+    failed = len(results) - len(succeeded)
+    print(f"\n📥 取り込み: 成功 {len(succeeded)}件 / 失敗 {failed}件 → {args.results}")
+
+    if args.excel and succeeded:
+        excel_path = Path(args.excel)
+        if not excel_path.exists():
+            shutil.copy(DEFAULT_TEMPLATE, excel_path)
+            print(f"📄 新規ファイルを作成しました: {excel_path.name}")
+
+        entries = [results[custom_id][1] for custom_id in succeeded]
+        writer = get_writer(str(excel_path))
+        try:
+            written = writer.add_expense_entries(entries)
+        finally:
+            writer.close()
+        # Excelに登録できた明細だけを重複の索引に登録
+        duplicate_index.add_entries(entry for entry, (success, _) in zip(entries, written) if success)
+        rejected = [message for success, message in written if not success]
+        print(f"📊 Excelに{len(written) - len(rejected)}件を登録しました: {excel_path.name}")
+        for message in rejected[:10]:
+            print(f"  ❌ {message}")
+
+        # 再実行で二重に登録しないように記録
+        job.state["collected"] = True
+        job.save()
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
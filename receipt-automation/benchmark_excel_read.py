@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Excel読み込みのベンチマーク
+通常モード（読み書き）と読み取り専用モードの読み込み時間・ピークメモリを比較
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from excel_handler import ExpenseExcelHandler
+
+DEFAULT_EXCEL = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+
+def peak_rss_mb() -> float:
+    """このプロセスのピークRSS（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_once(excel_path: str, read_only: bool) -> dict:
+    """1回分の読み込み（子プロセス内で実行）"""
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+
+    handler = ExpenseExcelHandler(excel_path)
+    handler.load(read_only=read_only)
+    entries = handler.get_existing_entries()
+    total = handler.get_total_amount()
+    handler.close()
+
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - baseline,
+        "entries": len(entries),
+        "total": total
+    }
+
+
+def measure(excel_path: str, read_only: bool, repeat: int) -> dict:
+    """ピークRSSを独立に測るため、モードごとに別プロセスで計測"""
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, __file__, excel_path, "--child", "read_only" if read_only else "full"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).resolve().parent
+        ).stdout
+        results.append(json.loads(output))
+
+    return {
+        "seconds": min(r["seconds"] for r in results),
+        "peak_rss_mb": max(r["peak_rss_mb"] for r in results),
+        "rss_growth_mb": max(r["rss_growth_mb"] for r in results),
+        "entries": results[0]["entries"],
+        "total": results[0]["total"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel読み込みのベンチマーク")
+    parser.add_argument("excel", nargs="?", default=str(DEFAULT_EXCEL), help="Excelファイルのパス")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最速値を採用）")
+    parser.add_argument("--child", choices=["full", "read_only"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_once(args.excel, args.child == "read_only")))
+        return
+
+    print("=" * 60)
+    print(f"📊 Excel読み込みベンチマーク: {Path(args.excel).name}")
+    print("=" * 60)
+
+    full = measure(args.excel, read_only=False, repeat=args.repeat)
+    fast = measure(args.excel, read_only=True, repeat=args.repeat)
+
+    for label, result in [("通常モード", full), ("読み取り専用", fast)]:
+        print(f"\n{label}:")
+        print(f"  読み込み時間: {result['seconds'] * 1000:,.1f} ms")
+        print(f"  ピークRSS:    {result['peak_rss_mb']:,.1f} MB（増加分 {result['rss_growth_mb']:,.1f} MB）")
+        print(f"  明細件数: {result['entries']}件 / 合計: ¥{result['total']:,.0f}")
+
+    if full["entries"] != fast["entries"] or full["total"] != fast["total"]:
+        print("\n❌ 読み込み結果が一致しません")
+        sys.exit(1)
+
+    print(f"\n⚡ 高速化: {full['seconds'] / fast['seconds']:.1f}倍")
+
+
+if __name__ == "__main__":
+    main()
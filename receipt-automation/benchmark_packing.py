@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+複数画像のまとめ送信のベンチマーク
+1枚ずつのリクエスト（process_receipts）と、数枚ずつ1リクエストにまとめた場合（process_receipts_packed）を比較
+
+リクエスト数・入力/出力トークン数の合計・全体の所要時間・失敗数を計測する。
+既定ではモックサーバーを使い、--api を付けると実APIで計測する（課金あり）
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from PIL import Image, ImageOps
+
+from image_preprocessor import ImagePreprocessor
+from metrics import Metrics
+from receipt_processor import ReceiptProcessor
+
+DEFAULT_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+
+
+def make_variants(image_path: str, count: int, output_dir: Path) -> List[str]:
+    """
+    サンプル画像から少しずつ異なる画像を作成（同じ画像の繰り返しにならないようにする）
+
+    Args:
+        image_path: 元画像のパス
+        count: 作成する枚数
+        output_dir: 出力先ディレクトリ
+
+    Returns:
+        作成した画像のパス
+    """
+    paths = []
+    with Image.open(image_path) as source:
+        source = source.convert("RGB")
+        for index in range(count):
+            # 余白の幅を変えて、内容は同じで画素の異なる画像にする
+            variant = ImageOps.expand(source, border=index % 8 + 1, fill=(255, 255, 255))
+            if index >= 8:
+                variant = variant.rotate(0.5 * (index // 8), expand=True, fillcolor=(255, 255, 255))
+            path = output_dir / f"receipt_{index:03d}.png"
+            variant.save(path)
+            paths.append(str(path))
+    return paths
+
+
+def measure(processor: ReceiptProcessor, run: Callable[[], List]) -> Dict:
+    """
+    一括処理を1回実行し、リクエスト数・トークン数・所要時間・失敗数を集計
+
+    Args:
+        processor: 計測対象（metrics にイベントを記録するもの）
+        run: 一括処理を実行する関数
+
+    Returns:
+        集計結果
+    """
+    events: List[Dict] = []
+    processor.metrics.add_hook(events.append)
+
+    start = time.perf_counter()
+    results = run()
+    elapsed = time.perf_counter() - start
+
+    def values(name: str) -> List[float]:
+        return [event["value"] for event in events if event["name"] == name]
+
+    latencies = values("api")
+    return {
+        "images": len(results),
+        "requests": len(latencies),
+        "failures": sum(not success for success, _, _ in results),
+        "prompt_tokens": sum(values("prompt_tokens")),
+        "completion_tokens": sum(values("completion_tokens")),
+        "api_p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "wall_s": elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数画像のまとめ送信のベンチマーク")
+    parser.add_argument("images", nargs="*", help="レシート画像のパス（省略時はサンプル画像から作成）")
+    parser.add_argument("--count", type=int, default=32, help="サンプル画像から作成する枚数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行するAPIリクエスト数の上限")
+    parser.add_argument("--token-budget", type=int, help="1リクエストあたりの入力トークン数の上限")
+    parser.add_argument("--max-images", type=int, help="1リクエストあたりの画像の枚数の上限")
+    parser.add_argument("--api", action="store_true", help="実APIで計測する（課金あり）")
+    parser.add_argument("--output", help="結果の出力先（JSON）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"📊 複数画像のまとめ送信のベンチマーク（{'実API' if args.api else 'モックAPI'}）")
+    print("=" * 60)
+
+    server = None
+    options: Dict = {"preprocessor": ImagePreprocessor()}
+    if args.api:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        from mock_server import MockConfig, MockServer
+        from openai_client import ClientConfig
+
+        # 最初の断片までの遅延と、出力の長さに比例する生成時間を模擬
+        server = MockServer(config=MockConfig(latency=0.3, chunk_interval=0.005, seed=0)).start()
+        options.update(api_key="benchmark", client_config=ClientConfig(base_url=server.base_url))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        images = args.images or make_variants(str(DEFAULT_IMAGE), args.count, Path(temp_dir))
+        print(f"画像: {len(images)}枚 / 同時実行数: {args.concurrency}")
+
+        runs = {
+            "single": lambda processor: processor.process_receipts(images, args.concurrency),
+            "packed": lambda processor: processor.process_receipts_packed(
+                images, args.concurrency, args.token_budget, args.max_images
+            )
+        }
+        try:
+            for label, run in runs.items():
+                with ReceiptProcessor(metrics=Metrics(), **options) as processor:
+                    results[label] = measure(processor, lambda: run(processor))
+        finally:
+            if server is not None:
+                server.stop()
+
+    print(f"\n{'':<10}{'リクエスト':>10}{'入力tok':>10}{'出力tok':>10}{'p50 ms':>10}{'全体 s':>10}{'失敗':>8}")
+    for label, result in results.items():
+        print(
+            f"{label:<10}{result['requests']:>10}{result['prompt_tokens']:>10.0f}"
+            f"{result['completion_tokens']:>10.0f}{result['api_p50_ms']:>10.1f}{result['wall_s']:>10.2f}"
+            f"{result['failures']:>5}/{result['images']}"
+        )
+
+    single, packed = results["single"], results["packed"]
+    if single["prompt_tokens"] and single["wall_s"]:
+        print(f"\n入力トークンの削減率: {100 * (1 - packed['prompt_tokens'] / single['prompt_tokens']):.1f}%")
+        print(f"全体の所要時間の短縮率: {100 * (1 - packed['wall_s'] / single['wall_s']):.1f}%")
+
+    if args.output:
+        report = {"created_at": datetime.now().isoformat(timespec="seconds"), "api": args.api, "results": results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+画像前処理のベンチマーク
+元画像をそのまま送る場合と前処理後に送る場合を比較
+"""
+
+import argparse
+import base64
+import time
+from pathlib import Path
+
+from image_preprocessor import ImagePreprocessor
+
+DEFAULT_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+FIELDS = ["date", "payee", "content", "amount"]
+
+
+def measure_payload(image_path: str, preprocessor: ImagePreprocessor, repeat: int):
+    """ペイロードサイズと前処理時間を計測"""
+    raw = Path(image_path).read_bytes()
+    raw_b64 = base64.b64encode(raw)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        prepared = preprocessor.prepare_file(image_path)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    prepared_b64 = base64.b64encode(prepared.data)
+
+    print("\n📦 ペイロード")
+    print(f"  元画像:   {len(raw):>10,} B（base64: {len(raw_b64):,} B）")
+    print(f"  前処理後: {len(prepared.data):>10,} B（base64: {len(prepared_b64):,} B）")
+    print(f"  削減率:   {100 * (1 - len(prepared_b64) / len(raw_b64)):.1f}%")
+    print(f"  出力: {prepared.width}x{prepared.height} {prepared.mime_type} "
+          f"quality={prepared.quality} detail={prepared.detail}")
+    print(f"  前処理時間: {elapsed_ms:.1f} ms/回")
+
+
+def measure_api(image_path: str, preprocessor: ImagePreprocessor):
+    """実APIでレイテンシと抽出結果の一致度を比較（課金あり）"""
+    from dotenv import load_dotenv
+    from receipt_processor import ReceiptProcessor
+
+    load_dotenv()
+    results = {}
+    for label, prep in [("元画像", None), ("前処理後", preprocessor)]:
+        processor = ReceiptProcessor(preprocessor=prep)
+        start = time.perf_counter()
+        success, data, message = processor.extract_receipt_info(image_path)
+        elapsed = time.perf_counter() - start
+        results[label] = data
+        status = "✅" if success else f"❌ {message}"
+        print(f"  {label}: {elapsed:.2f} 秒 {status}")
+
+    raw, prepared = results["元画像"], results["前処理後"]
+    matched = [f for f in FIELDS if raw.get(f) == prepared.get(f)]
+    print(f"  一致フィールド: {len(matched)}/{len(FIELDS)} ({', '.join(matched) or 'なし'})")
+    for field in FIELDS:
+        if field not in matched:
+            print(f"    {field}: {raw.get(field)!r} ≠ {prepared.get(field)!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画像前処理のベンチマーク")
+    parser.add_argument("image", nargs="?", default=str(DEFAULT_IMAGE), help="レシート画像のパス")
+    parser.add_argument("--repeat", type=int, default=5, help="前処理の計測回数")
+    parser.add_argument("--max-long-edge", type=int, default=2048)
+    parser.add_argument("--target-kb", type=int, default=500)
+    parser.add_argument("--min-quality", type=int, default=50)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--color", action="store_true", help="グレースケール変換しない")
+    parser.add_argument("--api", action="store_true", help="実APIでレイテンシと一致度も計測する")
+    args = parser.parse_args()
+
+    preprocessor = ImagePreprocessor(
+        max_long_edge=args.max_long_edge,
+        grayscale=not args.color,
+        output_format=args.format,
+        target_bytes=args.target_kb * 1024,
+        min_quality=args.min_quality
+    )
+
+    print("=" * 60)
+    print(f"📊 画像前処理ベンチマーク: {args.image}")
+    print("=" * 60)
+
+    measure_payload(args.image, preprocessor, args.repeat)
+
+    if args.api:
+        print("\n⏱️  API レイテンシ")
+        measure_api(args.image, preprocessor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+抽出プロンプトのベンチマーク
+以前の自由記述プロンプト（```json を探して解析）と、現在の構造化出力（JSONスキーマ指定）を比較
+
+出力トークン数・入力トークン数・APIレイテンシ（中央値/95パーセンタイル）・解析失敗数を計測する。
+既定ではモックサーバーを使い、--api を付けると実APIで計測する（課金あり）
+"""
+
+import argparse
+import json
+import statistics
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from metrics import Metrics
+from receipt_processor import ReceiptProcessor
+
+DEFAULT_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+
+
+class LegacyPromptProcessor(ReceiptProcessor):
+    """構造化出力を導入する前のプロンプト・解析（比較用）"""
+
+    PROMPT_VERSION = "1"
+
+    SYSTEM_PROMPT = """あなたはレシート情報抽出の専門家です。
+レシート画像から以下の情報を正確に抽出してJSON形式で返してください。
+
+必須フィールド:
+- date: 日付（YYYY/MM/DD形式）
+- payee: 支払先/店舗名
+- content: 支払内容/品目（複数ある場合はカンマ区切り）
+- amount: 合計金額（数値のみ）
+
+注意事項:
+- 日付が不明な場合は今日の日付を使用
+- 金額は消費税込みの合計金額を抽出
+- 支払先は正式な店舗名を使用
+- 支払内容は簡潔に（例: 文房具、交通費、飲食費など）"""
+
+    USER_PROMPT = "このレシートから日付、支払先、支払内容、金額を抽出してJSON形式で返してください。"
+
+    def _build_request(self, base64_image: str, mime_type: str, detail: str) -> Dict:
+        request = super()._build_request(base64_image, mime_type, detail)
+        del request["response_format"]
+        request["max_tokens"] = 500
+        return request
+
+    def _parse_response(self, response_text: str) -> Tuple[bool, Dict, str]:
+        # JSONブロックを抽出（```json ... ``` の中身）
+        if "```json" in response_text:
+            json_start = response_text.find("```json") + 7
+            json_end = response_text.find("```", json_start)
+            json_text = response_text[json_start:json_end].strip()
+        elif "```" in response_text:
+            json_start = response_text.find("```") + 3
+            json_end = response_text.find("```", json_start)
+            json_text = response_text[json_start:json_end].strip()
+        else:
+            json_text = response_text
+
+        try:
+            record = self._to_record(json.loads(json_text))
+        except ValueError as e:
+            return False, {}, str(e)
+        return True, record._asdict(), ""
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    """パーセンタイル（最近傍法）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(ratio * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(processor: ReceiptProcessor, images: List[str], repeat: int) -> Dict:
+    """
+    画像を順に抽出し、トークン数・レイテンシ・失敗数を集計
+
+    Args:
+        processor: 計測対象（metrics にイベントを記録するもの）
+        images: 画像ファイルのパス
+        repeat: 各画像の抽出回数
+
+    Returns:
+        集計結果
+    """
+    events: List[Dict] = []
+    processor.metrics.add_hook(events.append)
+
+    failures = 0
+    for _ in range(repeat):
+        for image_path in images:
+            success, _, _ = processor.extract_receipt_info(image_path)
+            failures += not success
+
+    def values(name: str) -> List[float]:
+        return [event["value"] for event in events if event["name"] == name]
+
+    latencies = [value * 1000 for value in values("api")]
+    return {
+        "requests": len(latencies),
+        "failures": failures,
+        "prompt_tokens": statistics.mean(values("prompt_tokens") or [0]),
+        "completion_tokens": statistics.mean(values("completion_tokens") or [0]),
+        "api_p50_ms": statistics.median(latencies),
+        "api_p95_ms": percentile(latencies, 0.95)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抽出プロンプトのベンチマーク")
+    parser.add_argument("images", nargs="*", default=[str(DEFAULT_IMAGE)], help="レシート画像のパス")
+    parser.add_argument("--repeat", type=int, default=5, help="各画像の抽出回数")
+    parser.add_argument("--api", action="store_true", help="実APIで計測する（課金あり）")
+    parser.add_argument("--output", help="結果の出力先（JSON）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"📊 抽出プロンプトのベンチマーク（{'実API' if args.api else 'モックAPI'}）")
+    print("=" * 60)
+
+    server = None
+    options: Dict = {}
+    if args.api:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        from mock_server import MockConfig, MockServer
+        from openai_client import ClientConfig
+
+        server = MockServer(config=MockConfig(latency=0.05, seed=0)).start()
+        options = {"api_key": "benchmark", "client_config": ClientConfig(base_url=server.base_url)}
+
+    results = {}
+    try:
+        for label, processor_class in [("legacy", LegacyPromptProcessor), ("structured", ReceiptProcessor)]:
+            with processor_class(metrics=Metrics(), **options) as processor:
+                results[label] = measure(processor, args.images, args.repeat)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(f"\n{'':<12}{'出力tok':>10}{'入力tok':>10}{'p50 ms':>10}{'p95 ms':>10}{'失敗':>8}")
+    for label, result in results.items():
+        print(
+            f"{label:<12}{result['completion_tokens']:>10.1f}{result['prompt_tokens']:>10.1f}"
+            f"{result['api_p50_ms']:>10.1f}{result['api_p95_ms']:>10.1f}"
+            f"{result['failures']:>5}/{result['requests']}"
+        )
+
+    legacy, structured = results["legacy"], results["structured"]
+    if legacy["completion_tokens"]:
+        reduction = 1 - structured["completion_tokens"] / legacy["completion_tokens"]
+        print(f"\n出力トークンの削減率: {100 * reduction:.1f}%")
+
+    if args.output:
+        report = {"created_at": datetime.now().isoformat(timespec="seconds"), "api": args.api, "results": results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
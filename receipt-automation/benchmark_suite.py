@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+レシート → Excel パイプラインのベンチマーク
+同梱のサンプル画像・PDF・テンプレートを使い、APIはモックサーバーで代替する
+
+結果はJSONに保存し、ベースラインと比較して閾値を超えて遅くなった項目があれば終了コード1を返す
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from duplicate_index import DuplicateIndex
+from excel_handler import ExpenseExcelHandler
+from image_preprocessor import ImagePreprocessor
+from mock_server import MockConfig, MockServer
+from openai_client import ClientConfig
+from pdf_renderer import PdfRenderer
+from receipt_processor import ReceiptProcessor
+
+APP_DIR = Path(__file__).resolve().parent
+REPO_DIR = APP_DIR.parent
+SAMPLE_IMAGE = REPO_DIR / "receipt_sample_20251203.png"
+SAMPLE_PDFS = sorted(REPO_DIR.glob("立替経費精算書_*.pdf"))
+TEMPLATE = APP_DIR / "templates" / "立替経費精算書.xlsx"
+
+SAMPLE_RESPONSE = '{"date": "2025/12/03", "payee": "業務スーパー金町店（シマダヤ）", "content": "業務用みそ汁", "amount": 3330}'
+
+
+class BenchmarkRunner:
+    """計測と結果の集計"""
+
+    def __init__(self, scale: float = 1.0):
+        """
+        初期化
+
+        Args:
+            scale: 繰り返し回数の倍率（--quick で小さくする）
+        """
+        self.scale = scale
+        self.results: Dict[str, Dict] = {}
+
+    def run(self, name: str, func: Callable[[], object], repeat: int, warmup: int = 1):
+        """
+        関数を繰り返し実行して所要時間を記録
+
+        Args:
+            name: ベンチマーク名
+            func: 計測対象（引数なし）
+            repeat: 計測回数
+            warmup: 計測前の空実行回数
+        """
+        repeat = max(1, int(repeat * self.scale))
+        for _ in range(warmup):
+            func()
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+        self.results[name] = {
+            "repeat": repeat,
+            "median_ms": statistics.median(timings) * 1000,
+            "min_ms": min(timings) * 1000,
+            "max_ms": max(timings) * 1000
+        }
+        print(f"  {name:<32} {self.results[name]['median_ms']:>10.2f} ms（中央値, n={repeat}）", flush=True)
+
+
+def bench_image(runner: BenchmarkRunner, processor: ReceiptProcessor):
+    """画像のバリデーション・エンコード・前処理"""
+    print("\n🖼️  画像")
+    image_path = str(SAMPLE_IMAGE)
+    preprocessor = ImagePreprocessor()
+
+    runner.run("validate_image", lambda: processor.validate_image(image_path), repeat=50)
+    runner.run("encode_image", lambda: processor.encode_image(image_path), repeat=50)
+    runner.run("preprocess_image", lambda: preprocessor.prepare_file(image_path), repeat=10)
+
+
+def bench_parse(runner: BenchmarkRunner, processor: ReceiptProcessor):
+    """レスポンスの解析・正規化"""
+    print("\n🧾 レスポンス解析")
+    runner.run("parse_response", lambda: processor._parse_response(SAMPLE_RESPONSE), repeat=2000)
+
+
+def bench_extract(runner: BenchmarkRunner, processor: ReceiptProcessor):
+    """モックサーバー経由の抽出（通信・リトライ経路を含む）"""
+    print("\n🔌 抽出（モックAPI）")
+    image_path = str(SAMPLE_IMAGE)
+
+    def extract():
+        success, _, message = processor.extract_receipt_info(image_path)
+        if not success:
+            raise RuntimeError(message)
+
+    runner.run("extract_receipt_info", extract, repeat=20)
+    runner.run(
+        "process_receipts_x20",
+        lambda: processor.process_receipts([image_path] * 20, concurrency=8),
+        repeat=3
+    )
+
+
+def bench_dedup(runner: BenchmarkRunner, work_dir: str):
+    """重複検出（知覚ハッシュの計算と索引の検索）"""
+    print("\n🔁 重複検出")
+    index = DuplicateIndex(str(Path(work_dir) / "duplicates.jsonl"))
+    image_bytes = SAMPLE_IMAGE.read_bytes()
+
+    rng = random.Random(0)
+    for _ in range(20000):
+        index._tree.add(rng.getrandbits(64), {"data": {}})
+    target = index.compute_hash(image_bytes)
+
+    runner.run("dedup_hash", lambda: index.compute_hash(image_bytes), repeat=20)
+    runner.run("dedup_find_20k", lambda: index.find(target), repeat=200)
+
+
+def bench_excel(runner: BenchmarkRunner, work_dir: str):
+    """Excelの読み込み・明細取得・保存"""
+    print("\n📊 Excel")
+    work_file = Path(work_dir) / "bench.xlsx"
+    shutil.copy(TEMPLATE, work_file)
+
+    def load_full():
+        handler = ExpenseExcelHandler(str(work_file))
+        handler.load()
+        handler.close()
+
+    def load_read_only():
+        handler = ExpenseExcelHandler(str(work_file))
+        handler.load(read_only=True)
+        handler.close()
+
+    runner.run("excel_load", load_full, repeat=3, warmup=0)
+    runner.run("excel_load_read_only", load_read_only, repeat=20)
+
+    handler = ExpenseExcelHandler(str(work_file))
+    handler.load()
+    runner.run("excel_get_existing_entries", handler.get_existing_entries, repeat=200)
+    runner.run("excel_save", lambda: handler.save(str(Path(work_dir) / "bench_out.xlsx")), repeat=3, warmup=0)
+    handler.close()
+
+    # 変更したシートのXMLだけを書き換える保存
+    fast = ExpenseExcelHandler(str(work_file), fast_save=True)
+    fast.load()
+    fast.add_expense_entry("2025/12/03", "ベンチマーク", "テスト", 1000)
+    runner.run("excel_save_fast", lambda: fast.save(str(Path(work_dir) / "bench_fast.xlsx")), repeat=20)
+    fast.close()
+
+
+def bench_pdf(runner: BenchmarkRunner):
+    """PDFページの描画"""
+    print("\n📄 PDF")
+    with PdfRenderer() as renderer:
+        for index, pdf_path in enumerate(SAMPLE_PDFS, start=1):
+            runner.run(
+                f"pdf_render_all_pages_{index}",
+                lambda: list(renderer.render(str(pdf_path))),
+                repeat=5
+            )
+
+
+def compare(
+    results: Dict[str, Dict],
+    baseline: Dict[str, Dict],
+    threshold: float,
+    min_delta_ms: float
+) -> List[str]:
+    """
+    ベースラインと比較して遅くなった項目を列挙
+
+    Args:
+        results: 今回の結果
+        baseline: ベースラインの結果
+        threshold: 許容する悪化率（0.2 = 20%）
+        min_delta_ms: 悪化とみなす最小の差（ミリ秒）。計測誤差で数μsの処理が引っかかるのを防ぐ
+
+    Returns:
+        悪化した項目の説明のリスト
+    """
+    regressions = []
+    print(f"\n📈 ベースラインとの比較（閾値 +{threshold * 100:.0f}%）")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ms"]
+        after = result["median_ms"]
+        ratio = after / before if before > 0 else 1.0
+        regressed = ratio > 1 + threshold and after - before > min_delta_ms
+        mark = "❌" if regressed else "✅"
+        print(f"  {mark} {name:<32} {before:>10.2f} → {after:>10.2f} ms（{(ratio - 1) * 100:+.1f}%）")
+        if regressed:
+            regressions.append(f"{name}: {before:.2f} → {after:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レシート → Excel パイプラインのベンチマーク")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果の出力先（JSON）")
+    parser.add_argument("--baseline", help="比較対象のベンチマーク結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="許容する悪化率（0.2 = 20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="悪化とみなす最小の差（ミリ秒）")
+    parser.add_argument("--quick", action="store_true", help="繰り返し回数を減らして短時間で実行")
+    parser.add_argument(
+        "--only", nargs="+", choices=["image", "parse", "extract", "dedup", "excel", "pdf"],
+        help="実行するグループを限定"
+    )
+    args = parser.parse_args()
+
+    groups = set(args.only or ["image", "parse", "extract", "dedup", "excel", "pdf"])
+    runner = BenchmarkRunner(scale=0.2 if args.quick else 1.0)
+
+    print("=" * 60)
+    print("⏱️  パイプラインベンチマーク")
+    print("=" * 60)
+
+    with MockServer(config=MockConfig(seed=0)) as server, tempfile.TemporaryDirectory() as work_dir:
+        processor = ReceiptProcessor(
+            api_key="benchmark",
+            client_config=ClientConfig(base_url=server.base_url)
+        )
+        try:
+            if "image" in groups:
+                bench_image(runner, processor)
+            if "parse" in groups:
+                bench_parse(runner, processor)
+            if "extract" in groups:
+                bench_extract(runner, processor)
+            if "dedup" in groups:
+                bench_dedup(runner, work_dir)
+            if "excel" in groups:
+                bench_excel(runner, work_dir)
+            if "pdf" in groups:
+                bench_pdf(runner)
+        finally:
+            processor.close()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": runner.results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(runner.results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n❌ {len(regressions)}件の性能劣化を検出しました")
+            return 1
+        print("\n✅ 性能劣化はありません")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
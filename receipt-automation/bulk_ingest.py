@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+レシート一括取り込みツール
+ディレクトリまたはマニフェストのレシート画像・PDFを並行処理し、結果を追記専用のジャーナルに記録
+
+中断後に再実行すると、ジャーナルに記録済みのものはスキップして続きから処理する
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from receipt_processor import ReceiptProcessor
+from receipt_cache import ReceiptCache
+from image_preprocessor import ImagePreprocessor
+from pdf_renderer import PdfRenderer
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".heic"}
+PDF_EXTENSIONS = {".pdf"}
+
+
+class IngestItem:
+    """処理単位（画像1枚、またはPDFの1ページ）"""
+
+    def __init__(self, path: Path, page: Optional[int] = None, error: Optional[str] = None):
+        self.path = path
+        self.page = page
+        # ページに展開できなかったPDF（破損・暗号化など）の理由。処理せず失敗として記録する
+        self.error = error
+
+    @property
+    def item_id(self) -> str:
+        """ジャーナル上の識別子"""
+        if self.page is None:
+            return str(self.path)
+        return f"{self.path}#page={self.page}"
+
+
+class Journal:
+    """追記専用のJSONLジャーナル"""
+
+    def __init__(self, journal_path: str):
+        """
+        初期化
+
+        Args:
+            journal_path: ジャーナルファイルのパス
+        """
+        self.journal_path = Path(journal_path)
+        self._file = None
+
+    def load(self) -> Dict[str, Dict]:
+        """
+        記録済みの結果を読み込む
+
+        クラッシュで最終行が途中まで書かれている場合や、識別子のない行は読み飛ばす
+
+        Returns:
+            識別子 -> 最新の記録
+        """
+        records = {}
+        if not self.journal_path.exists():
+            return records
+
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or "id" not in record:
+                    continue
+                records[record["id"]] = record
+        return records
+
+    def append(self, record: Dict):
+        """
+        1件追記してディスクへ書き出す
+
+        Args:
+            record: 記録内容
+        """
+        if self._file is None:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            # 途中で切れた行の後ろに続けて書かないよう改行を補う
+            if self._file.tell() > 0:
+                with open(self.journal_path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        self._file.write("\n")
+
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """ジャーナルを閉じる"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_source_files(sources: List[str], manifest: Optional[str]) -> Iterator[Path]:
+    """
+    処理対象ファイルを列挙
+
+    Args:
+        sources: ファイルまたはディレクトリのリスト（ディレクトリは再帰的に探索）
+        manifest: 1行1パスのマニフェストファイル
+
+    Yields:
+        対象ファイルのパス（ソート済み）
+    """
+    paths = set()
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.add(Path(line).resolve())
+
+    for source in sources:
+        source_path = Path(source)
+        if source_path.is_dir():
+            for path in source_path.rglob("*"):
+                if path.is_file():
+                    paths.add(path.resolve())
+        else:
+            paths.add(source_path.resolve())
+
+    supported = IMAGE_EXTENSIONS | PDF_EXTENSIONS
+    for path in sorted(paths):
+        if path.suffix.lower() in supported:
+            yield path
+
+
+def expand_items(paths: Iterator[Path]) -> List[IngestItem]:
+    """
+    ファイルを処理単位に展開（PDFはページごと）
+
+    Args:
+        paths: 対象ファイル
+
+    Returns:
+        処理単位のリスト（ページ数を取得できないPDFはエラー付きの1件）
+    """
+    items = []
+    for path in paths:
+        if path.suffix.lower() in PDF_EXTENSIONS:
+            try:
+                page_count = PdfRenderer.page_count(str(path))
+            except Exception as e:
+                # 1件の不正なPDFで取り込み全体を止めない
+                items.append(IngestItem(path, error=f"PDFを開けませんでした: {str(e)}"))
+                continue
+            items.extend(IngestItem(path, page) for page in range(1, page_count + 1))
+        else:
+            items.append(IngestItem(path))
+    return items
+
+
+def format_duration(seconds: float) -> str:
+    """秒数を 1時間2分 のような表記に変換"""
+    minutes = int(seconds // 60)
+    if minutes >= 60:
+        return f"{minutes // 60}時間{minutes % 60}分"
+    if minutes > 0:
+        return f"{minutes}分{int(seconds % 60)}秒"
+    return f"{int(seconds)}秒"
+
+
+async def run_ingest(
+    processor: ReceiptProcessor,
+    items: List[IngestItem],
+    journal: Journal,
+    concurrency: int
+) -> Tuple[int, int]:
+    """
+    処理単位を並行処理し、完了した順にジャーナルへ記録
+
+    Args:
+        processor: レシート処理クラス
+        items: 未処理の処理単位
+        journal: 記録先ジャーナル
+        concurrency: 同時実行数
+
+    Returns:
+        (成功件数, 失敗件数)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(item: IngestItem) -> Tuple[IngestItem, Tuple[bool, Dict, str]]:
+        async with semaphore:
+            try:
+                if item.error is not None:
+                    result = (False, {}, item.error)
+                elif item.page is None:
+                    result = await processor.process_receipt_to_expense_async(str(item.path))
+                else:
+                    # PDFのページはメモリ上で描画してそのまま抽出
+                    results = await processor.process_pdf_to_expenses_async(
+                        str(item.path), [item.page], concurrency=1
+                    )
+                    result = results[0]
+            except Exception as e:
+                result = (False, {}, f"予期しないエラー: {str(e)}")
+            return item, result
+
+    succeeded = failed = 0
+    start = time.monotonic()
+    total = len(items)
+    tasks = []
+
+    try:
+        tasks = [asyncio.create_task(worker(item)) for item in items]
+        for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+            item, (success, data, message) = await future
+            journal.append({
+                "id": item.item_id,
+                "path": str(item.path),
+                "page": item.page,
+                "success": success,
+                "data": data,
+                "message": message,
+                "processed_at": datetime.now().isoformat(timespec="seconds")
+            })
+
+            if success:
+                succeeded += 1
+            else:
+                failed += 1
+
+            elapsed = time.monotonic() - start
+            per_minute = done / elapsed * 60 if elapsed > 0 else 0.0
+            eta = (total - done) / (done / elapsed) if done and elapsed > 0 else 0.0
+            status = "✅" if success else f"❌ {message}"
+            print(
+                f"[{done}/{total}] {status} {item.item_id} "
+                f"| {per_minute:.1f}件/分 | 残り約{format_duration(eta)}",
+                flush=True
+            )
+    finally:
+        for task in tasks:
+            task.cancel()
+        await processor.backend.aclose()
+
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レシート画像・PDFの一括取り込み")
+    parser.add_argument("sources", nargs="*", help="レシート画像・PDF、またはそれらを含むディレクトリ")
+    parser.add_argument("--manifest", help="処理対象のパスを1行1件で列挙したファイル")
+    parser.add_argument("--journal", default="ingest_journal.jsonl", help="結果を記録するJSONLファイル")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に処理する件数")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗として記録済みのものも再処理する")
+    parser.add_argument("--no-cache", action="store_true", help="抽出結果キャッシュを使わない")
+    args = parser.parse_args()
+
+    if not args.sources and not args.manifest:
+        parser.error("処理対象（ディレクトリ・ファイル・--manifest）を指定してください")
+
+    load_dotenv()
+
+    journal = Journal(args.journal)
+    done_records = journal.load()
+    done_ids: Set[str] = {
+        item_id for item_id, record in done_records.items()
+        if record.get("success") or not args.retry_failed
+    }
+
+    items = expand_items(iter_source_files(args.sources, args.manifest))
+    pending = [item for item in items if item.item_id not in done_ids]
+
+    print("=" * 60)
+    print("📥 レシート一括取り込み")
+    print("=" * 60)
+    print(f"  対象: {len(items)}件（記録済み {len(items) - len(pending)}件をスキップ）")
+    print(f"  ジャーナル: {journal.journal_path}")
+    print(f"  同時実行数: {args.concurrency}")
+
+    if not pending:
+        print("\n✅ すべて処理済みです")
+        return 0
+
+    processor = ReceiptProcessor(
+        cache=None if args.no_cache else ReceiptCache(".cache/receipts"),
+        preprocessor=ImagePreprocessor()
+    )
+
+    start = time.monotonic()
+    try:
+        succeeded, failed = asyncio.run(run_ingest(processor, pending, journal, args.concurrency))
+    except KeyboardInterrupt:
+        print("\n⏸️  中断しました。再実行すると続きから処理します")
+        return 130
+    finally:
+        journal.close()
+        processor.close()
+
+    elapsed = time.monotonic() - start
+    print("\n" + "=" * 60)
+    print(f"🎉 完了: 成功 {succeeded}件 / 失敗 {failed}件（{format_duration(elapsed)}）")
+    print("=" * 60)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
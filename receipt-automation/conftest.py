@@ -0,0 +1,6 @@
+"""
+pytest の設定
+"""
+
+# APIキーを使って実際に接続を確認するスクリプト（python test_api.py で実行する）
+collect_ignore = ["test_api.py"]
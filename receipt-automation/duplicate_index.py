@@ -0,0 +1,218 @@
+"""
+重複レシート検出モジュール
+画像の知覚ハッシュ（dHash）をBK木に登録し、撮り直した同じレシートもハミング距離で検出する
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from image_preprocessor import ImageBuffer, open_buffer
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    差分ハッシュ（dHash）を計算
+
+    グレースケールの縮小画像で隣り合う画素の明暗を比較するため、
+    解像度・圧縮率・多少の明るさの違いに影響されにくい
+
+    Args:
+        image: PILの画像
+        hash_size: 1辺のビット数（8の場合は64ビット）
+
+    Returns:
+        ハッシュ値
+    """
+    # JPEGは縮小しながらデコードする（フル解像度で展開しない）
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    img = ImageOps.exif_transpose(image).convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = img.tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """ハミング距離（異なるビットの数）"""
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """ハミング距離のBK木（近いハッシュを全件走査せずに検索）"""
+
+    def __init__(self):
+        # ノード: [ハッシュ, 値のリスト, {距離: 子ノード}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value_hash: int, value):
+        """
+        ハッシュと値を登録
+
+        Args:
+            value_hash: ハッシュ値
+            value: 紐づける値
+        """
+        self._size += 1
+        if self._root is None:
+            self._root = [value_hash, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(value_hash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, value_hash: int, max_distance: int) -> List[Tuple[int, object]]:
+        """
+        距離が max_distance 以内の値を検索
+
+        Args:
+            value_hash: 検索するハッシュ値
+            max_distance: 許容するハミング距離
+
+        Returns:
+            (距離, 値) のリスト（距離の近い順）
+        """
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value_hash, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+            # 三角不等式により、この範囲の子だけを調べればよい
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+class DuplicateIndex:
+    """処理済みレシートの知覚ハッシュの索引（ファイルに永続化）"""
+
+    def __init__(self, path: str = ".cache/duplicates.jsonl", max_distance: int = 6):
+        """
+        初期化
+
+        Args:
+            path: 索引の保存先（JSONL、追記のみ）
+            max_distance: 重複とみなすハミング距離の上限（64ビット中）
+        """
+        self.path = Path(path)
+        self.max_distance = max_distance
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def _load(self):
+        """保存済みの索引を読み込む（壊れた行は読み飛ばす）"""
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._tree.add(int(record["hash"], 16), record)
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    def compute_hash(self, image_bytes: ImageBuffer) -> int:
+        """
+        画像の知覚ハッシュを計算
+
+        Args:
+            image_bytes: 画像のバイト列（bytes / memoryview）
+
+        Returns:
+            ハッシュ値
+        """
+        with Image.open(open_buffer(image_bytes)) as img:
+            return dhash(img)
+
+    def find(self, value_hash: int) -> Optional[Dict]:
+        """
+        最も近い登録済みレシートを検索
+
+        Args:
+            value_hash: ハッシュ値
+
+        Returns:
+            登録時の記録（hash, data, added_at）と distance を持つ辞書。見つからない場合はNone
+        """
+        with self._lock:
+            matches = self._tree.search(value_hash, self.max_distance)
+        if not matches:
+            return None
+        distance, record = matches[0]
+        return {**record, "distance": distance}
+
+    def add(self, value_hash: int, data: Dict):
+        """
+        処理済みレシートを登録
+
+        Args:
+            value_hash: ハッシュ値
+            data: 抽出データ（date, payee, content, amount）
+        """
+        record = {
+            "hash": f"{value_hash:016x}",
+            "data": {key: data.get(key) for key in ("date", "payee", "content", "amount")},
+            "added_at": datetime.now().isoformat(timespec="seconds")
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+
+        with self._lock:
+            self._tree.add(value_hash, record)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add_entries(self, entries: Iterable[Dict]):
+        """
+        Excelに登録した明細を登録（抽出時に付けた image_hash を持つものだけ）
+
+        Args:
+            entries: 登録した明細（date, payee, content, amount, image_hash）
+        """
+        for entry in entries:
+            if entry.get("image_hash") is not None:
+                self.add(int(entry["image_hash"]), entry)
+
+
+def describe_duplicate(match: Dict) -> str:
+    """重複候補の表示用文字列"""
+    data = match.get("data", {})
+    amount = data.get("amount")
+    amount_text = f"¥{amount:,.0f}" if isinstance(amount, (int, float)) else str(amount)
+    return f"{data.get('date')} {data.get('payee')} {amount_text}（{match.get('added_at', '')[:10]}登録）"
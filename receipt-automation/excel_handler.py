@@ -3,12 +3,26 @@ Excel操作モジュール
 立替経費精算書への明細追記機能
 """
 
+import io
 import openpyxl
+import os
+import sqlite3
+import tempfile
+import threading
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter, quote_sheetname
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+from ledger_index import LedgerIndex
+from metrics import Metrics, default_metrics
+from xlsx_patch import XlsxPatchError, patch_workbook, replace_file
+
+# 集計結果のキャッシュ: 解決済みパス -> ((更新時刻, サイズ), 集計結果)
+_summary_cache: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+_summary_lock = threading.Lock()
+
 
 class ExpenseExcelHandler:
     """立替経費精算書のExcel操作クラス"""
@@ -18,31 +32,95 @@ class ExpenseExcelHandler:
     DATA_START_ROW = 11
     DATA_END_ROW = 26
     TOTAL_ROW = 27
+    MAX_ENTRIES = DATA_END_ROW - DATA_START_ROW + 1
 
     # 列定義（マージされたセルの開始列）
     COL_DATE = 1      # A列: 日付
     COL_PAYEE = 5     # E列: 支払先
     COL_CONTENT = 13  # M列: 支払内容
     COL_AMOUNT = 23   # W列: 金額
-
-    def __init__(self, excel_path: str):
+    COL_NOTE = 30     # AD列: 備考
+
+    # 申請者欄（1ページ目の上部）
+    DATE_ROW = 3         # 申請日
+    COL_YEAR = 4         # D列: 年
+    COL_MONTH = 8        # H列: 月
+    COL_DAY = 12         # L列: 日
+    DEPARTMENT_ROW = 6   # 所属
+    APPLICANT_ROW = 7    # 氏名
+    COL_APPLICANT = 23   # W列
+
+    # 続きシートの名前（例: 立替経費精算書_続き2）
+    CONTINUATION_SUFFIX = "_続き"
+    MAX_SHEET_TITLE = 31
+
+    def __init__(
+        self,
+        excel_path: str,
+        overflow: bool = False,
+        metrics: Optional[Metrics] = None,
+        fast_save: bool = False,
+        ledger: Optional[LedgerIndex] = None
+    ):
         """
         初期化
 
         Args:
             excel_path: Excelファイルのパス
+            overflow: 明細行が満杯のとき、続きシートを自動で追加するか
+            metrics: 読み込み・保存の所要時間の計測先（Noneの場合は計測しない）
+            fast_save: 保存時に変更したセルを含むシートのXMLだけを書き換えるか
+                （ブック全体を再シリアライズしないため高速。続きシートの追加が必要になった場合は通常の保存に切り替える）
+            ledger: 保存した明細を複製する索引（Noneの場合は複製しない）
         """
         self.excel_path = Path(excel_path)
         if not self.excel_path.exists():
             raise FileNotFoundError(f"Excelファイルが見つかりません: {excel_path}")
 
+        self.overflow = overflow
+        self.fast_save = fast_save
+        self.metrics = default_metrics(metrics)
+        self.ledger = ledger
         self.workbook = None
         self.worksheet = None
+        self.read_only = False
+        # 1ページ目（アクティブシート）と続きシート
+        self.pages = []
+        # 次の空き位置 (ページ番号, 行番号)。最初の追加時に一度だけ探索する
+        self._cursor = None
+        # fast_save 時の未保存の書き込み: シート名 -> {(行, 列): 値}（通常モードではNone）
+        self._pending = None
+        # fast_save 時の記入済みの行: ページ番号 -> 行番号の集合
+        self._filled = {}
+        # 保存後に索引へ複製する明細と、読み込んだ時点のファイルの (更新時刻ns, サイズ)
+        self._written = []
+        self._signature = None
+
+    def load(self, read_only: bool = False):
+        """
+        Excelファイルを読み込む
 
-    def load(self):
-        """Excelファイルを読み込む"""
-        self.workbook = load_workbook(self.excel_path)
+        fast_save 有効時は書き込み可能なまま読み取り専用モードで開き、書き込みは保存時までメモリに保持する
+
+        Args:
+            read_only: 読み取り専用で開くか（書式・画像を読まずにセル値だけを逐次読み込むため高速）
+        """
+        fast = self.fast_save and not read_only
+        self.read_only = read_only
+        with self.metrics.stage("excel_load", read_only=read_only or fast):
+            source = self.excel_path
+            if fast:
+                # 読み取り専用モードはファイルを開いたまま読むため、保存時に置き換えられるようメモリ上から開く
+                # （Windowsでは開いているファイルを置き換えられない）
+                source = io.BytesIO(self.excel_path.read_bytes())
+            self.workbook = load_workbook(source, read_only=read_only or fast)
         self.worksheet = self.workbook.active
+        self.pages = self._find_pages()
+        self._cursor = None
+        self._pending = {} if fast else None
+        self._filled = {}
+        self._written = []
+        self._signature = _file_signature(self.excel_path)
 
     def save(self, output_path: Optional[str] = None):
         """
@@ -51,16 +129,228 @@ class ExpenseExcelHandler:
         Args:
             output_path: 出力先パス（Noneの場合は元ファイルを上書き）
         """
-        if output_path:
-            self.workbook.save(output_path)
-        else:
-            self.workbook.save(self.excel_path)
+        if self.read_only:
+            raise ValueError("読み取り専用で開いたExcelファイルは保存できません")
+
+        target = output_path or self.excel_path
+        if self._pending is not None:
+            try:
+                with self.metrics.stage("excel_save", mode="patch"):
+                    patch_workbook(str(self.excel_path), str(target), self._pending)
+                if Path(target).resolve() == self.excel_path.resolve():
+                    # 元ファイルに反映済みの書き込みは、次の保存で書き直さない
+                    self._pending = {}
+                invalidate_summary(str(target))
+                self._record_ledger(Path(target))
+                return
+            except XlsxPatchError:
+                # 部分書き換えできないブックは通常の保存に切り替える
+                self._leave_fast_mode()
+
+        with self.metrics.stage("excel_save"):
+            self._save_atomic(Path(target))
+        invalidate_summary(str(target))
+        self._record_ledger(Path(target))
+
+    def _record_ledger(self, target: Path):
+        """保存した明細を索引に複製"""
+        written, self._written = self._written, []
+        if self.ledger is None or not written:
+            return
+
+        # 別のファイルに保存した場合は、そのファイルの既存の明細が索引と一致している保証がない
+        same_file = target.resolve() == self.excel_path.resolve()
+        try:
+            self.ledger.record(str(target), written, self._signature if same_file else None)
+        except sqlite3.Error:
+            # 索引の失敗でExcelへの書き込みを失敗扱いにしない（次の backfill で取り込み直される）
+            pass
+        if same_file:
+            self._signature = _file_signature(target)
+
+    def _save_atomic(self, target: Path):
+        """一時ファイルに保存してから置き換える（書き込み途中のファイルを他から読ませない）"""
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".", suffix=".xlsx.tmp")
+        os.close(fd)
+        try:
+            self.workbook.save(tmp_path)
+            replace_file(tmp_path, target, self.excel_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def close(self):
         """Excelファイルを閉じる"""
         if self.workbook:
             self.workbook.close()
 
+    def _leave_fast_mode(self):
+        """ブック全体を通常モードで開き直し、保持していた書き込みを反映する"""
+        pending, cursor = self._pending, self._cursor
+        self.workbook.close()
+
+        with self.metrics.stage("excel_load", read_only=False):
+            self.workbook = load_workbook(self.excel_path)
+        self.worksheet = self.workbook.active
+        self.pages = self._find_pages()
+        for title, cells in pending.items():
+            page = self.workbook[title]
+            for (row, col), value in cells.items():
+                page.cell(row, col).value = value
+
+        self._pending = None
+        self._filled = {}
+        self._cursor = cursor
+
+    def _continuation_title(self, page_number: int) -> str:
+        """続きシートの名前（シート名の31文字制限に収める）"""
+        suffix = f"{self.CONTINUATION_SUFFIX}{page_number}"
+        return self.worksheet.title[:self.MAX_SHEET_TITLE - len(suffix)] + suffix
+
+    def _find_pages(self) -> List:
+        """1ページ目と既存の続きシートをページ順に取得"""
+        pages = [self.worksheet]
+        while self._continuation_title(len(pages) + 1) in self.workbook.sheetnames:
+            pages.append(self.workbook[self._continuation_title(len(pages) + 1)])
+        return pages
+
+    def _add_page(self):
+        """1ページ目を複製して空の続きシートを追加"""
+        page = self.workbook.copy_worksheet(self.worksheet)
+        page.title = self._continuation_title(len(self.pages) + 1)
+
+        for row in range(self.DATA_START_ROW, self.DATA_END_ROW + 1):
+            for col in (self.COL_DATE, self.COL_PAYEE, self.COL_CONTENT, self.COL_AMOUNT):
+                page.cell(row, col).value = None
+
+        # 直前のページの後ろに並べる
+        offset = self.workbook.index(self.pages[-1]) + 1 - self.workbook.index(page)
+        self.workbook.move_sheet(page, offset=offset)
+
+        self.pages.append(page)
+        self._write_page_totals()
+
+    def _write_page_totals(self):
+        """各ページの合計行に小計、1ページ目の備考欄に総合計の数式を書き込む"""
+        amount_col = get_column_letter(self.COL_AMOUNT)
+        page_sum = f"=SUM({amount_col}{self.DATA_START_ROW}:{amount_col}{self.DATA_END_ROW})"
+        for page in self.pages:
+            page.cell(self.TOTAL_ROW, self.COL_AMOUNT).value = page_sum
+
+        total_refs = "+".join(
+            f"{quote_sheetname(page.title)}!{amount_col}{self.TOTAL_ROW}" for page in self.pages
+        )
+        self.worksheet.cell(self.TOTAL_ROW, self.COL_NOTE).value = (
+            f'="総合計（{len(self.pages)}ページ） ¥"&TEXT({total_refs},"#,##0")'
+        )
+
+    @staticmethod
+    def _is_empty(value) -> bool:
+        """日付セルの値が空かどうか"""
+        return value is None or str(value).strip() == ""
+
+    def _is_slot_empty(self, page_index: int, row: int) -> bool:
+        """指定位置の日付セルが空かどうか"""
+        if self._pending is None:
+            return self._is_empty(self.pages[page_index].cell(row, self.COL_DATE).value)
+
+        # 読み取り専用モードではセル単位の参照が遅いため、ページごとに一度だけ読む
+        if page_index not in self._filled:
+            rows = self._read_table_rows(self.pages[page_index])
+            self._filled[page_index] = {
+                self.DATA_START_ROW + offset
+                for offset, values in enumerate(rows[:self.MAX_ENTRIES])
+                if len(values) >= self.COL_DATE and not self._is_empty(values[self.COL_DATE - 1])
+            }
+        return row not in self._filled[page_index]
+
+    def _next_slot(self) -> Optional[Tuple[int, int]]:
+        """
+        次の空き位置を取得
+
+        カーソルは前方にしか進まないため、連続して追加しても各行を高々1回しか調べない
+
+        Returns:
+            (ページ番号, 行番号)、満杯で続きシートを追加しない場合はNone
+        """
+        page_index, row = self._cursor or (0, self.DATA_START_ROW)
+
+        while True:
+            if row > self.DATA_END_ROW:
+                page_index, row = page_index + 1, self.DATA_START_ROW
+            if page_index >= len(self.pages):
+                if not self.overflow:
+                    self._cursor = (page_index, row)
+                    return None
+                if self._pending is not None:
+                    # シートの追加は部分書き換えでは扱えない
+                    self._leave_fast_mode()
+                self._add_page()
+            if self._is_slot_empty(page_index, row):
+                break
+            row += 1
+
+        self._cursor = (page_index, row)
+        return page_index, row
+
+    def _set_cells(self, page_index: int, row: int, values: Dict[int, object]):
+        """指定した行のセルに値を書き込む（fast_save 時は保存まで保持）"""
+        page = self.pages[page_index]
+        if self._pending is not None:
+            cells = self._pending.setdefault(page.title, {})
+            for col, value in values.items():
+                cells[(row, col)] = value
+        else:
+            for col, value in values.items():
+                page.cell(row, col).value = value
+
+    def _write_entry(self, page_index: int, row: int, date: str, payee: str, content: str, amount: float):
+        """指定位置に明細を書き込み、カーソルを進める"""
+        self._set_cells(page_index, row, {
+            self.COL_DATE: date,
+            self.COL_PAYEE: payee,
+            self.COL_CONTENT: content,
+            self.COL_AMOUNT: amount
+        })
+        self._written.append({
+            "sheet": self.pages[page_index].title,
+            "row": row, "date": date, "payee": payee, "content": content, "amount": amount
+        })
+        if self._pending is not None:
+            self._filled[page_index].add(row)
+        self._cursor = (page_index, row + 1)
+
+    def set_applicant(self, name: str, department: str = "", date: Optional[str] = None):
+        """
+        申請者欄（氏名・所属・申請日）を記入
+
+        続きシートは1ページ目の複製のため、明細を追加する前に呼ぶと全ページに反映される
+
+        Args:
+            name: 氏名
+            department: 所属
+            date: 申請日（YYYY/MM/DD形式、Noneの場合は変更しない）
+        """
+        if self.workbook is None:
+            self.load()
+
+        self._set_cells(0, self.APPLICANT_ROW, {self.COL_APPLICANT: name})
+        self._set_cells(0, self.DEPARTMENT_ROW, {self.COL_APPLICANT: department})
+        if date is not None:
+            date_obj = datetime.strptime(date, "%Y/%m/%d")
+            self._set_cells(0, self.DATE_ROW, {
+                self.COL_YEAR: date_obj.year,
+                self.COL_MONTH: date_obj.month,
+                self.COL_DAY: date_obj.day
+            })
+
+    def _slot_label(self, page_index: int, row: int) -> str:
+        """書き込み位置の表示用文字列"""
+        if page_index == 0:
+            return f"{row}行目"
+        return f"{self.pages[page_index].title} の{row}行目"
+
     def find_next_empty_row(self) -> Optional[int]:
         """
         次の空行を探す
@@ -94,62 +384,170 @@ class ExpenseExcelHandler:
         Returns:
             (成功フラグ, メッセージ)
         """
-        # 空行を探す
-        empty_row = self.find_next_empty_row()
-        if empty_row is None:
-            return False, "明細行が満杯です（最大16件）"
-
         # データを書き込む
         try:
-            self.worksheet.cell(empty_row, self.COL_DATE).value = date
-            self.worksheet.cell(empty_row, self.COL_PAYEE).value = payee
-            self.worksheet.cell(empty_row, self.COL_CONTENT).value = content
-            self.worksheet.cell(empty_row, self.COL_AMOUNT).value = amount
-
-            return True, f"{empty_row}行目に追加しました"
+            # 空き位置を探す（overflow有効時は必要に応じて続きシートを追加）
+            with self.metrics.stage("excel_write"):
+                slot = self._next_slot()
+                if slot is None:
+                    return False, f"明細行が満杯です（最大{self.MAX_ENTRIES}件）"
+
+                self._write_entry(*slot, date, payee, content, amount)
+            return True, f"{self._slot_label(*slot)}に追加しました"
         except Exception as e:
             return False, f"書き込みエラー: {str(e)}"
 
-    def get_existing_entries(self) -> List[Dict]:
+    def add_expense_entries(
+        self,
+        entries: List[Dict],
+        save: bool = True,
+        output_path: Optional[str] = None
+    ) -> Tuple[List[Dict], List[Dict]]:
         """
-        既存の明細を取得
+        経費明細をまとめて追加（読み込み・保存は1回だけ）
+
+        全件を先にバリデーションし、有効なものを空行へ順に書き込む
+
+        Args:
+            entries: date, payee, content, amount を持つ辞書のリスト
+            save: 書き込み後に保存するか
+            output_path: 出力先パス（Noneの場合は元ファイルを上書き）
 
         Returns:
-            明細のリスト
+            (書き込んだ明細のリスト, 書き込めなかった明細のリスト)
+            書き込んだ明細は index（入力の位置）と sheet・row・message、
+            書き込めなかった明細は index と message を持つ
         """
+        if self.workbook is None:
+            self.load()
+
+        # バリデーション
+        valid = []
+        rejected = []
+        for index, entry in enumerate(entries):
+            missing = [f for f in ("date", "payee", "content", "amount") if f not in entry]
+            if missing:
+                rejected.append({"index": index, "message": f"必須フィールド '{missing[0]}' が見つかりません"})
+                continue
+
+            try:
+                is_valid, error_msg = self.validate_data(
+                    entry["date"], entry["payee"], entry["content"], entry["amount"]
+                )
+            except (TypeError, ValueError):
+                is_valid, error_msg = False, "データ形式が不正です"
+
+            if is_valid:
+                valid.append((index, entry))
+            else:
+                rejected.append({"index": index, "message": error_msg})
+
+        # 空き位置のカーソルを進めながら先頭から順に埋める
+        written = []
+        with self.metrics.stage("excel_write", entries=len(valid)):
+            for index, entry in valid:
+                slot = self._next_slot()
+                if slot is None:
+                    rejected.append({"index": index, "message": f"明細行が満杯です（最大{self.MAX_ENTRIES}件）"})
+                    continue
+
+                self._write_entry(*slot, entry["date"], entry["payee"], entry["content"], float(entry["amount"]))
+                written.append({
+                    "index": index,
+                    "sheet": self.pages[slot[0]].title,
+                    "row": slot[1],
+                    "message": f"{self._slot_label(*slot)}に追加しました"
+                })
+
+        rejected.sort(key=lambda r: r["index"])
+
+        if save and written:
+            self.save(output_path)
+
+        return written, rejected
+
+    def _read_table_rows(self, page) -> List[tuple]:
+        """
+        明細行〜合計行のセル値を取得
+
+        Args:
+            page: 対象のワークシート
+
+        Returns:
+            DATA_START_ROW〜TOTAL_ROW の各行の値のタプル（A列〜W列）
+        """
+        return list(page.iter_rows(
+            min_row=self.DATA_START_ROW,
+            max_row=self.TOTAL_ROW,
+            max_col=self.COL_AMOUNT,
+            values_only=True
+        ))
+
+    def _entries_from_rows(self, rows: List[tuple], sheet: str) -> List[Dict]:
+        """行の値から明細のリストを作成"""
         entries = []
-        for row in range(self.DATA_START_ROW, self.DATA_END_ROW + 1):
-            date_val = self.worksheet.cell(row, self.COL_DATE).value
+        for offset, values in enumerate(rows[:self.MAX_ENTRIES]):
+            # 行末の空セルは省略される場合があるため長さを揃える
+            values = tuple(values) + (None,) * (self.COL_AMOUNT - len(values))
+            date_val = values[self.COL_DATE - 1]
 
             # 空行はスキップ
             if date_val is None or str(date_val).strip() == "":
                 continue
 
             entry = {
-                "row": row,
+                "sheet": sheet,
+                "row": self.DATA_START_ROW + offset,
                 "date": str(date_val),
-                "payee": self.worksheet.cell(row, self.COL_PAYEE).value or "",
-                "content": self.worksheet.cell(row, self.COL_CONTENT).value or "",
-                "amount": self.worksheet.cell(row, self.COL_AMOUNT).value or 0
+                "payee": values[self.COL_PAYEE - 1] or "",
+                "content": values[self.COL_CONTENT - 1] or "",
+                "amount": values[self.COL_AMOUNT - 1] or 0
             }
             entries.append(entry)
 
         return entries
 
+    def get_existing_entries(self) -> List[Dict]:
+        """
+        既存の明細を取得（続きシートを含む全ページ）
+
+        Returns:
+            明細のリスト
+        """
+        entries = []
+        for page in self.pages:
+            entries.extend(self._entries_from_rows(self._read_table_rows(page), page.title))
+        return entries
+
     def get_total_amount(self) -> float:
         """
-        合計金額を取得
+        合計金額を取得（続きシートがある場合は全ページの総合計）
 
         Returns:
             合計金額
         """
-        total_cell = self.worksheet.cell(self.TOTAL_ROW, self.COL_AMOUNT)
-        total_value = total_cell.value
+        return sum(self.get_page_totals())
+
+    def get_page_totals(self) -> List[float]:
+        """
+        ページごとの合計金額を取得
+
+        Returns:
+            1ページ目から順の合計金額のリスト
+        """
+        return [self._page_total(page) for page in self.pages]
+
+    def _page_total(self, page) -> float:
+        """1ページ分の合計金額"""
+        rows = self._read_table_rows(page)
+        total_offset = self.TOTAL_ROW - self.DATA_START_ROW
+        total_row = rows[total_offset] if len(rows) > total_offset else ()
+        total_value = total_row[self.COL_AMOUNT - 1] if len(total_row) >= self.COL_AMOUNT else None
 
         # 数式の場合は計算結果を取得
         if isinstance(total_value, str) and total_value.startswith("="):
             # 数式を再計算（openpyxlでは自動計算されないため、手動計算）
-            entries = self.get_existing_entries()
+            entries = self._entries_from_rows(rows, page.title)
             return sum([float(e["amount"]) for e in entries if e["amount"]])
 
         return float(total_value) if total_value else 0.0
@@ -192,6 +590,64 @@ class ExpenseExcelHandler:
         return True, ""
 
 
+def _file_signature(path: Path) -> Tuple[int, int]:
+    """キャッシュの鍵とするファイルの (更新時刻ns, サイズ)"""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_summary(excel_path: str, metrics: Optional[Metrics] = None) -> Dict:
+    """
+    明細一覧・件数・合計・残り件数を取得
+
+    ファイルの更新時刻とサイズが変わらない限り、Excelを再解析せずキャッシュを返す
+
+    Args:
+        excel_path: Excelファイルのパス
+        metrics: 読み込みの所要時間の計測先（Noneの場合は計測しない）
+
+    Returns:
+        entries, count, total, pages, remaining（既存ページの空き件数）を持つ辞書
+    """
+    path = Path(excel_path).resolve()
+    signature = _file_signature(path)
+
+    with _summary_lock:
+        cached = _summary_cache.get(str(path))
+    if cached is not None and cached[0] == signature:
+        summary = cached[1]
+    else:
+        handler = ExpenseExcelHandler(str(path), metrics=metrics)
+        handler.load(read_only=True)
+        try:
+            entries = handler.get_existing_entries()
+            summary = {
+                "entries": entries,
+                "count": len(entries),
+                "total": handler.get_total_amount(),
+                "pages": len(handler.pages),
+                "remaining": ExpenseExcelHandler.MAX_ENTRIES * len(handler.pages) - len(entries)
+            }
+        finally:
+            handler.close()
+
+        with _summary_lock:
+            _summary_cache[str(path)] = (signature, summary)
+
+    return {**summary, "entries": list(summary["entries"])}
+
+
+def invalidate_summary(excel_path: str):
+    """
+    集計結果のキャッシュを破棄
+
+    Args:
+        excel_path: Excelファイルのパス
+    """
+    with _summary_lock:
+        _summary_cache.pop(str(Path(excel_path).resolve()), None)
+
+
 def test_excel_handler():
     """テスト関数"""
     handler = ExpenseExcelHandler("templates/立替経費精算書.xlsx")
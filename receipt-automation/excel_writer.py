@@ -0,0 +1,305 @@
+"""
+Excel書き込みキューモジュール
+同じExcelファイルへの書き込みを1つのスレッドに集約し、ファイルロックで他プロセスとも排他する
+
+同時に届いた複数の明細は、1回の読み込み・保存にまとめて書き込む
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from excel_handler import ExpenseExcelHandler
+from ledger_index import LedgerIndex
+from metrics import Metrics, default_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """ロックファイルを使ったプロセス間の排他（アドバイザリロック）"""
+
+    def __init__(self, path: str, timeout: Optional[float] = None, poll_interval: float = 0.05):
+        """
+        初期化
+
+        Args:
+            path: ロックファイルのパス
+            timeout: ロック取得の待ち時間の上限（秒）。Noneの場合は無制限に待つ
+            poll_interval: タイムアウト指定時の再試行間隔（秒）
+        """
+        self.path = str(path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = None
+
+    def _try_lock(self, blocking: bool) -> bool:
+        """ロックを試みる（取得できたらTrue）"""
+        fd = self._file.fileno()
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        """
+        ロックを取得
+
+        Raises:
+            TimeoutError: timeout 秒以内に取得できなかった場合
+        """
+        self._file = open(self.path, "a+b")
+        blocking = self.timeout is None and fcntl is not None
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while not self._try_lock(blocking):
+            if deadline is not None and time.monotonic() >= deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"ファイルのロックを取得できませんでした: {self.path}")
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        """ロックを解放"""
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ExcelWriter:
+    """1つのExcelファイルへの書き込みを直列化するキュー"""
+
+    # キューの終了を知らせる目印
+    _STOP = object()
+
+    def __init__(
+        self,
+        excel_path: str,
+        overflow: bool = True,
+        fast_save: bool = True,
+        metrics: Optional[Metrics] = None,
+        max_batch: int = 64,
+        lock_timeout: Optional[float] = 60.0,
+        ledger: Optional[LedgerIndex] = None
+    ):
+        """
+        初期化
+
+        Args:
+            excel_path: Excelファイルのパス
+            overflow: 明細行が満杯のとき、続きシートを自動で追加するか
+            fast_save: 変更したシートのXMLだけを書き換えて保存するか
+            metrics: 書き込みの所要時間の計測先（Noneの場合は計測しない）
+            max_batch: 1回の読み込み・保存でまとめて書き込む明細数の上限
+            lock_timeout: ファイルロックの待ち時間の上限（秒）
+            ledger: 保存した明細を複製する索引（Noneの場合は複製しない）
+        """
+        self.excel_path = Path(excel_path)
+        self.overflow = overflow
+        self.fast_save = fast_save
+        self.metrics = default_metrics(metrics)
+        self.max_batch = max_batch
+        self.lock_path = self.excel_path.with_name(self.excel_path.name + ".lock")
+        self.lock_timeout = lock_timeout
+        self.ledger = ledger
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        # スレッドの起動・キューへの追加と、終了の目印の追加を排他する
+        # （close の後に追加された明細が、処理するスレッドのないまま待ち続けないようにする）
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, date: str, payee: str, content: str, amount: float) -> Future:
+        """
+        明細の書き込みを予約
+
+        Args:
+            date: 日付（YYYY/MM/DD形式）
+            payee: 支払先
+            content: 支払内容
+            amount: 金額
+
+        Returns:
+            (成功フラグ, メッセージ) を結果に持つ Future
+
+        Raises:
+            RuntimeError: close 済みの場合
+        """
+        future: Future = Future()
+        entry = {"date": date, "payee": payee, "content": content, "amount": amount}
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"書き込みキューは閉じられています: {self.excel_path.name}")
+            # 書き込みスレッドは初回に起動
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="excel-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((entry, future))
+        return future
+
+    def add_expense_entry(self, date: str, payee: str, content: str, amount: float) -> Tuple[bool, str]:
+        """
+        明細を書き込み、保存が終わるまで待つ
+
+        Args:
+            date: 日付（YYYY/MM/DD形式）
+            payee: 支払先
+            content: 支払内容
+            amount: 金額
+
+        Returns:
+            (成功フラグ, メッセージ)
+        """
+        return self.submit(date, payee, content, amount).result()
+
+    def add_expense_entries(self, entries: List[Dict]) -> List[Tuple[bool, str]]:
+        """
+        複数の明細を書き込み、保存が終わるまで待つ
+
+        Args:
+            entries: date, payee, content, amount を持つ辞書のリスト
+
+        Returns:
+            入力と同じ順序の (成功フラグ, メッセージ) のリスト
+        """
+        futures = [
+            self.submit(entry.get("date"), entry.get("payee"), entry.get("content"), entry.get("amount"))
+            for entry in entries
+        ]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        キューに残っている書き込みを終えてからスレッドを停止
+
+        閉じた後は書き込みを受け付けない。get_writer の登録からも外すため、次回は新しいキューが作られる
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(self._STOP)
+
+        with _writers_lock:
+            key = os.path.realpath(self.excel_path)
+            if _writers.get(key) is self:
+                del _writers[key]
+
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        """書き込みスレッド: 届いている明細をまとめて書き込む"""
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple[Dict, Future]]):
+        """
+        ロックを取って最新のファイルを読み込み、まとめて書き込んで保存
+
+        Args:
+            batch: (明細, Future) のリスト
+        """
+        entries = [entry for entry, _ in batch]
+        results: List[Tuple[bool, str]] = [(False, "書き込まれませんでした")] * len(batch)
+
+        try:
+            with self.metrics.stage("excel_batch", entries=len(batch)):
+                with FileLock(str(self.lock_path), timeout=self.lock_timeout):
+                    handler = ExpenseExcelHandler(
+                        str(self.excel_path),
+                        overflow=self.overflow,
+                        metrics=self.metrics,
+                        fast_save=self.fast_save,
+                        ledger=self.ledger
+                    )
+                    handler.load()
+                    try:
+                        written, rejected = handler.add_expense_entries(entries)
+                    finally:
+                        handler.close()
+
+            for item in written:
+                results[item["index"]] = (True, item["message"])
+            for item in rejected:
+                results[item["index"]] = (False, item["message"])
+        except Exception as e:
+            results = [(False, f"書き込みエラー: {str(e)}")] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+# Excelファイルごとの書き込みキュー（同じプロセス内のセッションで共有）
+_writers: Dict[str, ExcelWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(excel_path: str, **kwargs) -> ExcelWriter:
+    """
+    Excelファイルの書き込みキューを取得（なければ作成）
+
+    Args:
+        excel_path: Excelファイルのパス
+        kwargs: 初回作成時に ExcelWriter に渡す設定
+
+    Returns:
+        書き込みキュー
+    """
+    key = os.path.realpath(excel_path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = ExcelWriter(excel_path, **kwargs)
+            _writers[key] = writer
+        return writer
@@ -0,0 +1,190 @@
+"""
+抽出バックエンドモジュール
+Chat Completions 形式のリクエストを受け取り、モデルの応答を返す部分を差し替え可能にする
+"""
+
+import asyncio
+import weakref
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, NamedTuple, Optional
+
+import openai
+
+from openai_client import ClientConfig, call_with_retry, call_with_retry_async
+
+
+class Completion(NamedTuple):
+    """バックエンドの応答"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    finish_reason: Optional[str] = None  # length の場合は max_tokens で打ち切られている
+    refusal: Optional[str] = None        # 構造化出力でモデルが応答を拒否した理由
+
+
+def completion_from_body(body: Dict) -> Completion:
+    """
+    Chat Completions の応答本文（JSON）を Completion に変換（バッチの結果ファイルなど）
+
+    Args:
+        body: chat.completion の応答本文
+
+    Returns:
+        応答
+    """
+    usage = body.get("usage") or {}
+    choice = body["choices"][0]
+    message = choice.get("message") or {}
+    return Completion(
+        text=message.get("content") or "",
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        finish_reason=choice.get("finish_reason"),
+        refusal=message.get("refusal")
+    )
+
+
+class ExtractionBackend(ABC):
+    """抽出バックエンドの基底クラス"""
+
+    @abstractmethod
+    def complete(self, request: Dict) -> Completion:
+        """
+        リクエストを送信して応答を取得
+
+        Args:
+            request: chat.completions.create に渡すキーワード引数
+
+        Returns:
+            モデルの応答テキストとトークン数（不明な場合はNone）
+        """
+
+    async def complete_async(self, request: Dict) -> Completion:
+        """
+        リクエストを送信して応答を取得（非同期版）
+
+        デフォルトでは同期版をスレッドで実行する
+
+        Args:
+            request: chat.completions.create に渡すキーワード引数
+
+        Returns:
+            モデルの応答テキストとトークン数（不明な場合はNone）
+        """
+        return await asyncio.to_thread(self.complete, request)
+
+    def stream(self, request: Dict) -> Iterator[Completion]:
+        """
+        リクエストを送信し、応答を届いた順に断片で受け取る
+
+        各断片の text は前回からの差分。トークン数・finish_reason は届いた断片にだけ入る。
+        デフォルトでは同期版の応答全体を1つの断片として返す
+
+        Args:
+            request: chat.completions.create に渡すキーワード引数
+
+        Yields:
+            応答の断片
+        """
+        yield self.complete(request)
+
+    def close(self):
+        """保持している接続を閉じる"""
+
+    async def aclose(self):
+        """実行中のイベントループで使った非同期接続を閉じる"""
+
+
+class OpenAIBackend(ExtractionBackend):
+    """OpenAI互換APIのバックエンド（公式API・ローカルのモックサーバー共通）"""
+
+    def __init__(self, api_key: str, client_config: Optional[ClientConfig] = None):
+        """
+        初期化
+
+        Args:
+            api_key: OpenAI APIキー
+            client_config: 接続・リトライ設定（Noneの場合はデフォルト）
+        """
+        self.api_key = api_key
+        self.client_config = client_config or ClientConfig()
+
+        # 接続を使い回すため、同期クライアントはインスタンスごとに1つだけ生成
+        self.client = self.client_config.create_client(self.api_key)
+
+        # 非同期クライアントはイベントループに紐づくため、ループごとに1つ生成
+        self._async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _async_client(self) -> openai.AsyncOpenAI:
+        """実行中のイベントループ用の非同期クライアント"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self.client_config.create_async_client(self.api_key)
+            self._async_clients[loop] = client
+        return client
+
+    @staticmethod
+    def _to_completion(response) -> Completion:
+        """SDKの応答をCompletionに変換（usageがない互換サーバーにも対応）"""
+        usage = getattr(response, "usage", None)
+        choice = response.choices[0]
+        return Completion(
+            text=choice.message.content or "",
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            finish_reason=getattr(choice, "finish_reason", None),
+            refusal=getattr(choice.message, "refusal", None)
+        )
+
+    def complete(self, request: Dict) -> Completion:
+        # レート制限・タイムアウト時はリトライ
+        response = call_with_retry(
+            self.client_config,
+            lambda: self.client.chat.completions.create(**request)
+        )
+        return self._to_completion(response)
+
+    def stream(self, request: Dict) -> Iterator[Completion]:
+        # リトライは接続確立まで（応答の途中で切れた場合は呼び出し側のエラーになる）
+        stream = call_with_retry(
+            self.client_config,
+            lambda: self.client.chat.completions.create(
+                **request, stream=True, stream_options={"include_usage": True}
+            )
+        )
+        try:
+            for chunk in stream:
+                # include_usage の最後の断片は choices が空で usage だけを持つ
+                usage = getattr(chunk, "usage", None)
+                text, finish_reason, refusal = "", None, None
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    text = choice.delta.content or ""
+                    finish_reason = choice.finish_reason
+                    refusal = getattr(choice.delta, "refusal", None)
+                yield Completion(
+                    text=text,
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None),
+                    finish_reason=finish_reason,
+                    refusal=refusal
+                )
+        finally:
+            stream.close()
+
+    async def complete_async(self, request: Dict) -> Completion:
+        client = self._async_client()
+        response = await call_with_retry_async(
+            self.client_config,
+            lambda: client.chat.completions.create(**request)
+        )
+        return self._to_completion(response)
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
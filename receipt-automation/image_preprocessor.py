@@ -0,0 +1,296 @@
+"""
+画像前処理モジュール
+API送信前にレシート画像を縮小・グレースケール化・再圧縮してペイロードを削減
+"""
+
+import io
+import math
+from typing import NamedTuple, Optional, Union
+
+from PIL import Image, ImageOps
+
+# 画像のバイト列として受け付ける型（memoryview はコピーせずにそのまま扱う）
+ImageBuffer = Union[bytes, bytearray, memoryview]
+
+# HEIC/HEIF の ftyp ボックスに現れるブランド
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+def sniff_mime_type(data: ImageBuffer) -> Optional[str]:
+    """
+    先頭バイトから画像形式を判定（拡張子に頼らない）
+
+    Args:
+        data: 画像のバイト列
+
+    Returns:
+        MIMEタイプ（JPEG / PNG / HEIC 以外はNone）
+    """
+    header = bytes(memoryview(data)[:12])
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "image/heic"
+    return None
+
+
+class _BufferReader(io.RawIOBase):
+    """memoryview を複製せずに読み出すファイルオブジェクト（PIL用）"""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self._view) - self._position)
+        if size <= 0:
+            return 0
+        buffer[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def open_buffer(data: ImageBuffer) -> io.IOBase:
+    """
+    画像のバイト列をファイルオブジェクトとして開く（バッファ全体の複製はしない）
+
+    bytes は BytesIO が元のバッファを共有するためそのまま渡し、
+    それ以外（memoryview・bytearray）は読み出し専用のラッパーで包む
+
+    Args:
+        data: 画像のバイト列
+
+    Returns:
+        Image.open に渡せるファイルオブジェクト
+    """
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    return io.BufferedReader(_BufferReader(memoryview(data).cast("B")))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str) -> int:
+    """
+    Vision APIが画像1枚に課金する入力トークン数の概算
+
+    low は一律85トークン。high（auto も同様に扱う）は 2048px 四方に収めたうえで短辺を768pxに縮小し、
+    512px のタイル1枚につき170トークンを加算する
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        detail: Vision APIのdetail（low / high / auto）
+
+    Returns:
+        トークン数
+    """
+    if detail == "low":
+        return 85
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+class PreparedImage(NamedTuple):
+    """前処理済み画像"""
+    data: bytes        # エンコード済み画像のバイト列
+    mime_type: str     # 例: image/jpeg
+    detail: str        # Vision APIのdetail（low / high）
+    width: int
+    height: int
+    quality: int       # 最終的に使用した圧縮品質
+
+
+class ImagePreprocessor:
+    """レシート画像の前処理クラス"""
+
+    # Vision APIの低解像度モードが扱う最大サイズ
+    LOW_DETAIL_MAX_EDGE = 512
+
+    FORMATS = {
+        "JPEG": "image/jpeg",
+        "WEBP": "image/webp",
+    }
+
+    def __init__(
+        self,
+        max_long_edge: int = 2048,
+        grayscale: bool = True,
+        output_format: str = "JPEG",
+        target_bytes: int = 500 * 1024,
+        max_quality: int = 90,
+        min_quality: int = 50
+    ):
+        """
+        初期化
+
+        Args:
+            max_long_edge: 長辺の上限（px）
+            grayscale: グレースケールに変換するか
+            output_format: 出力形式（JPEG / WEBP）
+            target_bytes: 目標とする出力サイズ（バイト）
+            max_quality: 圧縮品質の上限
+            min_quality: 圧縮品質の下限（これ以上は画質を落とさない）
+        """
+        output_format = output_format.upper()
+        if output_format not in self.FORMATS:
+            raise ValueError(f"対応していない出力形式です: {output_format}")
+        if not 1 <= min_quality <= max_quality <= 100:
+            raise ValueError("圧縮品質は 1 <= min_quality <= max_quality <= 100 で指定してください")
+
+        self.max_long_edge = max_long_edge
+        self.grayscale = grayscale
+        self.output_format = output_format
+        self.target_bytes = target_bytes
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+
+    def signature(self) -> str:
+        """
+        設定を表す文字列（キャッシュキー用）
+
+        Returns:
+            設定値を連結した文字列
+        """
+        return (
+            f"{self.output_format}-{self.max_long_edge}-{int(self.grayscale)}"
+            f"-{self.target_bytes}-{self.max_quality}-{self.min_quality}"
+        )
+
+    def choose_detail(self, width: int, height: int) -> str:
+        """
+        Vision APIのdetailレベルを選択
+
+        Args:
+            width: 画像の幅
+            height: 画像の高さ
+
+        Returns:
+            "low"（512px以内に収まる場合）または "high"
+        """
+        if max(width, height) <= self.LOW_DETAIL_MAX_EDGE:
+            return "low"
+        return "high"
+
+    def _encode(self, img: Image.Image, quality: int) -> bytes:
+        """指定品質でエンコード"""
+        buffer = io.BytesIO()
+        img.save(buffer, format=self.output_format, quality=quality, optimize=True)
+        return buffer.getvalue()
+
+    def _fit_quality(self, img: Image.Image) -> tuple:
+        """
+        目標サイズに収まる最大の品質を二分探索
+
+        Returns:
+            (エンコード結果, 品質)。下限でも収まらない場合は下限品質の結果
+        """
+        # 上限品質で収まれば探索不要
+        data = self._encode(img, self.max_quality)
+        if len(data) <= self.target_bytes:
+            return data, self.max_quality
+
+        low, high = self.min_quality, self.max_quality - 1
+        best: Optional[tuple] = None
+
+        while low <= high:
+            quality = (low + high) // 2
+            data = self._encode(img, quality)
+            if len(data) <= self.target_bytes:
+                best = (data, quality)
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is None:
+            best = (self._encode(img, self.min_quality), self.min_quality)
+        return best
+
+    def prepare(self, image: Image.Image) -> PreparedImage:
+        """
+        画像を前処理
+
+        Args:
+            image: PILの画像
+
+        Returns:
+            前処理済み画像
+        """
+        # EXIFの回転情報を反映（スマホ撮影の横倒れ対策）
+        img = ImageOps.exif_transpose(image)
+
+        if self.grayscale:
+            img = img.convert("L")
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        # 長辺を上限に収める
+        if max(img.size) > self.max_long_edge:
+            img = img.copy()
+            img.thumbnail((self.max_long_edge, self.max_long_edge), Image.LANCZOS)
+
+        data, quality = self._fit_quality(img)
+
+        # 品質下限でも目標サイズを超える場合は解像度を段階的に下げる
+        while len(data) > self.target_bytes and max(img.size) > self.LOW_DETAIL_MAX_EDGE:
+            new_size = (max(1, int(img.width * 0.8)), max(1, int(img.height * 0.8)))
+            img = img.resize(new_size, Image.LANCZOS)
+            data, quality = self._fit_quality(img)
+
+        return PreparedImage(
+            data=data,
+            mime_type=self.FORMATS[self.output_format],
+            detail=self.choose_detail(img.width, img.height),
+            width=img.width,
+            height=img.height,
+            quality=quality
+        )
+
+    def prepare_buffer(self, data: ImageBuffer) -> PreparedImage:
+        """
+        メモリ上の画像を前処理
+
+        Args:
+            data: 画像のバイト列
+
+        Returns:
+            前処理済み画像
+        """
+        with Image.open(open_buffer(data)) as img:
+            return self.prepare(img)
+
+    def prepare_file(self, image_path: str) -> PreparedImage:
+        """
+        画像ファイルを前処理
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            前処理済み画像
+        """
+        with Image.open(image_path) as img:
+            img.load()
+            return self.prepare(img)
@@ -0,0 +1,133 @@
+"""
+逐次JSON解析モジュール
+ストリーミングで少しずつ届くJSONオブジェクトから、値が確定したフィールドを順に取り出す
+"""
+
+import json
+from typing import Any, Dict
+
+
+class IncrementalJsonParser:
+    """
+    1つのJSONオブジェクトを断片ごとに受け取り、確定したトップレベルのフィールドを返す
+
+    最初の { より前の文字（```json など）は読み飛ばす。
+    値の妥当性は最終的な json.loads で確認する前提で、解析できない値は無視する
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._token_start = 0     # 解析中のキー・値の開始位置
+        self._key = None
+        self._in_string = False   # 値（入れ子を含む）の文字列の中か
+        self._escaped = False     # 直前がバックスラッシュか
+        self._depth = 0           # 入れ子のオブジェクト・配列の深さ
+        self.fields: Dict[str, Any] = {}
+
+    @property
+    def done(self) -> bool:
+        """オブジェクトの終わり（}）まで読んだか"""
+        return self._state == "done"
+
+    def feed(self, text: str) -> Dict[str, Any]:
+        """
+        断片を追加して解析
+
+        Args:
+            text: 新しく届いた文字列
+
+        Returns:
+            今回新たに確定したフィールド
+        """
+        self._buffer += text
+        completed: Dict[str, Any] = {}
+        buffer = self._buffer
+
+        while self._pos < len(buffer) and self._state != "done":
+            char = buffer[self._pos]
+            state = self._state
+
+            if state == "start":
+                if char == "{":
+                    self._state = "key"
+            elif state == "key":
+                if char == '"':
+                    self._token_start = self._pos
+                    self._state = "key_string"
+                elif char == "}":
+                    self._state = "done"
+            elif state == "key_string":
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._key = self._loads(buffer[self._token_start:self._pos + 1])
+                    self._state = "colon"
+            elif state == "colon":
+                if char == ":":
+                    self._state = "value"
+            elif state == "value":
+                if not char.isspace():
+                    self._token_start = self._pos
+                    if char == '"':
+                        self._in_string = True
+                        self._state = "value_string"
+                    elif char in "{[":
+                        self._depth = 1
+                        self._state = "value_nested"
+                    else:
+                        self._state = "value_scalar"
+            elif state == "value_string":
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._complete(buffer[self._token_start:self._pos + 1], completed)
+            elif state == "value_nested":
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif char == "\\":
+                        self._escaped = True
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete(buffer[self._token_start:self._pos + 1], completed)
+            elif state == "value_scalar":
+                # 数値・true/false/null は区切り文字が来た時点で確定
+                if char in ",}" or char.isspace():
+                    self._complete(buffer[self._token_start:self._pos], completed)
+                    if char == "}":
+                        self._state = "done"
+
+            self._pos += 1
+
+        return completed
+
+    def _complete(self, raw: str, completed: Dict[str, Any]):
+        """値を確定して次のキーへ"""
+        value = self._loads(raw)
+        if self._key is not None and value is not None:
+            self.fields[self._key] = value
+            completed[self._key] = value
+        self._key = None
+        self._state = "key"
+
+    @staticmethod
+    def _loads(raw: str):
+        """JSON値を解析（解析できない場合はNone）"""
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
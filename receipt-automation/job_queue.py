@@ -0,0 +1,157 @@
+"""
+バックグラウンド抽出ジョブモジュール
+アップロードされたレシートをワーカースレッドで抽出し、進捗と結果をセッションごとに保持する
+
+画面の描画スレッドはジョブを登録するだけで、APIの応答を待たない
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from receipt_processor import ReceiptProcessor
+
+
+# 確認欄を開くのに必要なフィールド（揃えばストリーミングの途中でも編集を始められる）
+REQUIRED_FIELDS = ("date", "payee", "amount")
+
+
+class Job:
+    """抽出ジョブ（レシート1件）"""
+
+    def __init__(self, name: str, data: bytes, owner: str):
+        """
+        初期化
+
+        Args:
+            name: 表示用のファイル名
+            data: 画像のバイト列（確認画面で表示するため、登録簿から削除されるまで保持）
+            owner: ジョブを登録したセッションの識別子
+        """
+        self.job_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.owner = owner
+        self.data = data
+        self.status = "queued"           # queued / running / done / failed
+        self.fields: Dict = {}           # ストリーミング中に確定したフィールド
+        self.result: Dict = {}           # 経費データ（done の場合）
+        self.message = ""
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        """処理が終わったか（成功・失敗を問わない）"""
+        return self.status in ("done", "failed")
+
+    @property
+    def reviewable(self) -> bool:
+        """確認欄に表示できるか（完了済み、または抽出中で必須フィールドが確定済み）"""
+        if self.status == "done":
+            return True
+        fields = self.fields
+        return self.status == "running" and all(field in fields for field in REQUIRED_FIELDS)
+
+    @property
+    def elapsed(self) -> float:
+        """処理開始からの経過時間（秒、終了済みの場合は処理時間）"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobQueue:
+    """抽出ジョブのワーカープールと登録簿（全セッションで共有）"""
+
+    def __init__(self, max_workers: int = 4, retention: float = 3600.0):
+        """
+        初期化
+
+        Args:
+            max_workers: 同時に抽出するジョブ数
+            retention: 終了したジョブを保持する時間（秒、登録されないまま放置されたものを破棄）
+        """
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="receipt-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, processor: ReceiptProcessor, name: str, data: bytes, owner: str) -> Job:
+        """
+        ジョブを登録してバックグラウンドで抽出を始める
+
+        Args:
+            processor: 抽出に使うレシート処理クラス
+            name: 表示用のファイル名
+            data: 画像のバイト列
+            owner: セッションの識別子
+
+        Returns:
+            登録したジョブ
+        """
+        job = Job(name, data, owner)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, processor, job)
+        return job
+
+    def jobs(self, owner: str) -> List[Job]:
+        """
+        セッションのジョブ一覧
+
+        Args:
+            owner: セッションの識別子
+
+        Returns:
+            登録順のジョブのリスト
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+        return sorted(jobs, key=lambda job: job.submitted_at)
+
+    def remove(self, job_ids: Iterable[str]):
+        """
+        ジョブを登録簿から削除（Excelに登録済み・不要になったもの）
+
+        Args:
+            job_ids: 削除するジョブのID
+        """
+        with self._lock:
+            for job_id in job_ids:
+                self._jobs.pop(job_id, None)
+
+    def shutdown(self, wait: bool = True):
+        """ワーカーを停止"""
+        self._executor.shutdown(wait=wait)
+
+    def _prune(self):
+        """保持期間を過ぎた終了済みジョブを破棄（ロック取得済みで呼ぶ）"""
+        deadline = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < deadline
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, processor: ReceiptProcessor, job: Job):
+        """ワーカースレッド: 抽出して結果をジョブに書き込む"""
+        job.status = "running"
+        job.started_at = time.time()
+
+        def on_fields(fields: Dict):
+            job.fields = fields
+
+        try:
+            success, data, message = processor.process_receipt_to_expense_from_bytes(job.data, on_fields=on_fields)
+        except Exception as e:
+            success, data, message = False, {}, f"予期しないエラー: {str(e)}"
+
+        job.result = data
+        job.message = message
+        job.finished_at = time.time()
+        job.status = "done" if success else "failed"
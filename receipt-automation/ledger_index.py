@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+明細索引モジュール
+全ての月次ブックの明細をSQLiteに複製し、ブックを開かずに検索・集計できるようにする
+
+Excelへの書き込み時に書き込んだ明細を追記し、既存のブックは backfill で取り込む。
+ブックが正本で、索引はいつでも backfill(force=True) で作り直せる
+"""
+
+import argparse
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    source_file TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    payee TEXT NOT NULL,
+    content TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (source_file, sheet, row)
+);
+CREATE INDEX IF NOT EXISTS entries_date ON entries (date);
+-- 支払先は部分一致で検索するため索引を使えない（以前のバージョンで作った索引は削除する）
+DROP INDEX IF EXISTS entries_payee;
+
+CREATE TABLE IF NOT EXISTS sources (
+    source_file TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+"""
+
+# 集計の単位と、その値を求めるSQL式
+GROUP_COLUMNS = {
+    "payee": "payee",
+    "month": "substr(date, 1, 7)",
+    "source": "source_file",
+}
+
+
+def file_signature(path: Path) -> Tuple[int, int]:
+    """ブックの (更新時刻ns, サイズ)。前回の取り込みから変わったかの判定に使う"""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def normalize_date(value) -> str:
+    """セルの日付を YYYY/MM/DD 形式に揃える（datetime や YYYY-MM-DD で入力された行にも対応）"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y/%m/%d")
+    text = str(value).strip()
+    for date_format in ("%Y/%m/%d", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y/%m/%d")
+        except ValueError:
+            continue
+    return text
+
+
+class LedgerIndex:
+    """明細のSQLite索引"""
+
+    def __init__(self, path: str = ".cache/ledger.sqlite3"):
+        """
+        初期化
+
+        Args:
+            path: データベースファイルのパス
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            # 読み取りと書き込みを並行できるようにする
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """接続を開き、ブロックを抜けるときにコミットして閉じる（スレッドごとに接続を分ける）"""
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _source_key(source_file: str) -> str:
+        """ブックの識別子（解決済みの絶対パス）"""
+        return str(Path(source_file).resolve())
+
+    @staticmethod
+    def _rows(source: str, entries: Iterable[Dict]) -> List[tuple]:
+        """明細を entries テーブルの行に変換"""
+        return [
+            (
+                source,
+                entry["sheet"],
+                int(entry["row"]),
+                normalize_date(entry["date"]),
+                str(entry["payee"] or ""),
+                str(entry["content"] or ""),
+                float(entry["amount"] or 0)
+            )
+            for entry in entries
+        ]
+
+    def record(
+        self,
+        source_file: str,
+        entries: List[Dict],
+        previous_signature: Optional[Tuple[int, int]] = None
+    ):
+        """
+        書き込んだ明細を追加（同じ位置の明細は置き換える）
+
+        索引がブックの書き込み前の状態（previous_signature）と一致していた場合に限り、
+        書き込み後の状態も一致しているものとして記録する。一致していなかった場合は次の backfill で取り込み直す
+
+        Args:
+            source_file: 書き込んだブックのパス
+            entries: sheet, row, date, payee, content, amount を持つ辞書のリスト
+            previous_signature: 書き込み前のブックの (更新時刻ns, サイズ)
+        """
+        source = self._source_key(source_file)
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._rows(source, entries)
+            )
+
+            stored = conn.execute(
+                "SELECT mtime_ns, size FROM sources WHERE source_file = ?", (source,)
+            ).fetchone()
+            if stored is not None and previous_signature is not None and tuple(stored) == tuple(previous_signature):
+                mtime_ns, size = file_signature(Path(source))
+                conn.execute(
+                    "UPDATE sources SET mtime_ns = ?, size = ?, indexed_at = ? WHERE source_file = ?",
+                    (mtime_ns, size, datetime.now().isoformat(timespec="seconds"), source)
+                )
+
+    def replace_source(self, source_file: str, entries: List[Dict], signature: Tuple[int, int]):
+        """
+        ブック1つ分の明細をまとめて置き換える
+
+        Args:
+            source_file: ブックのパス
+            entries: ブックの全明細
+            signature: 読み込んだ時点のブックの (更新時刻ns, サイズ)
+        """
+        source = self._source_key(source_file)
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE source_file = ?", (source,))
+            conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", self._rows(source, entries))
+            conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                (source, signature[0], signature[1], datetime.now().isoformat(timespec="seconds"))
+            )
+
+    def is_current(self, source_file: str) -> bool:
+        """ブックが前回の取り込みから変わっていないか"""
+        source = self._source_key(source_file)
+        with self._connect() as conn:
+            stored = conn.execute(
+                "SELECT mtime_ns, size FROM sources WHERE source_file = ?", (source,)
+            ).fetchone()
+        return stored is not None and tuple(stored) == file_signature(Path(source))
+
+    def backfill(self, paths: Iterable[str], force: bool = False) -> Dict[str, int]:
+        """
+        既存のブックを読み込んで索引に取り込む
+
+        前回の取り込みから変わっていないブックは読み込まない
+
+        Args:
+            paths: ブックのパス
+            force: 変わっていないブックも取り込み直すか
+
+        Returns:
+            scanned（読み込んだブック数）, skipped（変更なしで飛ばした数）, entries（取り込んだ明細数）
+        """
+        # excel_handler はこのモジュールを参照するため、ここで読み込む
+        from excel_handler import ExpenseExcelHandler
+
+        stats = {"scanned": 0, "skipped": 0, "entries": 0}
+        for path in paths:
+            path = Path(path)
+            if not force and self.is_current(str(path)):
+                stats["skipped"] += 1
+                continue
+
+            signature = file_signature(path)
+            handler = ExpenseExcelHandler(str(path))
+            handler.load(read_only=True)
+            try:
+                entries = handler.get_existing_entries()
+            finally:
+                handler.close()
+
+            self.replace_source(str(path), entries, signature)
+            stats["scanned"] += 1
+            stats["entries"] += len(entries)
+        return stats
+
+    def prune(self, keep: Iterable[str]):
+        """
+        指定したブック以外（削除・移動されたブック）の明細を索引から削除
+
+        Args:
+            keep: 残すブックのパス
+        """
+        sources = [self._source_key(path) for path in keep]
+        placeholders = ",".join("?" * len(sources))
+        with self._lock, self._connect() as conn:
+            for table in ("entries", "sources"):
+                if sources:
+                    conn.execute(f"DELETE FROM {table} WHERE source_file NOT IN ({placeholders})", sources)
+                else:
+                    conn.execute(f"DELETE FROM {table}")
+
+    @classmethod
+    def _where(
+        cls,
+        source_file: Optional[str],
+        payee: Optional[str],
+        date_from: Optional[str],
+        date_to: Optional[str]
+    ) -> Tuple[str, List]:
+        """検索条件のWHERE句と引数"""
+        clauses, params = [], []
+        if source_file is not None:
+            clauses.append("source_file = ?")
+            params.append(cls._source_key(source_file))
+        if payee:
+            # 支払先に含まれる % _ をワイルドカードとして扱わない
+            escaped = payee.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("payee LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if date_from:
+            clauses.append("date >= ?")
+            params.append(normalize_date(date_from))
+        if date_to:
+            clauses.append("date <= ?")
+            params.append(normalize_date(date_to))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def entries(
+        self,
+        source_file: Optional[str] = None,
+        payee: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        明細を検索
+
+        Args:
+            source_file: ブックで絞り込む
+            payee: 支払先の部分一致で絞り込む
+            date_from: この日付以降（YYYY/MM/DD）
+            date_to: この日付以前（YYYY/MM/DD）
+            limit: 最大件数
+
+        Returns:
+            source_file, sheet, row, date, payee, content, amount を持つ辞書のリスト（日付順）
+        """
+        where, params = self._where(source_file, payee, date_from, date_to)
+        sql = f"SELECT * FROM entries{where} ORDER BY date, source_file, sheet, row"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def totals(
+        self,
+        group_by: Optional[str] = None,
+        source_file: Optional[str] = None,
+        payee: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        件数と合計金額を集計
+
+        Args:
+            group_by: payee / month / source（Noneの場合は全体で1行）
+            source_file, payee, date_from, date_to: entries と同じ絞り込み条件
+
+        Returns:
+            key（group_by 指定時）, count, total を持つ辞書のリスト（合計金額の大きい順）
+        """
+        where, params = self._where(source_file, payee, date_from, date_to)
+        if group_by is None:
+            sql = f"SELECT COUNT(*) AS count, COALESCE(SUM(amount), 0) AS total FROM entries{where}"
+        else:
+            if group_by not in GROUP_COLUMNS:
+                raise ValueError(f"group_by は {', '.join(GROUP_COLUMNS)} のいずれかを指定してください: {group_by}")
+            column = GROUP_COLUMNS[group_by]
+            sql = (
+                f"SELECT {column} AS key, COUNT(*) AS count, SUM(amount) AS total FROM entries{where} "
+                f"GROUP BY key ORDER BY total DESC"
+            )
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+
+# 月次ブックのファイル名（社員別の精算書 立替経費精算書_<氏名>_<YYYYMMDD>.xlsx などは含めない）
+MONTHLY_WORKBOOK_PATTERN = re.compile(r"立替経費精算書_\d{6}\.xlsx")
+
+
+def find_workbooks(directory: str = ".") -> List[str]:
+    """ディレクトリ内の月次ブック（立替経費精算書_YYYYMM.xlsx）"""
+    return [
+        str(path) for path in sorted(Path(directory).glob("立替経費精算書_*.xlsx"))
+        if MONTHLY_WORKBOOK_PATTERN.fullmatch(path.name)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="明細索引の取り込み・検索")
+    parser.add_argument("--db", default=".cache/ledger.sqlite3", help="索引のデータベース")
+    parser.add_argument("--backfill", nargs="*", metavar="PATH", help="ブックを取り込む（省略時はカレントディレクトリの月次ブック）")
+    parser.add_argument("--force", action="store_true", help="変更のないブックも取り込み直す")
+    parser.add_argument("--payee", help="支払先（部分一致）")
+    parser.add_argument("--year", help="年（例: 2025）")
+    parser.add_argument("--group-by", choices=sorted(GROUP_COLUMNS), help="集計の単位")
+    args = parser.parse_args()
+
+    ledger = LedgerIndex(args.db)
+
+    if args.backfill is not None:
+        paths = args.backfill or find_workbooks()
+        stats = ledger.backfill(paths, force=args.force)
+        print(f"📥 取り込み: {stats['scanned']}ファイル（{stats['entries']}件）、変更なし: {stats['skipped']}ファイル")
+
+    date_from = f"{args.year}/01/01" if args.year else None
+    date_to = f"{args.year}/12/31" if args.year else None
+
+    print()
+    for row in ledger.totals(args.group_by, payee=args.payee, date_from=date_from, date_to=date_to):
+        label = row.get("key", "合計")
+        if args.group_by == "source":
+            label = Path(label).name
+        print(f"  {label}: {row['count']}件 ¥{row['total']:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
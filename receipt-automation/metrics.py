@@ -0,0 +1,234 @@
+"""
+計測モジュール
+処理段階ごとの所要時間・ペイロードサイズ・トークン数を記録し、フック経由で外部へ渡す
+"""
+
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+# 実行中のリクエストID（非同期タスクごとに独立）
+_request_id: contextvars.ContextVar = contextvars.ContextVar("receipt_request_id", default=None)
+
+
+class Metrics:
+    """計測値の記録とフックへの通知"""
+
+    def __init__(self):
+        self._hooks: List[Callable[[Dict], None]] = []
+
+    def add_hook(self, hook: Callable[[Dict], None]):
+        """
+        計測イベントを受け取るフックを登録
+
+        イベントは type（timing / value）, name, value, request_id, timestamp と
+        任意のラベルを持つ辞書
+
+        Args:
+            hook: イベントを受け取る関数
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Dict], None]):
+        """フックの登録を解除"""
+        self._hooks.remove(hook)
+
+    def emit(self, event_type: str, name: str, value: float, **labels):
+        """
+        イベントを記録してフックへ通知
+
+        Args:
+            event_type: timing（秒）または value（バイト数・トークン数など）
+            name: 計測項目名
+            value: 値
+            labels: 追加のラベル
+        """
+        if not self._hooks:
+            return
+
+        event = {
+            "type": event_type,
+            "name": name,
+            "value": value,
+            "request_id": _request_id.get(),
+            "timestamp": time.time(),
+            **labels
+        }
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception:
+                # 計測の失敗で本処理を止めない
+                pass
+
+    def record(self, name: str, value: float, **labels):
+        """値（バイト数・トークン数など）を記録"""
+        self.emit("value", name, value, **labels)
+
+    @contextmanager
+    def stage(self, name: str, **labels) -> Iterator[None]:
+        """
+        処理段階の所要時間を計測
+
+        Args:
+            name: 段階名（例: validate, api, excel_save）
+            labels: 追加のラベル
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit("timing", name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def request(self) -> Iterator[str]:
+        """
+        1件分の処理をまとめるリクエストIDを発行
+
+        すでにリクエスト中であればそのIDを引き継ぐ
+
+        Yields:
+            リクエストID
+        """
+        current = _request_id.get()
+        if current is not None:
+            yield current
+            return
+
+        token = _request_id.set(uuid.uuid4().hex[:12])
+        try:
+            yield _request_id.get()
+        finally:
+            _request_id.reset(token)
+
+
+class RecentEvents:
+    """直近のイベントをメモリに保持するフック（画面表示用）"""
+
+    def __init__(self, maxlen: int = 500):
+        self._events: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict):
+        with self._lock:
+            self._events.append(event)
+
+    def events(self) -> List[Dict]:
+        """保持しているイベント（古い順）"""
+        with self._lock:
+            return list(self._events)
+
+
+class JsonLinesExporter:
+    """イベントをJSONL形式でファイルに追記するフック"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class PrometheusTextfileExporter:
+    """
+    集計値をPrometheusのテキスト形式で書き出すフック
+    （node_exporter の textfile collector で読み込む想定）
+    """
+
+    def __init__(self, path: str, min_interval: float = 5.0):
+        """
+        初期化
+
+        Args:
+            path: 出力先（.prom）
+            min_interval: 書き出しの最小間隔（秒）
+        """
+        self.path = path
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._timings: Dict[str, List[float]] = {}  # 段階名 -> [件数, 合計秒]
+        self._values: Dict[str, float] = {}         # 項目名 -> 合計
+        self._last_write = 0.0
+
+    def __call__(self, event: Dict):
+        with self._lock:
+            if event["type"] == "timing":
+                count_sum = self._timings.setdefault(event["name"], [0, 0.0])
+                count_sum[0] += 1
+                count_sum[1] += event["value"]
+            else:
+                self._values[event["name"]] = self._values.get(event["name"], 0) + event["value"]
+
+            if time.monotonic() - self._last_write >= self.min_interval:
+                self._write()
+
+    def flush(self):
+        """集計値を即時に書き出す"""
+        with self._lock:
+            self._write()
+
+    def render(self) -> str:
+        """Prometheusテキスト形式の文字列"""
+        lines = [
+            "# HELP receipt_stage_seconds Time spent per processing stage.",
+            "# TYPE receipt_stage_seconds summary",
+        ]
+        for name, (count, total) in sorted(self._timings.items()):
+            lines.append(f'receipt_stage_seconds_count{{stage="{name}"}} {count}')
+            lines.append(f'receipt_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+
+        lines.append("# HELP receipt_total Cumulative payload bytes and token counts.")
+        lines.append("# TYPE receipt_total counter")
+        for name, total in sorted(self._values.items()):
+            lines.append(f'receipt_total{{name="{name}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def _write(self):
+        """一時ファイル経由で書き出す（読み取り側に途中の内容を見せない）"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+        self._last_write = time.monotonic()
+
+
+def summarize_requests(events: List[Dict], limit: int = 20) -> List[Dict]:
+    """
+    イベントをリクエストIDごとにまとめる（画面表示用）
+
+    Args:
+        events: イベントのリスト（古い順）
+        limit: 返す件数（新しい順）
+
+    Returns:
+        request_id と各段階の値を持つ辞書のリスト
+    """
+    grouped: Dict[str, Dict] = {}
+    for event in events:
+        request_id = event.get("request_id")
+        if request_id is None:
+            continue
+        row = grouped.setdefault(request_id, {"request_id": request_id})
+        if event["type"] == "timing":
+            row[f"{event['name']} (ms)"] = round(event["value"] * 1000, 1)
+        else:
+            row[event["name"]] = event["value"]
+
+    return list(reversed(list(grouped.values())))[:limit]
+
+
+def default_metrics(metrics: Optional[Metrics]) -> Metrics:
+    """未指定の場合はフックなし（記録コストほぼゼロ）のインスタンスを返す"""
+    return metrics if metrics is not None else Metrics()
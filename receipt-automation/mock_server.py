@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+OpenAI互換のモックサーバー
+Chat Completions API と同じ形式で、決められたレシートJSONを返す（課金・ネットワーク不要）
+
+遅延・エラー率・レート制限（429）を設定でき、負荷試験やベンチマークをオフラインで実行できる
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from image_preprocessor import estimate_image_tokens
+
+# 返却するレシート（リクエスト中の画像ハッシュで選択するため、同じ画像には常に同じ結果）
+# キーの順は抽出用スキーマ（ReceiptProcessor.RESPONSE_FORMAT）の生成順に合わせる
+CANNED_RECEIPTS: List[Dict] = [
+    {"date": "2025/12/03", "payee": "業務スーパー金町店", "amount": 3330, "content": "業務用みそ汁"},
+    {"date": "2025/11/06", "payee": "くすりの福太郎", "amount": 2296, "content": "ワイパー用シート"},
+    {"date": "2025/11/10", "payee": "くすりの福太郎", "amount": 4332, "content": "キッチンペーパー"},
+    {"date": "2025/11/18", "payee": "セブン-イレブン", "amount": 440, "content": "文房具"},
+    {"date": "2025/12/10", "payee": "JR東日本", "amount": 1260, "content": "交通費"},
+]
+
+
+class MockConfig:
+    """モックサーバーの挙動設定"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+        chunk_interval: float = 0.0
+    ):
+        """
+        初期化
+
+        Args:
+            latency: 応答までの基本遅延（秒）
+            latency_jitter: 遅延のばらつき（秒、0〜この値を一様に加算）
+            error_rate: 500エラーを返す確率
+            rate_limit_rate: 429（レート制限）を返す確率
+            retry_after: 429のときに返す Retry-After（秒）
+            seed: 乱数シード（同じシード・同じ順序のリクエストなら同じ結果）
+            chunk_interval: 応答の生成時間（秒/断片）。ストリーミングでは断片ごとにこの間隔で送信し、
+                それ以外では全断片分を待ってから返す（latency は最初の断片までの時間）
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.chunk_interval = chunk_interval
+
+
+class MockServer:
+    """OpenAI互換のモックサーバー"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: Optional[MockConfig] = None):
+        """
+        初期化
+
+        Args:
+            host: 待ち受けアドレス
+            port: 待ち受けポート（0の場合は空きポートを自動選択）
+            config: 挙動設定
+        """
+        self.config = config or MockConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "succeeded": 0, "rate_limited": 0, "errors": 0}
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """クライアントに設定するベースURL"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockServer":
+        """バックグラウンドスレッドで起動"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self):
+        """フォアグラウンドで起動（Ctrl-Cで停止）"""
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _decide(self) -> tuple:
+        """今回のリクエストの結果（種別, 遅延秒）を決める"""
+        with self._lock:
+            self.stats["requests"] += 1
+            roll = self._random.random()
+            delay = self.config.latency + self._random.uniform(0, self.config.latency_jitter)
+
+            if roll < self.config.rate_limit_rate:
+                outcome = "rate_limited"
+            elif roll < self.config.rate_limit_rate + self.config.error_rate:
+                outcome = "errors"
+            else:
+                outcome = "succeeded"
+            self.stats[outcome] += 1
+        return outcome, delay
+
+    @staticmethod
+    def _image_parts(request: Dict) -> List[Dict]:
+        """リクエスト中の画像（image_url の中身）を出現順に取得"""
+        parts = []
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, list):
+                parts.extend(part["image_url"] for part in content if part.get("type") == "image_url")
+        return parts
+
+    @staticmethod
+    def _image_digest(request: Dict) -> bytes:
+        """リクエスト中の画像部分のハッシュ（画像がなければ本文全体）"""
+        digest = hashlib.sha256()
+        for image_url in MockServer._image_parts(request):
+            digest.update(image_url["url"].encode("utf-8"))
+        return digest.digest()
+
+    @staticmethod
+    def _prompt_tokens(request: Dict) -> int:
+        """
+        入力トークン数の概算
+
+        テキストは文字数から、画像は実APIと同じくdetailと解像度（タイル数）から見積もる
+        """
+        text_chars = 0
+        image_tokens = 0
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                text_chars += len(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    text_chars += len(part["text"])
+                elif part.get("type") == "image_url":
+                    detail = part["image_url"].get("detail", "auto")
+                    try:
+                        data = base64.b64decode(part["image_url"]["url"].split(",", 1)[1])
+                        with Image.open(io.BytesIO(data)) as img:
+                            width, height = img.size
+                    except Exception:
+                        width, height = 512, 512
+                    image_tokens += estimate_image_tokens(width, height, detail)
+        return text_chars // 4 + image_tokens
+
+    @staticmethod
+    def _receipt_for(image_url: Dict) -> Dict:
+        """画像に対応する決められたレシート（同じ画像には常に同じ結果）"""
+        digest = hashlib.sha256(image_url["url"].encode("utf-8")).digest()
+        return CANNED_RECEIPTS[digest[0] % len(CANNED_RECEIPTS)]
+
+    # ストリーミング応答の1断片の文字数
+    CHUNK_CHARS = 4
+
+    @classmethod
+    def _generate(cls, request: Dict) -> tuple:
+        """
+        応答の内容を作成
+
+        Args:
+            request: リクエスト本文
+
+        Returns:
+            (画像ハッシュ, 応答テキスト, finish_reason, usage)
+        """
+        digest = cls._image_digest(request)
+        images = cls._image_parts(request)
+        response_format = request.get("response_format")
+        schema_name = ((response_format or {}).get("json_schema") or {}).get("name")
+
+        if schema_name == "receipts":
+            # 複数画像をまとめたリクエストには、画像ごとの結果の配列を返す
+            content = json.dumps({"receipts": [
+                {"index": index, **cls._receipt_for(image_url), "error": ""}
+                for index, image_url in enumerate(images, start=1)
+            ]}, ensure_ascii=False)
+        else:
+            receipt = CANNED_RECEIPTS[digest[0] % len(CANNED_RECEIPTS)]
+            content = json.dumps(receipt, ensure_ascii=False)
+        if response_format is None:
+            # 出力形式の指定がない場合は、自由記述の応答らしくコードブロックで囲む
+            content = "以下が抽出結果です。\n```json\n" + content + "\n```"
+
+        # トークン数の概算（ベンチマークの比較用）
+        prompt_tokens = cls._prompt_tokens(request)
+        completion_tokens = len(content) // 2
+
+        # max_tokens を超える場合は実APIと同様に途中で打ち切る
+        finish_reason = "stop"
+        max_tokens = request.get("max_tokens")
+        if max_tokens is not None and completion_tokens > max_tokens:
+            content = content[:max_tokens * 2]
+            completion_tokens = max_tokens
+            finish_reason = "length"
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        return digest, content, finish_reason, usage
+
+    @classmethod
+    def completion_body(cls, request: Dict) -> Dict:
+        """
+        Chat Completions 形式の応答本文を作成（サーバーを起動せずに呼ぶこともできる）
+
+        Args:
+            request: リクエスト本文
+
+        Returns:
+            応答本文
+        """
+        digest, content, finish_reason, usage = cls._generate(request)
+        return {
+            "id": "chatcmpl-mock-" + digest.hex()[:12],
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": content}
+            }],
+            "usage": usage
+        }
+
+    def completion_chunks(self, request: Dict) -> List[Dict]:
+        """
+        ストリーミング（stream=True）の応答断片を作成
+
+        Args:
+            request: リクエスト本文
+
+        Returns:
+            chat.completion.chunk の本文のリスト（stream_options.include_usage 指定時は最後に usage のみの断片）
+        """
+        digest, content, finish_reason, usage = self._generate(request)
+        base = {
+            "id": "chatcmpl-mock-" + digest.hex()[:12],
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o")
+        }
+
+        chunks = []
+        for start in range(0, len(content), self.CHUNK_CHARS):
+            delta = {"content": content[start:start + self.CHUNK_CHARS]}
+            if start == 0:
+                delta["role"] = "assistant"
+            chunks.append({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunks.append({**base, "choices": [], "usage": usage})
+        return chunks
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, chunks: List[Dict]):
+                """Server-Sent Events で断片を順に送信（接続を閉じて終端を示す）"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                for index, chunk in enumerate(chunks):
+                    if index > 0 and server.config.chunk_interval > 0:
+                        time.sleep(server.config.chunk_interval)
+                    data = json.dumps(chunk, ensure_ascii=False)
+                    self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/mock/stats":
+                    with server._lock:
+                        self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                try:
+                    request = json.loads(raw)
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+                    return
+
+                outcome, delay = server._decide()
+                if delay > 0:
+                    time.sleep(delay)
+
+                if outcome == "rate_limited":
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                        {"Retry-After": str(server.config.retry_after)}
+                    )
+                elif outcome == "errors":
+                    self._send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+                elif request.get("stream"):
+                    self._send_stream(server.completion_chunks(request))
+                else:
+                    body = server.completion_body(request)
+                    if server.config.chunk_interval > 0:
+                        # ストリーミングと同じ生成時間を待ってからまとめて返す
+                        content = body["choices"][0]["message"]["content"]
+                        chunk_count = -(-len(content) // server.CHUNK_CHARS)
+                        time.sleep(server.config.chunk_interval * chunk_count)
+                    self._send_json(200, body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI互換のモックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="基本遅延（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="遅延のばらつき（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーの確率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429の確率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429時の Retry-After（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="応答の断片ごとの生成時間（秒）")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        chunk_interval=args.chunk_interval
+    )
+    server = MockServer(args.host, args.port, config)
+
+    print(f"🧪 モックサーバーを起動しました: {server.base_url}")
+    print(f"   OPENAI_BASE_URL={server.base_url} を設定すると、このサーバーを使用します")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n停止しました")
+
+
+if __name__ == "__main__":
+    main()
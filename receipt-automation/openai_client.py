@@ -0,0 +1,212 @@
+"""
+OpenAIクライアント管理モジュール
+接続プールを持つ長寿命クライアントの生成と、レート制限・タイムアウト時のリトライ
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+import openai
+
+T = TypeVar("T")
+
+# リトライ対象の例外（レート制限・タイムアウト・接続断・サーバーエラー）
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class ClientConfig:
+    """OpenAIクライアントの接続・リトライ設定"""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 10,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0
+    ):
+        """
+        初期化
+
+        Args:
+            base_url: APIのベースURL（Noneの場合は環境変数 OPENAI_BASE_URL、未設定なら公式API）
+            timeout: 1リクエストあたりのタイムアウト（秒）
+            connect_timeout: 接続確立のタイムアウト（秒）
+            max_connections: 接続プールの最大接続数
+            max_keepalive_connections: keep-aliveで保持する最大接続数
+            max_retries: リトライ回数の上限
+            backoff_base: バックオフの初期待ち時間（秒）
+            backoff_max: バックオフの最大待ち時間（秒）
+        """
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections
+        )
+
+    def create_client(self, api_key: str) -> openai.OpenAI:
+        """
+        同期クライアントを生成
+
+        リトライはこのモジュールで行うため、SDK側のリトライは無効にする
+
+        Args:
+            api_key: OpenAI APIキー
+
+        Returns:
+            接続プール付きのクライアント
+        """
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            timeout=self._timeout(),
+            max_retries=0,
+            http_client=httpx.Client(limits=self._limits(), timeout=self._timeout())
+        )
+
+    def create_async_client(self, api_key: str) -> openai.AsyncOpenAI:
+        """
+        非同期クライアントを生成
+
+        Args:
+            api_key: OpenAI APIキー
+
+        Returns:
+            接続プール付きの非同期クライアント
+        """
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            timeout=self._timeout(),
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=self._limits(), timeout=self._timeout())
+        )
+
+    def retry_delay(self, attempt: int, error: Exception) -> float:
+        """
+        次のリトライまでの待ち時間を計算
+
+        Retry-After ヘッダーがあればそれに従い、なければ
+        フルジッター付き指数バックオフ（0〜base*2^attempt のランダム）を使う
+
+        Args:
+            attempt: これまでの試行回数（0始まり）
+            error: 発生した例外
+
+        Returns:
+            待ち時間（秒）
+        """
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """
+    例外のレスポンスヘッダーから Retry-After を取得
+
+    Args:
+        error: APIの例外
+
+    Returns:
+        待ち時間（秒）、ヘッダーがなければNone
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    # HTTP日付形式
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def call_with_retry(config: ClientConfig, func: Callable[[], T]) -> T:
+    """
+    リトライ付きでAPIを呼び出す
+
+    Args:
+        config: リトライ設定
+        func: API呼び出し（引数なしの関数）
+
+    Returns:
+        func の戻り値
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= config.max_retries:
+                raise
+            time.sleep(config.retry_delay(attempt, e))
+            attempt += 1
+
+
+async def call_with_retry_async(config: ClientConfig, func: Callable[[], Awaitable[T]]) -> T:
+    """
+    リトライ付きでAPIを呼び出す（非同期版）
+
+    Args:
+        config: リトライ設定
+        func: API呼び出し（引数なしでコルーチンを返す関数）
+
+    Returns:
+        func の戻り値
+    """
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= config.max_retries:
+                raise
+            await asyncio.sleep(config.retry_delay(attempt, e))
+            attempt += 1
@@ -0,0 +1,163 @@
+"""
+PDF描画モジュール
+PyMuPDFでPDFの各ページを画像に変換（プロセスプールで並列、一時ファイルなし）
+"""
+
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+
+def _render_page(
+    pdf_path: str,
+    page_number: int,
+    target_long_edge: int,
+    min_dpi: int,
+    max_dpi: int,
+    grayscale: bool
+) -> Tuple[int, bytes]:
+    """
+    1ページを描画してPNGのバイト列を返す（ワーカープロセスで実行）
+
+    ページの物理サイズから、長辺が target_long_edge px になるDPIを選ぶ
+    """
+    with fitz.open(pdf_path) as doc:
+        page = doc[page_number - 1]
+        long_edge_inch = max(page.rect.width, page.rect.height) / 72
+        dpi = min(max_dpi, max(min_dpi, target_long_edge / long_edge_inch))
+        zoom = dpi / 72
+
+        pix = page.get_pixmap(
+            matrix=fitz.Matrix(zoom, zoom),
+            colorspace=fitz.csGRAY if grayscale else fitz.csRGB,
+            alpha=False
+        )
+        return page_number, pix.tobytes("png")
+
+
+class PdfRenderer:
+    """PDFページの並列描画クラス"""
+
+    def __init__(
+        self,
+        target_long_edge: int = 2000,
+        min_dpi: int = 100,
+        max_dpi: int = 300,
+        grayscale: bool = False,
+        workers: Optional[int] = None
+    ):
+        """
+        初期化
+
+        Args:
+            target_long_edge: 描画後の長辺の目標（px）。ページサイズに応じてDPIを決める
+            min_dpi: DPIの下限
+            max_dpi: DPIの上限
+            grayscale: グレースケールで描画するか
+            workers: 描画プロセス数（Noneの場合はCPU数）
+        """
+        self.target_long_edge = target_long_edge
+        self.min_dpi = min_dpi
+        self.max_dpi = max_dpi
+        self.grayscale = grayscale
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> Executor:
+        """描画用のプロセスプール（初回利用時に生成）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self):
+        """プロセスプールを終了"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def page_count(pdf_path: str) -> int:
+        """
+        ページ数を取得
+
+        Args:
+            pdf_path: PDFファイルのパス
+
+        Returns:
+            ページ数
+        """
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+
+    def resolve_pages(self, pdf_path: str, pages: Optional[Sequence[int]] = None) -> List[int]:
+        """
+        描画対象のページ番号を決定
+
+        Args:
+            pdf_path: PDFファイルのパス
+            pages: ページ番号（1始まり）のリスト。Noneの場合は全ページ
+
+        Returns:
+            ページ番号のリスト
+        """
+        count = self.page_count(pdf_path)
+        if pages is None:
+            return list(range(1, count + 1))
+
+        invalid = [p for p in pages if not 1 <= p <= count]
+        if invalid:
+            raise ValueError(f"存在しないページが指定されました: {invalid}（全{count}ページ）")
+        return list(pages)
+
+    def _render_args(self, pdf_path: str, page_number: int) -> tuple:
+        """ワーカーに渡す引数"""
+        return (
+            str(pdf_path), page_number, self.target_long_edge,
+            self.min_dpi, self.max_dpi, self.grayscale
+        )
+
+    def render(self, pdf_path: str, pages: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        ページを並列に描画し、ページ順に返す
+
+        Args:
+            pdf_path: PDFファイルのパス
+            pages: ページ番号（1始まり）のリスト。Noneの場合は全ページ
+
+        Yields:
+            (ページ番号, PNGのバイト列)
+        """
+        page_numbers = self.resolve_pages(pdf_path, pages)
+        futures = [
+            self.executor.submit(_render_page, *self._render_args(pdf_path, page_number))
+            for page_number in page_numbers
+        ]
+        for future in futures:
+            yield future.result()
+
+    async def render_page_async(self, pdf_path: str, page_number: int) -> bytes:
+        """
+        1ページを描画（非同期版、描画はプロセスプールで実行）
+
+        Args:
+            pdf_path: PDFファイルのパス
+            page_number: ページ番号（1始まり）
+
+        Returns:
+            PNGのバイト列
+        """
+        loop = asyncio.get_running_loop()
+        _, png_bytes = await loop.run_in_executor(
+            self.executor, _render_page, *self._render_args(pdf_path, page_number)
+        )
+        return png_bytes
@@ -0,0 +1,221 @@
+"""
+抽出結果キャッシュモジュール
+画像バイト列のハッシュをキーに、正規化済みの抽出データをディスクへ保存
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class ReceiptCache:
+    """抽出結果のコンテンツアドレス型ディスクキャッシュ"""
+
+    # デフォルトの上限値
+    DEFAULT_MAX_ENTRIES = 5000
+    DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # 50MB
+    DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60  # 30日
+
+    def __init__(
+        self,
+        cache_dir: str = ".cache/receipts",
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_seconds: Optional[float] = DEFAULT_MAX_AGE_SECONDS
+    ):
+        """
+        初期化
+
+        Args:
+            cache_dir: キャッシュ保存先ディレクトリ
+            max_entries: 保持する最大件数
+            max_bytes: ディスク上の合計サイズ上限（バイト）
+            max_age_seconds: エントリの有効期限（秒、Noneの場合は無期限）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # キー -> (更新時刻, バイト数)。古い順に並ぶ
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        # キー -> 抽出データ（ヒット時にディスクを読まないためのメモリ層）
+        self._memory: Dict[str, Dict] = {}
+        self._total_bytes = 0
+
+        self._load_index()
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model: str, prompt_version: str) -> str:
+        """
+        キャッシュキーを生成
+
+        Args:
+            image_bytes: 画像のバイト列
+            model: 使用モデル名
+            prompt_version: プロンプトのバージョン
+
+        Returns:
+            SHA-256の16進文字列
+        """
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        """キーに対応するファイルパス（先頭2文字でシャーディング）"""
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _load_index(self):
+        """起動時にディスク上のエントリを走査してインデックスを構築"""
+        found = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+
+        for mtime, key, size in sorted(found):
+            self._index[key] = (mtime, size)
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict()
+
+    def _is_expired(self, mtime: float) -> bool:
+        """有効期限切れかどうか"""
+        if self.max_age_seconds is None:
+            return False
+        return time.time() - mtime > self.max_age_seconds
+
+    def _remove(self, key: str):
+        """エントリを削除（ロック取得済みで呼ぶこと）"""
+        entry = self._index.pop(key, None)
+        self._memory.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry[1]
+        try:
+            self._path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """件数・サイズ・期限の上限を超えたエントリを古い順に削除（ロック取得済みで呼ぶこと）"""
+        while self._index:
+            key, (mtime, _) = next(iter(self._index.items()))
+            over_limit = (
+                len(self._index) > self.max_entries
+                or self._total_bytes > self.max_bytes
+            )
+            if not over_limit and not self._is_expired(mtime):
+                break
+            self._remove(key)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        キャッシュから抽出データを取得
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            抽出データ（見つからない場合はNone）
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if self._is_expired(entry[0]):
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            data = self._memory.get(key)
+            if data is None:
+                try:
+                    with open(self._path_for(key), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    self._remove(key)
+                    self.misses += 1
+                    return None
+                self._memory[key] = data
+
+            self._index.move_to_end(key)
+            self.hits += 1
+            return dict(data)
+
+    def put(self, key: str, data: Dict):
+        """
+        抽出データをキャッシュに保存
+
+        Args:
+            key: キャッシュキー
+            data: 正規化済みの抽出データ
+        """
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 一時ファイルに書いてからリネーム（書き込み途中のファイルを読ませない）
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._index[key] = (time.time(), len(payload))
+            self._total_bytes += len(payload)
+            self._memory[key] = dict(data)
+            self._evict()
+
+    def clear(self):
+        """全エントリを削除"""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self) -> Dict:
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            ヒット数・ミス数・件数・合計サイズ
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self._total_bytes
+            }
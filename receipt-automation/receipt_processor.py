@@ -4,31 +4,242 @@ OpenAI GPT-4 Vision APIを使用してレシート情報を抽出
 """
 
 import os
+import asyncio
 import base64
 import json
+import time
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
 from datetime import datetime
 import openai
 from PIL import Image
 import io
 
+from receipt_cache import ReceiptCache
+from image_preprocessor import ImageBuffer, ImagePreprocessor, estimate_image_tokens, open_buffer, sniff_mime_type
+from openai_client import ClientConfig
+from extraction_backend import Completion, ExtractionBackend, OpenAIBackend, completion_from_body
+from pdf_renderer import PdfRenderer
+from metrics import Metrics, default_metrics
+from duplicate_index import DuplicateIndex, describe_duplicate
+from incremental_json import IncrementalJsonParser
+
+# ストリーミング抽出で、フィールドが確定するたびに呼ばれる関数（これまでに確定した全フィールドを受け取る）
+FieldsCallback = Callable[[Dict], None]
+
+
+def plan_packs(costs: Sequence[int], budget: int, max_items: int) -> List[List[int]]:
+    """
+    入力順を保ったまま、トークン数の合計が予算に収まるように画像をまとめる
+
+    Args:
+        costs: 画像ごとの入力トークン数
+        budget: 1リクエストあたりの画像の入力トークン数の上限
+        max_items: 1リクエストあたりの画像の枚数の上限
+
+    Returns:
+        リクエストごとの画像の位置（costs の添字）のリスト。1枚で予算を超える画像は単独で送る
+    """
+    packs: List[List[int]] = []
+    current: List[int] = []
+    total = 0
+    for index, cost in enumerate(costs):
+        if current and (total + cost > budget or len(current) >= max_items):
+            packs.append(current)
+            current, total = [], 0
+        current.append(index)
+        total += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    応答を囲むコードブロック（```json ... ```）を取り除く
+
+    構造化出力に対応していない互換サーバーは、JSONをコードブロックで囲んで返すことがある
+
+    Args:
+        text: モデルの応答テキスト
+
+    Returns:
+        コードブロックの中身（囲まれていない場合は前後の空白を除いた応答）
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    return text
+
+
+class ReceiptRecord(NamedTuple):
+    """レシートから抽出した1件分の情報"""
+    date: str      # YYYY/MM/DD
+    payee: str     # 支払先
+    content: str   # 支払内容
+    amount: float  # 税込合計金額
+
 
 class ReceiptProcessor:
     """レシート画像処理クラス"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    # 使用モデルとプロンプトのバージョン（キャッシュキーに含める）
+    MODEL = "gpt-4o"
+    PROMPT_VERSION = "3"
+
+    # 抽出用プロンプト（変更時は PROMPT_VERSION を上げること）
+    # 出力形式は RESPONSE_FORMAT のスキーマで強制するため、プロンプトには抽出ルールだけを書く
+    SYSTEM_PROMPT = """レシート画像から経費情報を抽出する。
+- date: 日付 YYYY/MM/DD（不明なら空文字）
+- payee: 正式な店舗名
+- amount: 税込合計金額
+- content: 支払内容を簡潔に（例: 文房具、交通費、飲食費）"""
+
+    USER_PROMPT = "このレシートを抽出してください。"
+
+    # 構造化出力のスキーマ（応答は必ずこの形のJSONになる）
+    # 応答はスキーマの順に生成されるため、ストリーミング時に確認欄を早く開けるよう
+    # 登録に必須の date / payee / amount を自由記述の content より先に置く
+    RESPONSE_FORMAT = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "receipt",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "date": {"type": "string"},
+                    "payee": {"type": "string"},
+                    "amount": {"type": "number"},
+                    "content": {"type": "string"}
+                },
+                "required": ["date", "payee", "amount", "content"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+    # 応答の最大トークン数（4項目のJSONに十分な量。打ち切られた場合はエラー）
+    MAX_OUTPUT_TOKENS = 150
+
+    # 複数の画像を1リクエストにまとめる場合（process_receipts_packed）のプロンプトとスキーマ
+    # システムプロンプトは共通で、画像の前に「画像N」の見出しを付けて送る
+    PACKED_USER_PROMPT = "画像ごとに抽出し、index に画像番号を入れてください。レシートとして読み取れない画像は error に理由を書いてください。"
+
+    PACKED_RESPONSE_FORMAT = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "receipts",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "receipts": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "index": {"type": "integer"},
+                                "date": {"type": "string"},
+                                "payee": {"type": "string"},
+                                "content": {"type": "string"},
+                                "amount": {"type": "number"},
+                                "error": {"type": "string"}
+                            },
+                            "required": ["index", "date", "payee", "content", "amount", "error"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["receipts"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+    # まとめる画像の入力トークン数の合計と枚数の上限（1枚で超える場合は単独で送る）
+    PACK_TOKEN_BUDGET = 8000
+    PACK_MAX_IMAGES = 8
+
+    # バッチAPIのリクエストファイル（JSONL）の1行が呼び出すエンドポイント
+    BATCH_ENDPOINT = "/v1/chat/completions"
+
+    # 拡張子とMIMEタイプの対応（中身から判定できない場合の補助）
+    MIME_TYPES = {
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".png": "image/png",
+        ".heic": "image/heic",
+    }
+
+    # 画像ファイルサイズの上限（10MB）
+    MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[ReceiptCache] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        client_config: Optional[ClientConfig] = None,
+        pdf_renderer: Optional[PdfRenderer] = None,
+        backend: Optional[ExtractionBackend] = None,
+        metrics: Optional[Metrics] = None,
+        duplicate_index: Optional[DuplicateIndex] = None,
+        duplicate_policy: str = "warn"
+    ):
         """
         初期化
 
         Args:
             api_key: OpenAI APIキー（Noneの場合は環境変数から取得）
+            cache: 抽出結果キャッシュ（Noneの場合はキャッシュしない）
+            preprocessor: 画像前処理（Noneの場合は元画像をそのまま送信）
+            client_config: 接続・リトライ設定（Noneの場合はデフォルト）
+            pdf_renderer: PDFページの描画設定（Noneの場合はデフォルト）
+            backend: 抽出バックエンド（Noneの場合はOpenAI APIを使用）
+            metrics: 段階ごとの所要時間などの計測先（Noneの場合は計測しない）
+            duplicate_index: 処理済みレシートの知覚ハッシュの索引（Noneの場合は重複を検出しない）
+            duplicate_policy: 重複の可能性がある場合の扱い
+                warn: 抽出を続け、結果に duplicate_of（一致した登録済みレシート）を付ける
+                reject: APIを呼ばずにエラーとして返す
         """
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OpenAI APIキーが設定されていません")
+        if duplicate_policy not in ("warn", "reject"):
+            raise ValueError(f"duplicate_policy は warn または reject を指定してください: {duplicate_policy}")
 
-        openai.api_key = self.api_key
+        self.cache = cache
+        self.metrics = default_metrics(metrics)
+        self.duplicate_index = duplicate_index
+        self.duplicate_policy = duplicate_policy
+        self.preprocessor = preprocessor
+        self.pdf_renderer = pdf_renderer or PdfRenderer()
+
+        if backend is None:
+            api_key = api_key or os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OpenAI APIキーが設定されていません")
+            backend = OpenAIBackend(api_key, client_config)
+        self.backend = backend
+
+    def close(self):
+        """バックエンドの接続とPDF描画のプロセスプールを閉じる"""
+        self.backend.close()
+        self.pdf_renderer.close()
+
+    def _run(self, coro):
+        """コルーチンを新しいイベントループで実行し、そのループで使った接続を閉じる"""
+        async def runner():
+            try:
+                return await coro
+            finally:
+                await self.backend.aclose()
+
+        return asyncio.run(runner())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def encode_image(self, image_path: str) -> str:
         """
@@ -41,7 +252,49 @@ class ReceiptProcessor:
             base64エンコードされた画像
         """
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
+            return base64.b64encode(image_file.read()).decode("ascii")
+
+    def prepare_image(self, image_path: str) -> Tuple[str, str, str]:
+        """
+        API送信用に画像を準備
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            (base64エンコードされた画像, MIMEタイプ, detailレベル)
+        """
+        image_bytes = Path(image_path).read_bytes()
+        mime_type = (
+            sniff_mime_type(image_bytes)
+            or self.MIME_TYPES.get(Path(image_path).suffix.lower(), "image/jpeg")
+        )
+        return self.prepare_image_bytes(image_bytes, mime_type)
+
+    def prepare_image_bytes(self, image_bytes: ImageBuffer, mime_type: str) -> Tuple[str, str, str]:
+        """
+        API送信用に画像を準備（メモリ上のバイト列から）
+
+        読み込み済みのバッファをそのまま前処理・base64エンコードに使い、複製しない
+
+        Args:
+            image_bytes: 画像のバイト列（bytes / memoryview）
+            mime_type: 画像のMIMEタイプ
+
+        Returns:
+            (base64エンコードされた画像, MIMEタイプ, detailレベル)
+        """
+        if self.preprocessor is None:
+            return base64.b64encode(image_bytes).decode("ascii"), mime_type, "auto"
+
+        prepared = self.preprocessor.prepare_buffer(image_bytes)
+        return base64.b64encode(prepared.data).decode("ascii"), prepared.mime_type, prepared.detail
+
+    def _cache_version(self) -> str:
+        """キャッシュキーに含めるバージョン文字列（前処理の設定も含む）"""
+        if self.preprocessor is None:
+            return self.PROMPT_VERSION
+        return f"{self.PROMPT_VERSION}+{self.preprocessor.signature()}"
 
     def validate_image(self, image_path: str) -> Tuple[bool, str]:
         """
@@ -53,171 +306,1168 @@ class ReceiptProcessor:
         Returns:
             (有効フラグ, エラーメッセージ)
         """
+        _, _, error_msg = self.read_image(image_path)
+        return error_msg == "", error_msg
+
+    def read_image(self, image_path: str) -> Tuple[Optional[bytes], str, str]:
+        """
+        画像ファイルを1回だけ読み込み、そのバッファでバリデーションする
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            (画像のバイト列, MIMEタイプ, エラーメッセージ)。無効な場合はバイト列がNone
+        """
         image_path = Path(image_path)
 
         # ファイル存在チェック
         if not image_path.exists():
-            return False, "ファイルが見つかりません"
+            return None, "", "ファイルが見つかりません"
 
         # 拡張子チェック
         valid_extensions = [".jpg", ".jpeg", ".png", ".heic"]
         if image_path.suffix.lower() not in valid_extensions:
-            return False, f"対応していない画像形式です（対応形式: {', '.join(valid_extensions)}）"
+            return None, "", f"対応していない画像形式です（対応形式: {', '.join(valid_extensions)}）"
+
+        # ファイルサイズチェック（読み込む前に確認）
+        size_error = self._check_size(image_path.stat().st_size)
+        if size_error:
+            return None, "", size_error
+
+        try:
+            image_bytes = image_path.read_bytes()
+        except OSError as e:
+            return None, "", f"ファイルの読み込みに失敗しました: {str(e)}"
+
+        mime_type, error_msg = self._check_image_buffer(memoryview(image_bytes))
+        if error_msg:
+            return None, "", error_msg
+        return image_bytes, mime_type, ""
+
+    def validate_image_bytes(self, image_bytes: ImageBuffer) -> Tuple[bool, str]:
+        """
+        メモリ上の画像をバリデーション
+
+        Args:
+            image_bytes: 画像のバイト列（bytes / memoryview）
+
+        Returns:
+            (有効フラグ, エラーメッセージ)
+        """
+        _, error_msg = self._check_image_buffer(image_bytes)
+        return error_msg == "", error_msg
+
+    def _check_size(self, size: int) -> str:
+        """ファイルサイズの上限チェック（超過時はエラーメッセージ）"""
+        if size > self.MAX_IMAGE_BYTES:
+            return (
+                f"ファイルサイズが大きすぎます"
+                f"（{size / (1024 * 1024):.1f}MB > {self.MAX_IMAGE_BYTES // (1024 * 1024)}MB）"
+            )
+        return ""
+
+    def _check_image_buffer(self, image_bytes: ImageBuffer) -> Tuple[str, str]:
+        """
+        バッファの形式判定・サイズ・破損チェック
+
+        Args:
+            image_bytes: 画像のバイト列
+
+        Returns:
+            (MIMEタイプ, エラーメッセージ)
+        """
+        size_error = self._check_size(memoryview(image_bytes).nbytes)
+        if size_error:
+            return "", size_error
 
-        # ファイルサイズチェック（10MB）
-        file_size_mb = image_path.stat().st_size / (1024 * 1024)
-        if file_size_mb > 10:
-            return False, f"ファイルサイズが大きすぎます（{file_size_mb:.1f}MB > 10MB）"
+        # 先頭バイトで形式を判定
+        mime_type = sniff_mime_type(image_bytes)
+        if mime_type is None:
+            return "", "対応していない画像形式です（対応形式: JPEG, PNG, HEIC）"
 
-        # 画像として開けるかチェック
+        # 画像として開けるかチェック（同じバッファを読むだけでコピーしない）
         try:
-            with Image.open(image_path) as img:
+            with Image.open(open_buffer(image_bytes)) as img:
                 img.verify()
         except Exception as e:
-            return False, f"画像ファイルが破損しています: {str(e)}"
+            return "", f"画像ファイルが破損しています: {str(e)}"
+
+        return mime_type, ""
+
+    def validate_pdf(self, pdf_path: str) -> Tuple[bool, str]:
+        """
+        PDFファイルをバリデーション
+
+        Args:
+            pdf_path: PDFファイルのパス
+
+        Returns:
+            (有効フラグ, エラーメッセージ)
+        """
+        pdf_path = Path(pdf_path)
+
+        if not pdf_path.exists():
+            return False, "ファイルが見つかりません"
+
+        if pdf_path.suffix.lower() != ".pdf":
+            return False, "PDFファイルではありません"
+
+        try:
+            if self.pdf_renderer.page_count(str(pdf_path)) == 0:
+                return False, "PDFにページがありません"
+        except Exception as e:
+            return False, f"PDFファイルが破損しています: {str(e)}"
 
         return True, ""
 
-    def extract_receipt_info(self, image_path: str) -> Tuple[bool, Dict, str]:
+    def _lookup_cache(self, image_bytes: ImageBuffer) -> Tuple[Optional[str], Optional[Dict]]:
         """
-        レシート画像から情報を抽出
+        キャッシュを確認（同じ画像・モデル・プロンプトならAPIを呼ばない）
 
         Args:
-            image_path: 画像ファイルのパス
+            image_bytes: 画像のバイト列
+
+        Returns:
+            (キャッシュキー, キャッシュ済みデータ)。キャッシュ無効時はキーもNone
+        """
+        if self.cache is None:
+            return None, None
+
+        cache_key = ReceiptCache.make_key(image_bytes, self.MODEL, self._cache_version())
+        return cache_key, self.cache.get(cache_key)
+
+    def _build_request(self, base64_image: str, mime_type: str, detail: str) -> Dict:
+        """
+        Chat Completions APIのリクエスト引数を組み立てる
+
+        Args:
+            base64_image: base64エンコードされた画像
+            mime_type: 画像のMIMEタイプ
+            detail: Vision APIのdetailレベル
+
+        Returns:
+            chat.completions.create に渡すキーワード引数
+        """
+        return {
+            "model": self.MODEL,  # 最新のVision対応モデル
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": self.USER_PROMPT
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{base64_image}",
+                                "detail": detail
+                            }
+                        }
+                    ]
+                }
+            ],
+            "response_format": self.RESPONSE_FORMAT,
+            "max_tokens": self.MAX_OUTPUT_TOKENS,
+            "temperature": 0.1  # 精度優先
+        }
+
+    def _build_packed_request(self, images: Sequence[Tuple[str, str, str]]) -> Dict:
+        """
+        複数の画像をまとめたリクエスト引数を組み立てる
+
+        Args:
+            images: 画像ごとの (base64エンコードされた画像, MIMEタイプ, detailレベル)
+
+        Returns:
+            chat.completions.create に渡すキーワード引数
+        """
+        content: List[Dict] = [{"type": "text", "text": f"{self.PACKED_USER_PROMPT}（{len(images)}枚）"}]
+        for number, (base64_image, mime_type, detail) in enumerate(images, start=1):
+            content.append({"type": "text", "text": f"画像{number}"})
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:{mime_type};base64,{base64_image}", "detail": detail}
+            })
+
+        return {
+            "model": self.MODEL,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            "response_format": self.PACKED_RESPONSE_FORMAT,
+            "max_tokens": self.MAX_OUTPUT_TOKENS * len(images),
+            "temperature": 0.1
+        }
+
+    def _pack_overhead(self) -> int:
+        """まとめたリクエストで画像以外にかかる入力トークン数の概算（日本語は1文字1トークンとして多めに見積もる）"""
+        return len(self.SYSTEM_PROMPT) + len(self.PACKED_USER_PROMPT) + 10
+
+    def _prepare_for_pack(self, image_bytes: ImageBuffer, mime_type: str) -> Tuple[Tuple[str, str, str], int]:
+        """
+        API送信用に画像を準備し、画像の入力トークン数を見積もる
+
+        Args:
+            image_bytes: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+
+        Returns:
+            ((base64エンコードされた画像, MIMEタイプ, detailレベル), 入力トークン数)
+        """
+        if self.preprocessor is not None:
+            prepared = self.preprocessor.prepare_buffer(image_bytes)
+            encoded = (base64.b64encode(prepared.data).decode("ascii"), prepared.mime_type, prepared.detail)
+            return encoded, estimate_image_tokens(prepared.width, prepared.height, prepared.detail)
+
+        encoded = self.prepare_image_bytes(image_bytes, mime_type)
+        try:
+            with Image.open(open_buffer(image_bytes)) as img:
+                width, height = img.size
+        except Exception:
+            # 解像度を読めない形式（HEICなど）は最大サイズとして見積もる
+            width, height = 2048, 2048
+        return encoded, estimate_image_tokens(width, height, encoded[2])
+
+    def _record_payload(self, image_bytes: ImageBuffer, base64_image: str):
+        """画像のサイズ（元画像・送信時のbase64）を記録"""
+        self.metrics.record("image_bytes", memoryview(image_bytes).nbytes)
+        self.metrics.record("payload_bytes", len(base64_image))
+
+    def _record_usage(self, completion: Completion):
+        """APIの usage に含まれるトークン数を記録"""
+        if completion.prompt_tokens is not None:
+            self.metrics.record("prompt_tokens", completion.prompt_tokens)
+        if completion.completion_tokens is not None:
+            self.metrics.record("completion_tokens", completion.completion_tokens)
+
+    def _parse_completion(self, completion: Completion) -> Tuple[bool, Dict, str]:
+        """
+        バックエンドの応答を抽出データに変換
+
+        Args:
+            completion: バックエンドの応答
 
         Returns:
             (成功フラグ, 抽出データ, エラーメッセージ)
         """
-        # バリデーション
-        is_valid, error_msg = self.validate_image(image_path)
-        if not is_valid:
-            return False, {}, error_msg
+        if completion.refusal:
+            return False, {}, f"モデルが抽出を拒否しました: {completion.refusal}"
+        if completion.finish_reason == "length":
+            return False, {}, f"応答が最大トークン数（{self.MAX_OUTPUT_TOKENS}）で打ち切られました"
+        return self._parse_response(completion.text)
+
+    def _parse_response(self, response_text: str) -> Tuple[bool, Dict, str]:
+        """
+        APIのレスポンス本文を抽出データに変換・正規化
+
+        Args:
+            response_text: モデルの応答テキスト（スキーマに沿ったJSON）
 
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
         try:
-            # 画像をbase64エンコード
-            base64_image = self.encode_image(image_path)
-
-            # OpenAI APIに送信
-            client = openai.OpenAI(api_key=self.api_key)
-
-            response = client.chat.completions.create(
-                model="gpt-4o",  # 最新のVision対応モデル
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """あなたはレシート情報抽出の専門家です。
-レシート画像から以下の情報を正確に抽出してJSON形式で返してください。
-
-必須フィールド:
-- date: 日付（YYYY/MM/DD形式）
-- payee: 支払先/店舗名
-- content: 支払内容/品目（複数ある場合はカンマ区切り）
-- amount: 合計金額（数値のみ）
-
-注意事項:
-- 日付が不明な場合は今日の日付を使用
-- 金額は消費税込みの合計金額を抽出
-- 支払先は正式な店舗名を使用
-- 支払内容は簡潔に（例: 文房具、交通費、飲食費など）"""
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "このレシートから日付、支払先、支払内容、金額を抽出してJSON形式で返してください。"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500,
-                temperature=0.1  # 精度優先
-            )
+            payload = json.loads(strip_code_fence(response_text))
+        except json.JSONDecodeError as e:
+            return False, {}, f"応答のJSONを解析できませんでした: {str(e)}"
 
-            # レスポンスからJSON抽出
-            response_text = response.choices[0].message.content
-
-            # JSONブロックを抽出（```json ... ``` の中身）
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
+        try:
+            record = self._to_record(payload)
+        except ValueError as e:
+            return False, {}, str(e)
+        return True, record._asdict(), ""
+
+    def _parse_packed_completion(self, completion: Completion, count: int) -> List[Optional[Tuple[bool, Dict, str]]]:
+        """
+        まとめたリクエストの応答を画像ごとの抽出データに分ける
+
+        Args:
+            completion: バックエンドの応答
+            count: リクエストに含めた画像の枚数
+
+        Returns:
+            画像順の (成功フラグ, 抽出データ, エラーメッセージ) のリスト。
+            応答全体が使えない場合（拒否・打ち切り・JSONの不正）や結果が欠けた画像は None（1枚ずつ送り直す）
+        """
+        if completion.refusal or completion.finish_reason == "length":
+            return [None] * count
+        try:
+            payload = json.loads(strip_code_fence(completion.text))
+        except json.JSONDecodeError:
+            return [None] * count
+
+        items: Dict[int, Dict] = {}
+        for item in payload.get("receipts", []) if isinstance(payload, dict) else []:
+            if isinstance(item, dict) and isinstance(item.get("index"), int):
+                items.setdefault(item["index"], item)
+
+        results: List[Optional[Tuple[bool, Dict, str]]] = []
+        for number in range(1, count + 1):
+            item = items.get(number)
+            if item is None:
+                results.append(None)
+            elif item.get("error"):
+                results.append((False, {}, f"レシートを読み取れませんでした: {item['error']}"))
             else:
-                json_text = response_text
+                try:
+                    results.append((True, self._to_record(item)._asdict(), ""))
+                except ValueError as e:
+                    results.append((False, {}, str(e)))
+        return results
 
-            # JSONパース
-            data = json.loads(json_text)
+    @staticmethod
+    def _to_record(payload) -> ReceiptRecord:
+        """
+        応答のJSONを検証・正規化して ReceiptRecord に変換
 
-            # データ検証
-            required_fields = ["date", "payee", "content", "amount"]
-            for field in required_fields:
-                if field not in data:
-                    return False, {}, f"必須フィールド '{field}' が見つかりません"
+        Args:
+            payload: json.loads の結果
 
-            # 日付形式の正規化
-            date_str = str(data["date"])
-            try:
-                # 様々な日付形式に対応
-                if "/" in date_str:
-                    date_obj = datetime.strptime(date_str, "%Y/%m/%d")
-                elif "-" in date_str:
-                    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                else:
-                    date_obj = datetime.now()
+        Returns:
+            抽出した情報
 
-                data["date"] = date_obj.strftime("%Y/%m/%d")
+        Raises:
+            ValueError: 必須フィールドの欠落・型の誤り
+        """
+        if not isinstance(payload, dict):
+            raise ValueError("応答がJSONオブジェクトではありません")
+        for field in ReceiptRecord._fields:
+            if field not in payload:
+                raise ValueError(f"必須フィールド '{field}' が見つかりません")
+
+        # 日付形式の正規化
+        date_str = str(payload["date"]).strip()
+        date_obj = datetime.now()
+        for date_format in ("%Y/%m/%d", "%Y-%m-%d"):
+            try:
+                date_obj = datetime.strptime(date_str, date_format)
+                break
             except ValueError:
                 # パースできない場合は今日の日付
-                data["date"] = datetime.now().strftime("%Y/%m/%d")
+                continue
 
-            # 金額を数値に変換
+        # 金額を数値に変換
+        amount = payload["amount"]
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
             try:
-                amount_str = str(data["amount"]).replace(",", "").replace("¥", "").replace("円", "").strip()
-                data["amount"] = float(amount_str)
+                amount = str(amount).replace(",", "").replace("¥", "").replace("円", "").strip()
+                amount = float(amount)
             except ValueError:
-                return False, {}, f"金額の変換に失敗しました: {data['amount']}"
+                raise ValueError(f"金額の変換に失敗しました: {payload['amount']}")
+
+        return ReceiptRecord(
+            date=date_obj.strftime("%Y/%m/%d"),
+            payee=str(payload["payee"]),
+            content=str(payload["content"]),
+            amount=float(amount)
+        )
+
+    def extract_receipt_info(self, image_path: str) -> Tuple[bool, Dict, str]:
+        """
+        レシート画像から情報を抽出
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        with self.metrics.request(), self.metrics.stage("extract"):
+            # 読み込み・バリデーション（ファイルは1回だけ読む）
+            with self.metrics.stage("validate"):
+                image_bytes, mime_type, error_msg = self.read_image(image_path)
+            if image_bytes is None:
+                return False, {}, error_msg
+
+            return self._extract_image_bytes(image_bytes, mime_type)
+
+    def _check_duplicate(self, image_bytes: ImageBuffer) -> Tuple[Optional[int], Optional[Dict]]:
+        """
+        処理済みのレシートと見た目が一致するかを確認
+
+        Args:
+            image_bytes: 画像のバイト列
+
+        Returns:
+            (知覚ハッシュ, 一致した登録済みレシート)。索引なし・ハッシュ計算不可の場合はどちらもNone
+        """
+        if self.duplicate_index is None:
+            return None, None
+
+        try:
+            with self.metrics.stage("duplicate_check"):
+                image_hash = self.duplicate_index.compute_hash(image_bytes)
+                match = self.duplicate_index.find(image_hash)
+        except Exception:
+            # デコードできない形式（HEICなど）は重複チェックを省略
+            return None, None
+
+        if match is not None:
+            self.metrics.record("duplicates", 1)
+        return image_hash, match
+
+    def _apply_duplicate(
+        self,
+        result: Tuple[bool, Dict, str],
+        image_hash: Optional[int],
+        match: Optional[Dict]
+    ) -> Tuple[bool, Dict, str]:
+        """
+        抽出結果に知覚ハッシュと重複候補を付ける
+
+        索引への登録はExcelへの保存後に行う（DuplicateIndex.add_entries）。
+        抽出しただけで破棄したレシートを、次回重複として扱わないため
+
+        Args:
+            result: (成功フラグ, 抽出データ, エラーメッセージ)
+            image_hash: 知覚ハッシュ
+            match: 一致した登録済みレシート
 
-            return True, data, ""
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        success, data, error_msg = result
+        if not success or image_hash is None:
+            return result
+
+        data = {**data, "image_hash": image_hash}
+        if match is not None:
+            data["duplicate_of"] = match
+        return True, data, error_msg
+
+    def _duplicate_error(self, match: Dict) -> Tuple[bool, Dict, str]:
+        """reject 時のエラー"""
+        return False, {}, f"登録済みのレシートと重複している可能性があります: {describe_duplicate(match)}"
+
+    def _extract_image_bytes(
+        self,
+        image_bytes: ImageBuffer,
+        mime_type: str,
+        on_fields: Optional[FieldsCallback] = None
+    ) -> Tuple[bool, Dict, str]:
+        """
+        バリデーション済みの画像バイト列から情報を抽出
+
+        重複の索引がある場合は、APIを呼ぶ前に見た目が一致する処理済みレシートを探す
+
+        Args:
+            image_bytes: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+            on_fields: 指定した場合は応答をストリーミングで受け取り、フィールドが確定するたびに呼ぶ
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        image_hash, match = self._check_duplicate(image_bytes)
+        if match is not None and self.duplicate_policy == "reject":
+            return self._duplicate_error(match)
+
+        result = self._extract_uncached(image_bytes, mime_type, on_fields)
+        return self._apply_duplicate(result, image_hash, match)
+
+    def _extract_uncached(
+        self,
+        image_bytes: ImageBuffer,
+        mime_type: str,
+        on_fields: Optional[FieldsCallback] = None
+    ) -> Tuple[bool, Dict, str]:
+        """
+        キャッシュ、なければAPIで情報を抽出
+
+        Args:
+            image_bytes: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+            on_fields: 指定した場合は応答をストリーミングで受け取り、フィールドが確定するたびに呼ぶ
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        with self.metrics.stage("cache_lookup"):
+            cache_key, cached = self._lookup_cache(image_bytes)
+        if cached is not None:
+            self.metrics.record("cache_hits", 1)
+            if on_fields is not None:
+                on_fields(dict(cached))
+            return True, cached, ""
+
+        try:
+            # 画像を前処理してbase64エンコード
+            with self.metrics.stage("encode"):
+                prepared = self.prepare_image_bytes(image_bytes, mime_type)
+            self._record_payload(image_bytes, prepared[0])
+            request = self._build_request(*prepared)
+
+            # バックエンド（OpenAI API）に送信
+            with self.metrics.stage("api"):
+                if on_fields is None:
+                    completion = self.backend.complete(request)
+                else:
+                    completion = self._stream_completion(request, on_fields)
+            self._record_usage(completion)
+
+            # 応答を検証して抽出データに変換
+            with self.metrics.stage("parse"):
+                success, data, error_msg = self._parse_completion(completion)
+
+            if success and cache_key is not None:
+                self.cache.put(cache_key, data)
+
+            return success, data, error_msg
 
         except openai.APIError as e:
             return False, {}, f"OpenAI APIエラー: {str(e)}"
         except Exception as e:
             return False, {}, f"予期しないエラー: {str(e)}"
 
-    def process_receipt_to_expense(self, image_path: str) -> Tuple[bool, Dict, str]:
+    def _stream_completion(self, request: Dict, on_fields: FieldsCallback) -> Completion:
         """
-        レシート画像を処理して経費データに変換
+        応答をストリーミングで受け取り、フィールドが確定するたびに on_fields を呼ぶ
+
+        Args:
+            request: chat.completions.create に渡すキーワード引数
+            on_fields: これまでに確定したフィールドを受け取る関数
+
+        Returns:
+            応答全体（断片を連結したもの）
+        """
+        parser = IncrementalJsonParser()
+        parts: List[str] = []
+        refusal_parts: List[str] = []
+        extra: Dict = {}
+        first_field = True
+        start = time.perf_counter()
+
+        for chunk in self.backend.stream(request):
+            for name in ("prompt_tokens", "completion_tokens", "finish_reason"):
+                value = getattr(chunk, name)
+                if value is not None:
+                    extra[name] = value
+            # 拒否理由も本文と同じく差分で届く
+            if chunk.refusal:
+                refusal_parts.append(chunk.refusal)
+            if not chunk.text:
+                continue
+
+            parts.append(chunk.text)
+            if parser.feed(chunk.text):
+                if first_field:
+                    # 最初のフィールドが表示できるまでの時間
+                    self.metrics.emit("timing", "first_field", time.perf_counter() - start)
+                    first_field = False
+                on_fields(dict(parser.fields))
+
+        if refusal_parts:
+            extra["refusal"] = "".join(refusal_parts)
+        return Completion(text="".join(parts), **extra)
+
+    def _open_source(self, source: Union[ImageBuffer, BinaryIO]) -> memoryview:
+        """
+        バイト列・ファイルオブジェクトを memoryview として取得
+
+        BytesIO（StreamlitのUploadedFileを含む）は内部バッファをコピーせずに参照する。
+        それ以外のファイルオブジェクトは上限サイズ+1バイトまで読み込む
+
+        Args:
+            source: bytes / bytearray / memoryview / BytesIO / 読み込み可能なファイルオブジェクト
+
+        Returns:
+            画像データの memoryview（呼び出し側で release する）
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return memoryview(source)
+        if isinstance(source, io.BytesIO):
+            return source.getbuffer()
+        if hasattr(source, "read"):
+            return memoryview(source.read(self.MAX_IMAGE_BYTES + 1))
+        raise TypeError(f"画像データとして扱えない型です: {type(source).__name__}")
+
+    def extract_receipt_info_from_bytes(
+        self,
+        source: Union[ImageBuffer, BinaryIO],
+        on_fields: Optional[FieldsCallback] = None
+    ) -> Tuple[bool, Dict, str]:
+        """
+        メモリ上のレシート画像から情報を抽出（一時ファイル不要）
+
+        Args:
+            source: 画像のバイト列（bytes / memoryview）またはファイルオブジェクト（BytesIO など）
+            on_fields: 指定した場合は応答をストリーミングで受け取り、フィールドが確定するたびに
+                これまでに確定したフィールド（正規化前の値）を渡して呼ぶ
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        with self.metrics.request(), self.metrics.stage("extract"):
+            try:
+                buffer = self._open_source(source)
+            except (OSError, TypeError, ValueError) as e:
+                return False, {}, f"画像の読み込みに失敗しました: {str(e)}"
+
+            with buffer:
+                with self.metrics.stage("validate"):
+                    mime_type, error_msg = self._check_image_buffer(buffer)
+                if error_msg:
+                    return False, {}, error_msg
+
+                return self._extract_image_bytes(buffer, mime_type, on_fields)
+
+    async def extract_receipt_info_async(
+        self,
+        image_path: str
+    ) -> Tuple[bool, Dict, str]:
+        """
+        レシート画像から情報を抽出（非同期版）
 
         Args:
             image_path: 画像ファイルのパス
 
         Returns:
-            (成功フラグ, 経費データ, メッセージ)
+            (成功フラグ, 抽出データ, エラーメッセージ)
         """
-        success, data, error_msg = self.extract_receipt_info(image_path)
+        with self.metrics.request(), self.metrics.stage("extract"):
+            # 読み込み・バリデーション（ファイルI/Oはイベントループを塞がないようスレッドで実行）
+            with self.metrics.stage("validate"):
+                image_bytes, mime_type, error_msg = await asyncio.to_thread(self.read_image, image_path)
+            if image_bytes is None:
+                return False, {}, error_msg
 
-        if not success:
-            return False, {}, error_msg
+            return await self._extract_image_bytes_async(image_bytes, mime_type)
+
+    async def _extract_image_bytes_async(
+        self,
+        image_bytes: ImageBuffer,
+        mime_type: str
+    ) -> Tuple[bool, Dict, str]:
+        """
+        バリデーション済みの画像バイト列から情報を抽出（非同期版）
+
+        Args:
+            image_bytes: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
 
-        # 経費データに整形
-        expense_data = {
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        image_hash, match = await asyncio.to_thread(self._check_duplicate, image_bytes)
+        if match is not None and self.duplicate_policy == "reject":
+            return self._duplicate_error(match)
+
+        result = await self._extract_uncached_async(image_bytes, mime_type)
+        return await asyncio.to_thread(self._apply_duplicate, result, image_hash, match)
+
+    async def _extract_uncached_async(
+        self,
+        image_bytes: ImageBuffer,
+        mime_type: str
+    ) -> Tuple[bool, Dict, str]:
+        """
+        キャッシュ、なければAPIで情報を抽出（非同期版）
+
+        Args:
+            image_bytes: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        try:
+            # ハッシュ計算・前処理はCPUを使うためスレッドで実行
+            with self.metrics.stage("cache_lookup"):
+                cache_key, cached = await asyncio.to_thread(self._lookup_cache, image_bytes)
+            if cached is not None:
+                self.metrics.record("cache_hits", 1)
+                return True, cached, ""
+
+            with self.metrics.stage("encode"):
+                prepared = await asyncio.to_thread(self.prepare_image_bytes, image_bytes, mime_type)
+            self._record_payload(image_bytes, prepared[0])
+            request = self._build_request(*prepared)
+
+            with self.metrics.stage("api"):
+                completion = await self.backend.complete_async(request)
+            self._record_usage(completion)
+
+            with self.metrics.stage("parse"):
+                success, data, error_msg = self._parse_completion(completion)
+
+            if success and cache_key is not None:
+                await asyncio.to_thread(self.cache.put, cache_key, data)
+
+            return success, data, error_msg
+
+        except openai.APIError as e:
+            return False, {}, f"OpenAI APIエラー: {str(e)}"
+        except Exception as e:
+            return False, {}, f"予期しないエラー: {str(e)}"
+
+    def _to_expense(self, data: Dict) -> Dict:
+        """抽出データを経費データに整形"""
+        expense = {
             "date": data["date"],
             "payee": data["payee"][:30],  # 30文字制限
             "content": data["content"],
             "amount": data["amount"]
         }
+        for key in ("image_hash", "duplicate_of"):
+            if key in data:
+                expense[key] = data[key]
+        return expense
+
+    def _success_message(self, expense: Dict, message: str) -> str:
+        """成功時のメッセージ（重複の可能性がある場合は注意書きを付ける）"""
+        if "duplicate_of" in expense:
+            return f"{message}（⚠️ 重複の可能性: {describe_duplicate(expense['duplicate_of'])}）"
+        return message
+
+    def process_receipt_to_expense(self, image_path: str) -> Tuple[bool, Dict, str]:
+        """
+        レシート画像を処理して経費データに変換
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            (成功フラグ, 経費データ, メッセージ)
+        """
+        with self.metrics.request(), self.metrics.stage("process_receipt"):
+            success, data, error_msg = self.extract_receipt_info(image_path)
+
+        return self._expense_result((success, data, error_msg))
+
+    def process_receipt_to_expense_from_bytes(
+        self,
+        source: Union[ImageBuffer, BinaryIO],
+        on_fields: Optional[FieldsCallback] = None
+    ) -> Tuple[bool, Dict, str]:
+        """
+        メモリ上のレシート画像を処理して経費データに変換
+
+        Args:
+            source: 画像のバイト列（bytes / memoryview）またはファイルオブジェクト（BytesIO など）
+            on_fields: 指定した場合は応答をストリーミングで受け取り、フィールドが確定するたびに呼ぶ
+
+        Returns:
+            (成功フラグ, 経費データ, メッセージ)
+        """
+        with self.metrics.request(), self.metrics.stage("process_receipt"):
+            success, data, error_msg = self.extract_receipt_info_from_bytes(source, on_fields)
+
+        return self._expense_result((success, data, error_msg))
+
+    async def process_receipt_to_expense_async(
+        self,
+        image_path: str
+    ) -> Tuple[bool, Dict, str]:
+        """
+        レシート画像を処理して経費データに変換（非同期版）
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            (成功フラグ, 経費データ, メッセージ)
+        """
+        with self.metrics.request(), self.metrics.stage("process_receipt"):
+            success, data, error_msg = await self.extract_receipt_info_async(image_path)
+
+        return self._expense_result((success, data, error_msg))
+
+    async def process_receipts_async(
+        self,
+        image_paths: List[str],
+        concurrency: int = 4
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        複数のレシート画像を並行処理（非同期版）
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            concurrency: 同時に実行するAPIリクエスト数の上限
 
-        return True, expense_data, "レシート情報の抽出に成功しました"
+        Returns:
+            入力と同じ順序の (成功フラグ, 経費データ, メッセージ) のリスト
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency は1以上を指定してください")
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def worker(image_path: str) -> Tuple[bool, Dict, str]:
+            async with semaphore:
+                try:
+                    return await self.process_receipt_to_expense_async(image_path)
+                except Exception as e:
+                    return False, {}, f"予期しないエラー: {str(e)}"
+
+        return list(await asyncio.gather(*(worker(str(p)) for p in image_paths)))
+
+    async def process_receipts_packed_async(
+        self,
+        image_paths: List[str],
+        concurrency: int = 4,
+        token_budget: Optional[int] = None,
+        max_images: Optional[int] = None
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        複数のレシート画像を数枚ずつ1リクエストにまとめて処理（非同期版）
+
+        システムプロンプトと往復の遅延を複数の画像で共有する。まとめる枚数は画像の入力トークン数の
+        見積もりが token_budget に収まる範囲で決め、応答は画像ごとの結果に分ける。
+        応答全体が使えなかった場合や結果が欠けた画像は、1枚ずつのリクエストで送り直す
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            concurrency: 同時に実行するAPIリクエスト数の上限
+            token_budget: 1リクエストあたりの入力トークン数の上限（Noneの場合は PACK_TOKEN_BUDGET）
+            max_images: 1リクエストあたりの画像の枚数の上限（Noneの場合は PACK_MAX_IMAGES）
+
+        Returns:
+            入力と同じ順序の (成功フラグ, 経費データ, メッセージ) のリスト
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency は1以上を指定してください")
+        token_budget = token_budget or self.PACK_TOKEN_BUDGET
+        max_images = max_images or self.PACK_MAX_IMAGES
+
+        results: List[Optional[Tuple[bool, Dict, str]]] = [None] * len(image_paths)
+        pending = []  # (位置, 画像のバイト列, MIMEタイプ, キャッシュキー, 知覚ハッシュ, 一致した登録済みレシート)
+
+        with self.metrics.stage("process_packed", images=len(image_paths)):
+            # 読み込み・重複・キャッシュの確認は1枚ずつ
+            for position, image_path in enumerate(image_paths):
+                image_bytes, mime_type, error_msg = await asyncio.to_thread(self.read_image, str(image_path))
+                if image_bytes is None:
+                    results[position] = (False, {}, error_msg)
+                    continue
+
+                image_hash, match = await asyncio.to_thread(self._check_duplicate, image_bytes)
+                if match is not None and self.duplicate_policy == "reject":
+                    results[position] = self._duplicate_error(match)
+                    continue
+
+                cache_key, cached = await asyncio.to_thread(self._lookup_cache, image_bytes)
+                if cached is not None:
+                    self.metrics.record("cache_hits", 1)
+                    results[position] = await asyncio.to_thread(
+                        self._apply_duplicate, (True, cached, ""), image_hash, match
+                    )
+                    continue
+                pending.append((position, image_bytes, mime_type, cache_key, image_hash, match))
+
+            # 前処理とトークン数の見積もり（CPUを使うためスレッドで実行）
+            with self.metrics.stage("encode"):
+                prepared = await asyncio.gather(*(
+                    asyncio.to_thread(self._prepare_for_pack, image_bytes, mime_type)
+                    for _, image_bytes, mime_type, _, _, _ in pending
+                ))
+            packs = plan_packs([tokens for _, tokens in prepared], token_budget - self._pack_overhead(), max_images)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def send(pack: List[int]):
+                async with semaphore:
+                    extracted = await self._extract_pack_async([prepared[i][0] for i in pack])
+
+                for i, result in zip(pack, extracted):
+                    position, image_bytes, mime_type, cache_key, image_hash, match = pending[i]
+                    if result is None:
+                        async with semaphore:
+                            result = await self._extract_uncached_async(image_bytes, mime_type)
+                    elif result[0] and cache_key is not None:
+                        await asyncio.to_thread(self.cache.put, cache_key, result[1])
+                    results[position] = await asyncio.to_thread(self._apply_duplicate, result, image_hash, match)
+
+            await asyncio.gather(*(send(pack) for pack in packs))
+
+        return [self._expense_result(result) for result in results]
+
+    async def _extract_pack_async(
+        self,
+        images: List[Tuple[str, str, str]]
+    ) -> List[Optional[Tuple[bool, Dict, str]]]:
+        """
+        前処理済みの画像をまとめて1リクエストで抽出
+
+        Args:
+            images: 画像ごとの (base64エンコードされた画像, MIMEタイプ, detailレベル)
+
+        Returns:
+            画像順の (成功フラグ, 抽出データ, エラーメッセージ) のリスト
+            （送り直しが必要な画像は None。通信・APIエラーの場合は全画像が None）
+        """
+        for base64_image, _, _ in images:
+            self.metrics.record("payload_bytes", len(base64_image))
+        request = self._build_packed_request(images)
+
+        try:
+            with self.metrics.stage("api", images=len(images)):
+                completion = await self.backend.complete_async(request)
+        except Exception:
+            # 1回の通信・APIエラーでまとめた全画像を失敗にせず、1枚ずつ送り直す（エラーはそちらで返す）
+            self.metrics.record("pack_errors", 1)
+            return [None] * len(images)
+        self._record_usage(completion)
+
+        with self.metrics.stage("parse"):
+            return self._parse_packed_completion(completion, len(images))
+
+    async def process_pdf_to_expenses_async(
+        self,
+        pdf_path: str,
+        pages: Optional[Sequence[int]] = None,
+        concurrency: int = 4
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        PDFの各ページをレシートとして処理（非同期版）
+
+        ページの描画はプロセスプールで並列に行い、描画できたページから順に
+        一時ファイルを介さずメモリ上の画像のまま抽出へ回す
+
+        Args:
+            pdf_path: PDFファイルのパス
+            pages: 処理するページ番号（1始まり）。Noneの場合は全ページ
+            concurrency: 同時に実行するAPIリクエスト数の上限
+
+        Returns:
+            ページ順の (成功フラグ, 経費データ, メッセージ) のリスト
+            （PDF自体が不正な場合はエラー1件のみのリスト）
+        """
+        is_valid, error_msg = await asyncio.to_thread(self.validate_pdf, pdf_path)
+        if not is_valid:
+            return [(False, {}, error_msg)]
+
+        try:
+            page_numbers = await asyncio.to_thread(self.pdf_renderer.resolve_pages, str(pdf_path), pages)
+        except ValueError as e:
+            return [(False, {}, str(e))]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def worker(page_number: int) -> Tuple[bool, Dict, str]:
+            with self.metrics.request():
+                try:
+                    with self.metrics.stage("render", page=page_number):
+                        png_bytes = await self.pdf_renderer.render_page_async(str(pdf_path), page_number)
+                except Exception as e:
+                    return False, {}, f"{page_number}ページ目の描画に失敗しました: {str(e)}"
+
+                async with semaphore:
+                    success, data, error_msg = await self._extract_image_bytes_async(png_bytes, "image/png")
+
+            if not success:
+                return False, {}, f"{page_number}ページ目: {error_msg}"
+            expense = self._to_expense(data)
+            return True, expense, self._success_message(expense, f"{page_number}ページ目のレシート情報の抽出に成功しました")
+
+        return list(await asyncio.gather(*(worker(p) for p in page_numbers)))
+
+    def process_pdf_to_expenses(
+        self,
+        pdf_path: str,
+        pages: Optional[Sequence[int]] = None,
+        concurrency: int = 4
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        PDFの各ページをレシートとして処理
+
+        Args:
+            pdf_path: PDFファイルのパス
+            pages: 処理するページ番号（1始まり）。Noneの場合は全ページ
+            concurrency: 同時に実行するAPIリクエスト数の上限
+
+        Returns:
+            ページ順の (成功フラグ, 経費データ, メッセージ) のリスト
+        """
+        return self._run(self.process_pdf_to_expenses_async(pdf_path, pages, concurrency))
+
+    def process_receipts(
+        self,
+        image_paths: List[str],
+        concurrency: int = 4
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        複数のレシート画像を並行処理
+
+        1件ごとの失敗は結果のタプルに記録し、残りの処理は継続する
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            concurrency: 同時に実行するAPIリクエスト数の上限
+
+        Returns:
+            入力と同じ順序の (成功フラグ, 経費データ, メッセージ) のリスト
+        """
+        return self._run(self.process_receipts_async(image_paths, concurrency))
+
+    def process_receipts_packed(
+        self,
+        image_paths: List[str],
+        concurrency: int = 4,
+        token_budget: Optional[int] = None,
+        max_images: Optional[int] = None
+    ) -> List[Tuple[bool, Dict, str]]:
+        """
+        複数のレシート画像を数枚ずつ1リクエストにまとめて処理
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            concurrency: 同時に実行するAPIリクエスト数の上限
+            token_budget: 1リクエストあたりの入力トークン数の上限（Noneの場合は PACK_TOKEN_BUDGET）
+            max_images: 1リクエストあたりの画像の枚数の上限（Noneの場合は PACK_MAX_IMAGES）
+
+        Returns:
+            入力と同じ順序の (成功フラグ, 経費データ, メッセージ) のリスト
+        """
+        return self._run(self.process_receipts_packed_async(image_paths, concurrency, token_budget, max_images))
+
+    @staticmethod
+    def batch_custom_id(index: int) -> str:
+        """バッチのリクエストの custom_id（画像の通し番号から作成）"""
+        return f"receipt-{index:06d}"
+
+    def write_batch_file(
+        self,
+        image_paths: Sequence[str],
+        batch_path: str,
+        first_index: int = 0
+    ) -> Tuple[Dict[str, Dict], Dict[str, Tuple[bool, Dict, str]]]:
+        """
+        バッチAPIのリクエストファイル（JSONL）を作成
+
+        1行が画像1枚のリクエストで、custom_id は batch_custom_id（receipt-<通し番号>）。
+        読み込みエラー・重複（reject 時）・キャッシュ済みの画像は送らず、その場で結果を確定する
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            batch_path: 作成するJSONLファイルのパス
+            first_index: custom_id の通し番号の開始値（複数のファイルに分ける場合に重複させないため）
+
+        Returns:
+            (custom_id → 送信した画像の情報（path, cache_key）,
+             custom_id → 送信せずに確定した (成功フラグ, 経費データ, メッセージ))
+        """
+        requests: Dict[str, Dict] = {}
+        resolved: Dict[str, Tuple[bool, Dict, str]] = {}
+
+        with open(batch_path, "w", encoding="utf-8") as f:
+            for index, image_path in enumerate(image_paths, start=first_index):
+                custom_id = self.batch_custom_id(index)
+                image_bytes, mime_type, error_msg = self.read_image(str(image_path))
+                if image_bytes is None:
+                    resolved[custom_id] = (False, {}, error_msg)
+                    continue
+
+                image_hash, match = self._check_duplicate(image_bytes)
+                if match is not None and self.duplicate_policy == "reject":
+                    resolved[custom_id] = self._duplicate_error(match)
+                    continue
+
+                cache_key, cached = self._lookup_cache(image_bytes)
+                if cached is not None:
+                    self.metrics.record("cache_hits", 1)
+                    resolved[custom_id] = self._expense_result(self._apply_duplicate((True, cached, ""), image_hash, match))
+                    continue
+
+                prepared = self.prepare_image_bytes(image_bytes, mime_type)
+                self._record_payload(image_bytes, prepared[0])
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": self.BATCH_ENDPOINT,
+                    "body": self._build_request(*prepared)
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                requests[custom_id] = {"path": str(image_path), "cache_key": cache_key}
+
+        return requests, resolved
+
+    def read_batch_results(
+        self,
+        lines: Iterable[str],
+        requests: Dict[str, Dict]
+    ) -> Dict[str, Tuple[bool, Dict, str]]:
+        """
+        バッチAPIの結果ファイル（出力・エラーのJSONL）を custom_id ごとの経費データに変換
+
+        抽出に成功した結果はキャッシュに保存し、重複の索引がある場合は画像を読み直して照合する
+
+        Args:
+            lines: 結果ファイルの行（出力ファイルとエラーファイルを連結したもの。解析できない行は読み飛ばす）
+            requests: write_batch_file が返した custom_id → 送信した画像の情報
+
+        Returns:
+            custom_id → (成功フラグ, 経費データ, メッセージ)。結果がなかったリクエストもエラーとして含む
+        """
+        results: Dict[str, Tuple[bool, Dict, str]] = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 途中で切れた行などは読み飛ばす（該当リクエストは「結果に含まれていません」になる）
+                continue
+            if not isinstance(record, dict):
+                continue
+            custom_id = record.get("custom_id")
+            if custom_id not in requests or custom_id in results:
+                continue
+
+            result = self._parse_batch_record(record)
+            request = requests[custom_id]
+            if result[0]:
+                if self.cache is not None and request.get("cache_key"):
+                    self.cache.put(request["cache_key"], result[1])
+                if self.duplicate_index is not None:
+                    image_bytes, _, _ = self.read_image(request["path"])
+                    if image_bytes is not None:
+                        result = self._apply_duplicate(result, *self._check_duplicate(image_bytes))
+            results[custom_id] = self._expense_result(result)
+
+        for custom_id in requests:
+            results.setdefault(custom_id, (False, {}, "バッチの結果に含まれていません"))
+        return results
+
+    def _parse_batch_record(self, record: Dict) -> Tuple[bool, Dict, str]:
+        """
+        結果ファイルの1行を抽出データに変換
+
+        Args:
+            record: 結果ファイルの1行（custom_id, response, error）
+
+        Returns:
+            (成功フラグ, 抽出データ, エラーメッセージ)
+        """
+        error = record.get("error")
+        if error:
+            return False, {}, f"バッチエラー: {error.get('code', '')} {error.get('message', '')}".strip()
+
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") != 200:
+            message = (body.get("error") or {}).get("message", "")
+            return False, {}, f"OpenAI APIエラー（{response.get('status_code')}）: {message}"
+
+        try:
+            completion = completion_from_body(body)
+        except (KeyError, IndexError, TypeError) as e:
+            return False, {}, f"バッチの応答を解析できませんでした: {str(e)}"
+        self._record_usage(completion)
+        return self._parse_completion(completion)
+
+    def _expense_result(self, result: Tuple[bool, Dict, str]) -> Tuple[bool, Dict, str]:
+        """抽出結果を (成功フラグ, 経費データ, メッセージ) に整形"""
+        success, data, error_msg = result
+        if not success:
+            return False, {}, error_msg
+        expense = self._to_expense(data)
+        return True, expense, self._success_message(expense, "レシート情報の抽出に成功しました")
 
 
 def test_receipt_processor():
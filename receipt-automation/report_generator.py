@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+精算書の一括作成モジュール
+社員ごとにテンプレートのコピーへ明細を記入し、領収書を添付したPDFとあわせてプロセスプールで並列に作成する
+
+出力ファイルのタイムスタンプは申請日に固定するため、同じ入力からは常に同じバイト列のファイルができる
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps
+
+from excel_handler import ExpenseExcelHandler
+from ledger_index import normalize_date
+from xlsx_patch import rewrite_archive
+
+DEFAULT_TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+# 出力先（月次ブックと同じ場所に出力すると、明細索引に精算書の明細が二重に取り込まれるため分ける）
+DEFAULT_OUTPUT_DIR = "reports"
+
+# PDFのレイアウト（A4縦、単位はpt）
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+FONT = "japan"  # PyMuPDF内蔵の日本語フォント（埋め込まないため軽量）
+TABLE_COLUMNS = [("日付", 80), ("支払先", 150), ("支払内容", 165), ("金額", 100)]
+ROW_HEIGHT = 20
+ROWS_PER_PAGE = 28
+
+# 添付する領収書画像の長辺（px）
+RECEIPT_LONG_EDGE = 1600
+
+
+class ReportRequest(NamedTuple):
+    """社員1人分の精算書の作成依頼"""
+    employee: str          # 氏名
+    report_date: str       # 申請日（YYYY/MM/DD）
+    entries: List[Dict]    # date, payee, content, amount と任意の receipt（領収書の画像・PDFのパス）
+    department: str = ""   # 所属
+
+
+class ReportResult(NamedTuple):
+    """精算書の作成結果"""
+    employee: str
+    success: bool
+    xlsx_path: Optional[str]
+    pdf_path: Optional[str]
+    message: str
+
+
+def report_basename(employee: str, report_date: str) -> str:
+    """
+    出力ファイル名（拡張子なし）
+
+    例: 立替経費精算書_掛屋大志朗_20251203
+    """
+    safe_name = re.sub(r'[\\/:*?"<>|\s]+', "", employee)
+    date_text = datetime.strptime(report_date, "%Y/%m/%d").strftime("%Y%m%d")
+    return f"立替経費精算書_{safe_name}_{date_text}"
+
+
+def _freeze_archive(path: Path, timestamp: datetime):
+    """
+    xlsxの更新日時（ZIP内の各ファイルの時刻・docProps/core.xml）を固定値に揃える
+
+    部分書き換えで保存した場合はテンプレートの時刻のままだが、続きシートを追加して
+    通常の保存をした場合は保存時刻が入るため、どちらの場合も同じ結果になるように書き直す。
+    再圧縮するのは core.xml だけで、その他のメンバーはヘッダーの時刻だけを書き換える
+    """
+    iso_time = timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def restamp_core(archive: zipfile.ZipFile) -> Dict[str, bytes]:
+        if "docProps/core.xml" not in archive.namelist():
+            return {}
+        core = archive.read("docProps/core.xml")
+        return {"docProps/core.xml": re.sub(
+            rb"(<dcterms:(?:created|modified)[^>]*>)[^<]*(</dcterms:)",
+            rb"\g<1>" + iso_time.encode("ascii") + rb"\g<2>",
+            core
+        )}
+
+    rewrite_archive(str(path), str(path), restamp_core, date_time=timestamp.timetuple()[:6])
+
+
+def _write_workbook(request: ReportRequest, template_path: str, output_path: Path, timestamp: datetime):
+    """テンプレートのコピーに申請者欄と明細を記入"""
+    shutil.copyfile(template_path, output_path)
+
+    # 16件までは変更したシートのXMLだけを書き換える（超える場合は続きシートを追加して通常の保存）
+    handler = ExpenseExcelHandler(str(output_path), overflow=True, fast_save=True)
+    handler.load()
+    try:
+        handler.set_applicant(request.employee, request.department, request.report_date)
+        _, rejected = handler.add_expense_entries(request.entries, save=False)
+        if rejected:
+            details = "、".join(f"{item['index'] + 1}件目: {item['message']}" for item in rejected)
+            raise ValueError(f"記入できない明細があります（{details}）")
+        handler.save()
+    finally:
+        handler.close()
+
+    _freeze_archive(output_path, timestamp)
+
+
+def _fit_text(text: str, width: float, fontsize: float) -> str:
+    """列幅に収まるように末尾を省略"""
+    font = fitz.Font(FONT)
+    if font.text_length(text, fontsize=fontsize) <= width:
+        return text
+    while text and font.text_length(text + "…", fontsize=fontsize) > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def _draw_table_header(page, y: float):
+    """明細表の見出し行"""
+    x = MARGIN
+    for label, width in TABLE_COLUMNS:
+        rect = fitz.Rect(x, y, x + width, y + ROW_HEIGHT)
+        page.draw_rect(rect, color=(0, 0, 0), fill=(0.9, 0.9, 0.9), width=0.5)
+        page.insert_text((x + 4, y + 14), label, fontname=FONT, fontsize=10)
+        x += width
+
+
+def _draw_row(page, y: float, values: Sequence[str], bold_line: bool = False):
+    """明細表の1行（金額は右寄せ）"""
+    x = MARGIN
+    for (label, width), value in zip(TABLE_COLUMNS, values):
+        page.draw_rect(fitz.Rect(x, y, x + width, y + ROW_HEIGHT), color=(0, 0, 0), width=1.0 if bold_line else 0.5)
+        text = _fit_text(value, width - 8, 9)
+        if label == "金額":
+            text_x = x + width - 4 - fitz.Font(FONT).text_length(text, fontsize=9)
+        else:
+            text_x = x + 4
+        page.insert_text((text_x, y + 14), text, fontname=FONT, fontsize=9)
+        x += width
+
+
+def _draw_report_pages(doc, request: ReportRequest):
+    """精算書（申請者欄・明細表・合計）のページを作成"""
+    date_obj = datetime.strptime(request.report_date, "%Y/%m/%d")
+    entries = request.entries
+    chunks = [entries[i:i + ROWS_PER_PAGE] for i in range(0, len(entries), ROWS_PER_PAGE)] or [[]]
+
+    for page_index, chunk in enumerate(chunks):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        title = "立替経費精算書" if page_index == 0 else f"立替経費精算書（{page_index + 1}/{len(chunks)}）"
+        page.insert_text((MARGIN, 70), title, fontname=FONT, fontsize=18)
+        page.insert_text(
+            (MARGIN, 100), f"申請日: {date_obj.year}年{date_obj.month}月{date_obj.day}日", fontname=FONT, fontsize=10
+        )
+        page.insert_text((MARGIN + 250, 100), f"所属: {request.department}", fontname=FONT, fontsize=10)
+        page.insert_text((MARGIN + 250, 118), f"氏名: {request.employee}", fontname=FONT, fontsize=10)
+
+        y = 140
+        _draw_table_header(page, y)
+        for entry in chunk:
+            y += ROW_HEIGHT
+            _draw_row(page, y, [
+                str(entry["date"]), str(entry["payee"]), str(entry["content"]), f"¥{float(entry['amount']):,.0f}"
+            ])
+
+        if page_index == len(chunks) - 1:
+            total = sum(float(entry["amount"]) for entry in entries)
+            y += ROW_HEIGHT
+            _draw_row(page, y, ["合計", "", f"{len(entries)}件", f"¥{total:,.0f}"], bold_line=True)
+
+
+def _receipt_image(path: Path) -> bytes:
+    """領収書画像を向きを補正・縮小したJPEGに変換（HEICなどPDFに直接入れられない形式にも対応）"""
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((RECEIPT_LONG_EDGE, RECEIPT_LONG_EDGE))
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+
+def _append_receipt(doc, path: Path, caption: str):
+    """領収書を1ページとして追加（PDFの場合は全ページを追加）"""
+    if path.suffix.lower() == ".pdf":
+        with fitz.open(path) as receipt_pdf:
+            doc.insert_pdf(receipt_pdf)
+        return
+
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_text((MARGIN, MARGIN), caption, fontname=FONT, fontsize=10)
+    rect = fitz.Rect(MARGIN, MARGIN + 15, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN)
+    page.insert_image(rect, stream=_receipt_image(path), keep_proportion=True)
+
+
+def _write_pdf(request: ReportRequest, output_path: Path, timestamp: datetime):
+    """精算書と領収書をまとめたPDFを作成"""
+    pdf_time = timestamp.strftime("D:%Y%m%d%H%M%S")
+    with fitz.open() as doc:
+        _draw_report_pages(doc, request)
+        for index, entry in enumerate(request.entries, start=1):
+            if entry.get("receipt"):
+                caption = f"領収書 {index}: {entry['date']} {entry['payee']} ¥{float(entry['amount']):,.0f}"
+                _append_receipt(doc, Path(entry["receipt"]), caption)
+
+        doc.set_metadata({
+            "title": f"立替経費精算書 {request.employee}",
+            "author": request.employee,
+            "creator": "receipt-automation",
+            "producer": "receipt-automation",
+            "creationDate": pdf_time,
+            "modDate": pdf_time
+        })
+        # no_new_id: 毎回異なるファイルIDを付けない（同じ入力から同じバイト列にする）
+        doc.save(str(output_path), garbage=4, deflate=True, no_new_id=True)
+
+
+def build_report(request: ReportRequest, template_path: str, output_dir: str) -> ReportResult:
+    """
+    社員1人分のExcelとPDFを作成（ワーカープロセスで実行）
+
+    Args:
+        request: 作成依頼
+        template_path: テンプレートのパス
+        output_dir: 出力先ディレクトリ
+
+    Returns:
+        作成結果
+    """
+    try:
+        basename = report_basename(request.employee, request.report_date)
+        timestamp = datetime.strptime(request.report_date, "%Y/%m/%d")
+        xlsx_path = Path(output_dir) / f"{basename}.xlsx"
+        pdf_path = Path(output_dir) / f"{basename}.pdf"
+
+        _write_workbook(request, template_path, xlsx_path, timestamp)
+        _write_pdf(request, pdf_path, timestamp)
+
+        receipts = sum(1 for entry in request.entries if entry.get("receipt"))
+        return ReportResult(
+            request.employee, True, str(xlsx_path), str(pdf_path),
+            f"{len(request.entries)}件（領収書{receipts}枚）"
+        )
+    except Exception as e:
+        return ReportResult(request.employee, False, None, None, f"作成エラー: {str(e)}")
+
+
+class ReportGenerator:
+    """精算書の一括作成クラス"""
+
+    def __init__(
+        self,
+        template_path: str = str(DEFAULT_TEMPLATE),
+        output_dir: str = DEFAULT_OUTPUT_DIR,
+        workers: Optional[int] = None
+    ):
+        """
+        初期化
+
+        Args:
+            template_path: テンプレートのパス
+            output_dir: 出力先ディレクトリ
+            workers: 作成プロセス数（Noneの場合はCPU数）
+        """
+        self.template_path = template_path
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+
+    def generate(self, requests: Sequence[ReportRequest]) -> List[ReportResult]:
+        """
+        精算書をプロセスプールで並列に作成
+
+        Args:
+            requests: 作成依頼のリスト
+
+        Returns:
+            入力と同じ順序の作成結果
+
+        Raises:
+            ValueError: 同じ出力ファイル名になる依頼がある場合
+        """
+        names = [report_basename(request.employee, request.report_date) for request in requests]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"出力ファイル名が重複しています: {', '.join(duplicates)}")
+
+        Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+        if not requests:
+            return []
+
+        workers = min(self.workers, len(requests))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(build_report, request, self.template_path, self.output_dir)
+                for request in requests
+            ]
+            return [future.result() for future in futures]
+
+
+def load_requests(manifest_path: str) -> List[ReportRequest]:
+    """
+    作成依頼のマニフェスト（JSON）を読み込む
+
+    各要素は employee, report_date と entries（明細のリスト）または workbook（明細を読み込むExcel）を持つ。
+    receipt などの相対パスはマニフェストのディレクトリを基準とする
+
+    Args:
+        manifest_path: マニフェストのパス
+
+    Returns:
+        作成依頼のリスト
+    """
+    base_dir = Path(manifest_path).resolve().parent
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    requests = []
+    for item in items:
+        if "workbook" in item:
+            handler = ExpenseExcelHandler(str(base_dir / item["workbook"]))
+            handler.load(read_only=True)
+            try:
+                entries = handler.get_existing_entries()
+            finally:
+                handler.close()
+        else:
+            entries = item.get("entries", [])
+
+        resolved = []
+        for entry in entries:
+            entry = {key: entry[key] for key in ("date", "payee", "content", "amount", "receipt") if key in entry}
+            entry["date"] = normalize_date(entry["date"])
+            if entry.get("receipt"):
+                entry["receipt"] = str(base_dir / entry["receipt"])
+            resolved.append(entry)
+
+        requests.append(ReportRequest(
+            employee=item["employee"],
+            report_date=item["report_date"],
+            entries=resolved,
+            department=item.get("department", "")
+        ))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="社員ごとの立替経費精算書（Excel・PDF）の一括作成")
+    parser.add_argument("manifest", help="作成依頼のマニフェスト（JSON）")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="出力先ディレクトリ")
+    parser.add_argument("--template", default=str(DEFAULT_TEMPLATE), help="テンプレートのパス")
+    parser.add_argument("--workers", type=int, help="作成プロセス数（デフォルト: CPU数）")
+    args = parser.parse_args()
+
+    requests = load_requests(args.manifest)
+    generator = ReportGenerator(args.template, args.output_dir, args.workers)
+
+    print(f"📄 {len(requests)}人分の精算書を作成します（{min(generator.workers, len(requests) or 1)}プロセス）")
+    start = time.perf_counter()
+    results = generator.generate(requests)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if result.success:
+            print(f"  ✅ {result.employee}: {Path(result.pdf_path).name} {result.message}")
+        else:
+            print(f"  ❌ {result.employee}: {result.message}")
+
+    failed = sum(not result.success for result in results)
+    print(f"\n⏱️  {elapsed:.1f}秒（成功 {len(results) - failed}件 / 失敗 {failed}件）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+バッチAPIの結果ファイルの解析（ReceiptProcessor.read_batch_results）のテスト
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from extraction_backend import ExtractionBackend
+from receipt_cache import ReceiptCache
+from receipt_processor import ReceiptProcessor
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+RECEIPT = {"date": "2025/12/03", "payee": "業務スーパー", "content": "食品", "amount": 3330.0}
+
+
+class UnusedBackend(ExtractionBackend):
+    """バッチの結果を読むだけのテストで、APIを呼ばないことを確認するバックエンド"""
+
+    def complete(self, request):
+        raise AssertionError("バッチの結果の解析でAPIを呼び出しました")
+
+
+@pytest.fixture
+def processor():
+    with ReceiptProcessor(api_key="test", backend=UnusedBackend()) as processor:
+        yield processor
+
+
+def output_line(custom_id: str, content: str, status_code: int = 200) -> str:
+    """出力ファイルの1行"""
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {
+            "status_code": status_code,
+            "body": {
+                "choices": [{"message": {"content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 20}
+            }
+        },
+        "error": None
+    }, ensure_ascii=False)
+
+
+def requests_for(*custom_ids):
+    return {custom_id: {"path": str(SAMPLE_IMAGE), "cache_key": None} for custom_id in custom_ids}
+
+
+def test_successful_record(processor):
+    results = processor.read_batch_results(
+        [output_line("receipt-0", json.dumps(RECEIPT, ensure_ascii=False))], requests_for("receipt-0")
+    )
+
+    success, expense, message = results["receipt-0"]
+    assert success
+    assert {key: expense[key] for key in RECEIPT} == RECEIPT
+    assert "抽出に成功" in message
+
+
+def test_fenced_content_is_accepted(processor):
+    content = "```json\n" + json.dumps(RECEIPT, ensure_ascii=False) + "\n```"
+
+    results = processor.read_batch_results([output_line("receipt-0", content)], requests_for("receipt-0"))
+
+    assert results["receipt-0"][0]
+
+
+def test_error_record(processor):
+    line = json.dumps({
+        "custom_id": "receipt-0",
+        "response": None,
+        "error": {"code": "batch_expired", "message": "期限切れ"}
+    }, ensure_ascii=False)
+
+    results = processor.read_batch_results([line], requests_for("receipt-0"))
+
+    assert results["receipt-0"] == (False, {}, "バッチエラー: batch_expired 期限切れ")
+
+
+def test_non_200_status(processor):
+    line = json.dumps({
+        "custom_id": "receipt-0",
+        "response": {"status_code": 429, "body": {"error": {"message": "Rate limit"}}},
+        "error": None
+    })
+
+    results = processor.read_batch_results([line], requests_for("receipt-0"))
+
+    assert results["receipt-0"] == (False, {}, "OpenAI APIエラー（429）: Rate limit")
+
+
+def test_body_without_choices(processor):
+    line = json.dumps({"custom_id": "receipt-0", "response": {"status_code": 200, "body": {"choices": []}}})
+
+    success, _, message = processor.read_batch_results([line], requests_for("receipt-0"))["receipt-0"]
+
+    assert not success
+    assert message.startswith("バッチの応答を解析できませんでした")
+
+
+def test_malformed_and_unknown_lines_are_skipped(processor):
+    lines = [
+        "",
+        '{"custom_id": "receipt-0", "respo',
+        "[1, 2]",
+        output_line("receipt-9", json.dumps(RECEIPT)),
+        output_line("receipt-1", json.dumps(RECEIPT))
+    ]
+
+    results = processor.read_batch_results(lines, requests_for("receipt-0", "receipt-1"))
+
+    assert set(results) == {"receipt-0", "receipt-1"}
+    assert results["receipt-0"] == (False, {}, "バッチの結果に含まれていません")
+    assert results["receipt-1"][0]
+
+
+def test_first_record_for_an_id_wins(processor):
+    lines = [
+        output_line("receipt-0", json.dumps(RECEIPT)),
+        output_line("receipt-0", "{}", status_code=500)
+    ]
+
+    results = processor.read_batch_results(lines, requests_for("receipt-0"))
+
+    assert results["receipt-0"][0]
+
+
+def test_success_is_stored_in_the_cache(tmp_path):
+    cache = ReceiptCache(str(tmp_path / "cache"))
+    with ReceiptProcessor(api_key="test", backend=UnusedBackend(), cache=cache) as processor:
+        requests, resolved = processor.write_batch_file([str(SAMPLE_IMAGE)], str(tmp_path / "batch.jsonl"))
+        assert resolved == {}
+        (custom_id,) = requests
+
+        processor.read_batch_results([output_line(custom_id, json.dumps(RECEIPT))], requests)
+
+        # 同じ画像は次回送信せず、キャッシュから確定する
+        requests, resolved = processor.write_batch_file([str(SAMPLE_IMAGE)], str(tmp_path / "batch2.jsonl"))
+
+    assert requests == {}
+    assert resolved[custom_id][0]
@@ -0,0 +1,139 @@
+"""
+重複レシート検出（duplicate_index）のテスト
+"""
+
+import io
+import json
+import random
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from duplicate_index import BKTree, DuplicateIndex, hamming
+from extraction_backend import Completion, ExtractionBackend
+from receipt_processor import ReceiptProcessor
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+RECEIPT = {"date": "2025/12/03", "payee": "業務スーパー", "content": "食品", "amount": 3330.0}
+BASE_HASH = 0x0123456789ABCDEF
+
+
+def flip_bits(value: int, count: int) -> int:
+    """下位から count ビットを反転した値（ハミング距離 count）"""
+    return value ^ ((1 << count) - 1)
+
+
+@pytest.mark.parametrize("distance, found", [(0, True), (6, True), (7, False)])
+def test_find_at_the_max_distance_boundary(tmp_path, distance, found):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    index.add(BASE_HASH, RECEIPT)
+
+    match = index.find(flip_bits(BASE_HASH, distance))
+
+    if found:
+        assert match["distance"] == distance
+        assert match["data"] == RECEIPT
+    else:
+        assert match is None
+
+
+def test_find_returns_the_nearest_match(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    index.add(flip_bits(BASE_HASH, 5), {**RECEIPT, "payee": "遠い"})
+    index.add(flip_bits(BASE_HASH, 2), {**RECEIPT, "payee": "近い"})
+
+    match = index.find(BASE_HASH)
+
+    assert match["distance"] == 2
+    assert match["data"]["payee"] == "近い"
+
+
+def test_bk_tree_search_matches_a_linear_scan():
+    rng = random.Random(20251203)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    # 互いに近いハッシュと、同じハッシュの重複登録も混ぜる
+    hashes += [flip_bits(hashes[0], bits) for bits in range(1, 10)] + [hashes[1]]
+    tree = BKTree()
+    for position, value in enumerate(hashes):
+        tree.add(value, position)
+
+    assert len(tree) == len(hashes)
+    for query in hashes[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for max_distance in (0, 6, 20):
+            expected = sorted(
+                (hamming(query, value), position) for position, value in enumerate(hashes)
+                if hamming(query, value) <= max_distance
+            )
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_index_is_reloaded_and_broken_lines_are_skipped(tmp_path):
+    path = tmp_path / "duplicates.jsonl"
+    DuplicateIndex(str(path)).add(BASE_HASH, {**RECEIPT, "image_hash": BASE_HASH})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"hash": "zz"}\n{"data": {}}\n{\n')
+
+    reopened = DuplicateIndex(str(path))
+
+    assert len(reopened) == 1
+    # 抽出データ以外の項目は保存しない
+    assert reopened.find(BASE_HASH)["data"] == RECEIPT
+    assert json.loads(path.read_text(encoding="utf-8").splitlines()[0])["hash"] == f"{BASE_HASH:016x}"
+
+
+def test_add_entries_only_indexes_entries_with_a_hash(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+
+    index.add_entries([
+        {**RECEIPT, "image_hash": BASE_HASH},
+        {**RECEIPT, "image_hash": None},
+        dict(RECEIPT)
+    ])
+
+    assert len(index) == 1
+    assert index.find(BASE_HASH) is not None
+
+
+def test_hash_survives_resizing_and_recompression(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    original = SAMPLE_IMAGE.read_bytes()
+    with Image.open(io.BytesIO(original)) as img:
+        retaken = io.BytesIO()
+        img.convert("RGB").resize((img.width // 2, img.height // 2)).save(retaken, "JPEG", quality=70)
+
+    distance = hamming(index.compute_hash(original), index.compute_hash(retaken.getvalue()))
+
+    assert distance <= index.max_distance
+
+
+class StaticBackend(ExtractionBackend):
+    """常に同じ抽出結果を返すバックエンド"""
+
+    def complete(self, request):
+        return Completion(text=json.dumps(RECEIPT, ensure_ascii=False))
+
+
+@pytest.mark.parametrize("policy", ["warn", "reject"])
+def test_processor_applies_the_duplicate_policy(tmp_path, policy):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    image = SAMPLE_IMAGE.read_bytes()
+
+    with ReceiptProcessor(
+        api_key="test", backend=StaticBackend(), duplicate_index=index, duplicate_policy=policy
+    ) as processor:
+        success, data, _ = processor.extract_receipt_info_from_bytes(image)
+        assert success and "duplicate_of" not in data
+
+        # 抽出しただけでは登録されない（Excelへの保存後に登録する）
+        assert len(index) == 0
+        index.add_entries([data])
+
+        success, data, message = processor.extract_receipt_info_from_bytes(image)
+
+    if policy == "warn":
+        assert success
+        assert data["duplicate_of"]["distance"] == 0
+    else:
+        assert not success
+        assert "重複" in message
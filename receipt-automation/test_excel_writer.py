@@ -0,0 +1,93 @@
+"""
+Excel書き込みキュー（excel_writer）のテスト
+"""
+
+import shutil
+import threading
+from pathlib import Path
+
+import pytest
+
+from excel_handler import ExpenseExcelHandler
+from excel_writer import ExcelWriter, get_writer
+
+TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+
+@pytest.fixture
+def workbook(tmp_path) -> Path:
+    path = tmp_path / "立替経費精算書_202512.xlsx"
+    shutil.copy(TEMPLATE, path)
+    return path
+
+
+def registered_count(path: Path) -> int:
+    handler = ExpenseExcelHandler(str(path))
+    handler.load(read_only=True)
+    try:
+        return len(handler.get_existing_entries())
+    finally:
+        handler.close()
+
+
+def test_entries_are_written_in_one_batch(workbook):
+    writer = ExcelWriter(str(workbook))
+    try:
+        results = writer.add_expense_entries([
+            {"date": "2025/12/01", "payee": "店A", "content": "文房具", "amount": 100},
+            {"date": "2025/12/02", "payee": "店B", "content": "交通費", "amount": 200},
+        ])
+    finally:
+        writer.close()
+
+    assert [success for success, _ in results] == [True, True]
+    assert registered_count(workbook) == 2
+
+
+def test_submit_after_close_raises(workbook):
+    writer = ExcelWriter(str(workbook))
+    writer.close()
+
+    with pytest.raises(RuntimeError):
+        writer.submit("2025/12/01", "店", "文房具", 100)
+
+
+def test_close_removes_writer_from_registry(workbook):
+    writer = get_writer(str(workbook))
+    assert get_writer(str(workbook)) is writer
+
+    writer.close()
+
+    replacement = get_writer(str(workbook))
+    try:
+        assert replacement is not writer
+        assert replacement.add_expense_entry("2025/12/01", "店", "文房具", 100)[0]
+    finally:
+        replacement.close()
+
+
+def test_every_accepted_entry_resolves_when_closed_concurrently(workbook):
+    writer = ExcelWriter(str(workbook), fast_save=True)
+    futures, rejected = [], []
+    start = threading.Barrier(5)
+
+    def produce(worker: int):
+        start.wait()
+        for index in range(5):
+            try:
+                futures.append(writer.submit(f"2025/12/{index + 1:02d}", f"店{worker}", "文房具", 100))
+            except RuntimeError:
+                rejected.append(worker)
+
+    threads = [threading.Thread(target=produce, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    writer.close()
+    for thread in threads:
+        thread.join()
+
+    # close と競合しても、受け付けた明細は必ず結果が返る（待ち続けない）
+    results = [future.result(timeout=30) for future in futures]
+    assert len(results) + len(rejected) == 20
+    assert registered_count(workbook) == sum(success for success, _ in results)
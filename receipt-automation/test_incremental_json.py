@@ -0,0 +1,89 @@
+"""
+逐次JSON解析（incremental_json）のテスト
+"""
+
+import json
+
+from incremental_json import IncrementalJsonParser
+
+DOCUMENT = (
+    '```json\n{"date": "2025/12/03", "payee": "業務\\"スーパー\\" \\u3042店", '
+    '"amount": 3330.5, "tags": [{"k": "}]"}, "\\\\"], "paid": true, "content": "食品\\n日用品"}\n```'
+)
+EXPECTED = json.loads(DOCUMENT[DOCUMENT.index("{"):DOCUMENT.rindex("}") + 1])
+
+
+def feed_all(chunks):
+    """断片を順に渡し、確定したフィールドを届いた順に集める"""
+    parser = IncrementalJsonParser()
+    order = []
+    for chunk in chunks:
+        order.extend(parser.feed(chunk).items())
+    return parser, order
+
+
+def test_whole_document_at_once():
+    parser, order = feed_all([DOCUMENT])
+
+    assert parser.done
+    assert parser.fields == EXPECTED
+    assert [key for key, _ in order] == list(EXPECTED)
+
+
+def test_every_split_point_gives_the_same_fields():
+    # キー・文字列・エスケープ（\" \u \\）・数値の途中で分かれても結果は同じ
+    for split in range(1, len(DOCUMENT)):
+        parser, order = feed_all([DOCUMENT[:split], DOCUMENT[split:]])
+
+        assert parser.done, split
+        assert dict(order) == EXPECTED, split
+
+
+def test_one_character_at_a_time():
+    parser, order = feed_all(list(DOCUMENT))
+
+    assert parser.done
+    assert dict(order) == EXPECTED
+    assert [key for key, _ in order] == list(EXPECTED)
+
+
+def test_escape_split_across_chunks():
+    parser = IncrementalJsonParser()
+
+    assert parser.feed('{"payee": "A\\') == {}
+    assert parser.feed('"B\\u30') == {}
+    assert parser.feed('42"') == {"payee": 'A"Bあ'}
+
+
+def test_number_is_completed_only_at_a_delimiter():
+    parser = IncrementalJsonParser()
+
+    assert parser.feed('{"amount": 33') == {}
+    assert parser.feed("30") == {}
+    assert parser.feed(', "date"') == {"amount": 3330}
+    assert parser.feed(': "2025/12/03"}') == {"date": "2025/12/03"}
+    assert parser.done
+
+
+def test_fields_arrive_before_the_object_is_closed():
+    parser = IncrementalJsonParser()
+
+    assert parser.feed('{"date": "2025/12/03", "payee": "店') == {"date": "2025/12/03"}
+    assert not parser.done
+    assert parser.fields == {"date": "2025/12/03"}
+
+
+def test_text_after_the_object_is_ignored():
+    parser = IncrementalJsonParser()
+    parser.feed('{"amount": 1}')
+
+    assert parser.done
+    assert parser.feed('{"amount": 2}') == {}
+    assert parser.fields == {"amount": 1}
+
+
+def test_null_and_invalid_values_are_skipped():
+    parser, order = feed_all(['{"date": null, "amount": 1e, "payee": "店"}'])
+
+    assert parser.done
+    assert dict(order) == {"payee": "店"}
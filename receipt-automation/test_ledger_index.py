@@ -0,0 +1,144 @@
+"""
+明細索引（ledger_index）のテスト
+"""
+
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from excel_handler import ExpenseExcelHandler
+from ledger_index import LedgerIndex, find_workbooks, normalize_date
+
+TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+
+def entry(row: int, payee: str, amount: float, date: str = "2025/12/01") -> dict:
+    return {"sheet": "立替経費精算書", "row": row, "date": date, "payee": payee, "content": "文房具", "amount": amount}
+
+
+@pytest.fixture
+def ledger(tmp_path) -> LedgerIndex:
+    ledger = LedgerIndex(str(tmp_path / "ledger.sqlite3"))
+    book = tmp_path / "立替経費精算書_202512.xlsx"
+    book.touch()
+    ledger.replace_source(str(book), [
+        entry(11, "100%果汁スタンド", 500),
+        entry(12, "100円ショップ", 110),
+        entry(13, "A_B商店", 300),
+        entry(14, "AxB商店", 400),
+        entry(15, "C:\\パス商店", 200),
+        entry(16, "100円ショップ", 220, date="2025/11/30"),
+    ], (0, 0))
+    return ledger
+
+
+def payees(ledger: LedgerIndex, query: str):
+    return [row["payee"] for row in ledger.entries(payee=query)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("%", ["100%果汁スタンド"]),
+    ("0%", ["100%果汁スタンド"]),
+    ("_", ["A_B商店"]),
+    ("A_B", ["A_B商店"]),
+    ("\\", ["C:\\パス商店"]),
+    ("\\パ", ["C:\\パス商店"]),
+])
+def test_like_wildcards_in_payee_are_literal(ledger, query, expected):
+    assert payees(ledger, query) == expected
+
+
+def test_payee_is_a_substring_match(ledger):
+    assert payees(ledger, "ショップ") == ["100円ショップ", "100円ショップ"]
+    assert payees(ledger, "商店") == ["A_B商店", "AxB商店", "C:\\パス商店"]
+    assert payees(ledger, "存在しない") == []
+
+
+def test_old_payee_index_is_dropped(tmp_path):
+    path = tmp_path / "ledger.sqlite3"
+    LedgerIndex(str(path))
+    with sqlite3.connect(str(path)) as conn:
+        conn.execute("CREATE INDEX entries_payee ON entries (payee)")
+
+    LedgerIndex(str(path))
+
+    with sqlite3.connect(str(path)) as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "entries_payee" not in names
+    assert "entries_date" in names
+
+
+def test_totals(ledger):
+    assert ledger.totals() == [{"count": 6, "total": 1730}]
+    assert ledger.totals(payee="ショップ") == [{"count": 2, "total": 330}]
+    assert ledger.totals("month") == [
+        {"key": "2025/12", "count": 5, "total": 1510},
+        {"key": "2025/11", "count": 1, "total": 220},
+    ]
+    assert ledger.totals("payee", date_from="2025-12-01")[0] == {"key": "100%果汁スタンド", "count": 1, "total": 500}
+
+
+def test_empty_totals(tmp_path):
+    assert LedgerIndex(str(tmp_path / "ledger.sqlite3")).totals() == [{"count": 0, "total": 0}]
+
+
+def test_unknown_group_raises(ledger):
+    with pytest.raises(ValueError):
+        ledger.totals("content")
+
+
+def test_dates_are_normalized():
+    assert normalize_date(datetime(2025, 12, 3, 9, 30)) == "2025/12/03"
+    assert normalize_date("2025-12-03") == "2025/12/03"
+    assert normalize_date(" 2025/12/03 ") == "2025/12/03"
+    assert normalize_date("不明") == "不明"
+
+
+def test_find_workbooks_only_lists_monthly_books(tmp_path):
+    for name in (
+        "立替経費精算書_202512.xlsx",
+        "立替経費精算書_202511.xlsx",
+        "立替経費精算書_山田_20251231.xlsx",
+        "立替経費精算書_202512_backup.xlsx",
+        "メモ.xlsx",
+    ):
+        (tmp_path / name).touch()
+
+    assert [Path(path).name for path in find_workbooks(str(tmp_path))] == [
+        "立替経費精算書_202511.xlsx", "立替経費精算書_202512.xlsx"
+    ]
+
+
+def test_backfill_skips_unchanged_books_and_follows_writes(tmp_path):
+    book = tmp_path / "立替経費精算書_202512.xlsx"
+    shutil.copy(TEMPLATE, book)
+    ledger = LedgerIndex(str(tmp_path / "ledger.sqlite3"))
+
+    assert ledger.backfill([str(book)]) == {"scanned": 1, "skipped": 0, "entries": 0}
+    assert ledger.backfill([str(book)]) == {"scanned": 0, "skipped": 1, "entries": 0}
+
+    handler = ExpenseExcelHandler(str(book), ledger=ledger)
+    handler.load()
+    try:
+        assert handler.add_expense_entry("2025-12-03", "業務スーパー", "食品", 3330)[0]
+        handler.save()
+    finally:
+        handler.close()
+
+    # 書き込んだ明細は索引にも追記され、ブックを読み直さずに済む
+    assert ledger.is_current(str(book))
+    assert [(row["date"], row["amount"]) for row in ledger.entries()] == [("2025/12/03", 3330)]
+    assert ledger.backfill([str(book)])["skipped"] == 1
+
+
+def test_prune_removes_missing_books(ledger, tmp_path):
+    other = tmp_path / "立替経費精算書_202601.xlsx"
+    other.touch()
+    ledger.replace_source(str(other), [entry(11, "店", 1, date="2026/01/05")], (0, 0))
+
+    ledger.prune([str(other)])
+
+    assert ledger.totals() == [{"count": 1, "total": 1}]
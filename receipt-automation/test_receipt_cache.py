@@ -0,0 +1,117 @@
+"""
+抽出結果キャッシュ（receipt_cache）のテスト
+"""
+
+import json
+import time
+from pathlib import Path
+
+from extraction_backend import Completion, ExtractionBackend
+from receipt_cache import ReceiptCache
+from receipt_processor import ReceiptProcessor
+
+SAMPLE_IMAGE = Path(__file__).resolve().parent.parent / "receipt_sample_20251203.png"
+RECEIPT = {"date": "2025/12/03", "payee": "業務スーパー", "content": "食品", "amount": 3330.0}
+
+
+def test_key_depends_on_image_model_and_prompt_version():
+    key = ReceiptCache.make_key(b"image", "gpt-4o", "1")
+
+    assert key == ReceiptCache.make_key(b"image", "gpt-4o", "1")
+    assert key != ReceiptCache.make_key(b"image2", "gpt-4o", "1")
+    assert key != ReceiptCache.make_key(b"image", "gpt-4o-mini", "1")
+    assert key != ReceiptCache.make_key(b"image", "gpt-4o", "2")
+
+
+def test_put_and_get_round_trip(tmp_path):
+    cache = ReceiptCache(str(tmp_path))
+    key = ReceiptCache.make_key(b"image", "gpt-4o", "1")
+
+    assert cache.get(key) is None
+    cache.put(key, RECEIPT)
+    data = cache.get(key)
+    data["amount"] = 0
+
+    assert cache.get(key) == RECEIPT  # 呼び出し側の変更はキャッシュに影響しない
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_survive_restart(tmp_path):
+    key = ReceiptCache.make_key(b"image", "gpt-4o", "1")
+    ReceiptCache(str(tmp_path)).put(key, RECEIPT)
+
+    reopened = ReceiptCache(str(tmp_path))
+
+    assert reopened.get(key) == RECEIPT
+    assert reopened.stats()["entries"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ReceiptCache(str(tmp_path), max_entries=2)
+    cache.put("a" * 64, RECEIPT)
+    cache.put("b" * 64, RECEIPT)
+    cache.get("a" * 64)
+
+    cache.put("c" * 64, RECEIPT)
+
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) == RECEIPT
+    assert cache.get("c" * 64) == RECEIPT
+    assert not (tmp_path / "bb" / f"{'b' * 64}.json").exists()
+
+
+def test_total_size_limit(tmp_path):
+    size = len(json.dumps(RECEIPT, ensure_ascii=False).encode("utf-8"))
+    cache = ReceiptCache(str(tmp_path), max_bytes=size * 2)
+    for key in ("a", "b", "c"):
+        cache.put(key * 64, RECEIPT)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == size * 2
+
+
+def test_expired_entry_is_a_miss(tmp_path, monkeypatch):
+    cache = ReceiptCache(str(tmp_path), max_age_seconds=60)
+    cache.put("a" * 64, RECEIPT)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+
+    assert cache.get("a" * 64) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_corrupt_file_is_dropped(tmp_path):
+    key = "a" * 64
+    ReceiptCache(str(tmp_path)).put(key, RECEIPT)
+    (tmp_path / "aa" / f"{key}.json").write_text("{", encoding="utf-8")
+
+    cache = ReceiptCache(str(tmp_path))
+
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
+
+
+class CountingBackend(ExtractionBackend):
+    """呼び出し回数を数えるバックエンド"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, request):
+        self.calls += 1
+        return Completion(text=json.dumps(RECEIPT, ensure_ascii=False))
+
+
+def test_processor_skips_the_backend_on_a_hit(tmp_path):
+    backend = CountingBackend()
+    image = SAMPLE_IMAGE.read_bytes()
+
+    with ReceiptProcessor(api_key="test", backend=backend, cache=ReceiptCache(str(tmp_path))) as processor:
+        first = processor.extract_receipt_info_from_bytes(image)
+        second = processor.extract_receipt_info_from_bytes(image)
+
+    assert first == second
+    assert first[0]
+    assert backend.calls == 1
@@ -0,0 +1,91 @@
+"""
+集計結果キャッシュ（excel_handler.get_summary）のテスト
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from excel_handler import ExpenseExcelHandler, get_summary
+from metrics import Metrics
+
+TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+
+@pytest.fixture
+def workbook(tmp_path) -> Path:
+    path = tmp_path / "立替経費精算書_202512.xlsx"
+    shutil.copy(TEMPLATE, path)
+    return path
+
+
+@pytest.fixture
+def loads():
+    """Excelの読み込み回数を数える計測先"""
+    events = []
+    metrics = Metrics()
+    metrics.add_hook(events.append)
+    return metrics, events
+
+
+def load_count(events) -> int:
+    return sum(event["name"] == "excel_load" for event in events)
+
+
+def add_entry(path: Path, amount: float, fast_save: bool = True):
+    handler = ExpenseExcelHandler(str(path), fast_save=fast_save)
+    handler.load()
+    try:
+        assert handler.add_expense_entries([
+            {"date": "2025/12/01", "payee": "店", "content": "文房具", "amount": amount}
+        ])[0]
+    finally:
+        handler.close()
+
+
+def test_unchanged_file_is_not_parsed_again(workbook, loads):
+    metrics, events = loads
+
+    first = get_summary(str(workbook), metrics=metrics)
+    second = get_summary(str(workbook), metrics=metrics)
+
+    assert load_count(events) == 1
+    assert first == second
+    assert first["count"] == 0
+
+
+def test_returned_summary_is_a_copy(workbook, loads):
+    metrics, _ = loads
+    get_summary(str(workbook), metrics=metrics)["entries"].append({"amount": 1})
+
+    assert get_summary(str(workbook), metrics=metrics)["entries"] == []
+
+
+@pytest.mark.parametrize("fast_save", [True, False])
+def test_save_through_the_handler_refreshes_the_summary(workbook, loads, fast_save):
+    metrics, events = loads
+    get_summary(str(workbook), metrics=metrics)
+
+    add_entry(workbook, 440, fast_save=fast_save)
+    summary = get_summary(str(workbook), metrics=metrics)
+
+    assert summary["count"] == 1
+    assert summary["entries"][0]["amount"] == 440
+    assert load_count(events) == 2
+
+
+def test_external_change_is_detected(workbook, loads, tmp_path):
+    metrics, _ = loads
+    get_summary(str(workbook), metrics=metrics)
+
+    # 別プロセス（Excelなど）での保存を模擬: 別のファイルで書き込んでから置き換える
+    edited = tmp_path / "edited.xlsx"
+    shutil.copy(workbook, edited)
+    add_entry(edited, 1260)
+    stat = workbook.stat()
+    os.replace(edited, workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert [entry["amount"] for entry in get_summary(str(workbook), metrics=metrics)["entries"]] == [1260]
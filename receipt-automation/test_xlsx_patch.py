@@ -0,0 +1,122 @@
+"""
+xlsx部分書き換え（xlsx_patch）のテスト
+"""
+
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from excel_handler import ExpenseExcelHandler
+from xlsx_patch import XlsxPatchError, patch_sheet_xml, patch_workbook, sheet_parts
+
+TEMPLATE = Path(__file__).resolve().parent / "templates" / "立替経費精算書.xlsx"
+
+
+def sheet(rows: str) -> str:
+    """sheetData だけを持つワークシートXML"""
+    return (
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f"<sheetData>{rows}</sheetData></worksheet>"
+    )
+
+
+def test_insert_into_sparse_row_keeps_cell_references():
+    xml = sheet('<row r="11"><c r="A11" s="1"/><c r="Z11" s="2"/></row>')
+
+    patched = patch_sheet_xml(xml, {(11, 4): "文房具", (11, 30): 3})
+
+    assert (
+        '<c r="A11" s="1"/><c r="D11" t="inlineStr"><is><t>文房具</t></is></c>'
+        '<c r="Z11" s="2"/><c r="AD11"><v>3</v></c>'
+    ) in patched
+
+
+def test_existing_cell_keeps_style_and_drops_old_type():
+    xml = sheet('<row r="3"><c r="B3" s="5" t="s"><v>0</v></c></row>')
+
+    patched = patch_sheet_xml(xml, {(3, 2): 440.5})
+
+    assert '<c r="B3" s="5"><v>440.5</v></c>' in patched
+
+
+def test_self_closing_row_is_expanded():
+    xml = sheet('<row r="5" spans="1:4"/><row r="6"><c r="A6"><v>1</v></c></row>')
+
+    patched = patch_sheet_xml(xml, {(5, 2): " 先頭に空白"})
+
+    assert (
+        '<row r="5" spans="1:4"><c r="B5" t="inlineStr">'
+        '<is><t xml:space="preserve"> 先頭に空白</t></is></c></row>'
+        '<row r="6"><c r="A6"><v>1</v></c></row>'
+    ) in patched
+
+
+def test_unchanged_rows_are_copied_verbatim():
+    rows = '<row r="1"><c r="A1" t="s"><v>7</v></c></row><row r="2"><c r="A2"/></row>'
+
+    patched = patch_sheet_xml(sheet(rows), {(2, 1): "a&b"})
+
+    assert '<row r="1"><c r="A1" t="s"><v>7</v></c></row>' in patched
+    assert "a&amp;b" in patched
+
+
+def test_missing_row_raises():
+    with pytest.raises(XlsxPatchError):
+        patch_sheet_xml(sheet('<row r="1"/>'), {(2, 1): "x"})
+
+
+def test_cell_without_reference_raises():
+    with pytest.raises(XlsxPatchError):
+        patch_sheet_xml(sheet('<row r="1"><c><v>1</v></c></row>'), {(1, 3): "x"})
+
+
+def test_patch_workbook_round_trip(tmp_path):
+    path = tmp_path / "精算書.xlsx"
+    shutil.copy(TEMPLATE, path)
+    title = load_workbook(path, read_only=True).active.title
+
+    row = ExpenseExcelHandler.DATA_START_ROW
+    patch_workbook(str(path), str(path), {title: {
+        (row, ExpenseExcelHandler.COL_DATE): "2025/12/03",
+        (row, ExpenseExcelHandler.COL_AMOUNT): 3330
+    }})
+
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+    worksheet = load_workbook(path).active
+    assert worksheet.cell(row, ExpenseExcelHandler.COL_DATE).value == "2025/12/03"
+    assert worksheet.cell(row, ExpenseExcelHandler.COL_AMOUNT).value == 3330
+
+
+def test_patch_workbook_sparse_sheet(tmp_path):
+    path = tmp_path / "sparse.xlsx"
+    workbook = Workbook()
+    workbook.active.title = "明細"
+    workbook.active["A1"] = "見出し"
+    workbook.active["E1"] = "右端"
+    workbook.active["A2"] = None
+    workbook.active.row_dimensions[2].height = 20
+    workbook.save(path)
+
+    patch_workbook(str(path), str(path), {"明細": {(1, 3): "中央", (2, 2): 10}})
+
+    worksheet = load_workbook(path).active
+    assert [cell.value for cell in worksheet[1]] == ["見出し", None, "中央", None, "右端"]
+    assert worksheet.cell(2, 2).value == 10
+
+
+def test_patch_workbook_unknown_sheet_leaves_file_untouched(tmp_path):
+    path = tmp_path / "精算書.xlsx"
+    shutil.copy(TEMPLATE, path)
+    before = path.read_bytes()
+
+    with pytest.raises(XlsxPatchError):
+        patch_workbook(str(path), str(path), {"存在しないシート": {(1, 1): "x"}})
+
+    assert path.read_bytes() == before
+    assert list(tmp_path.iterdir()) == [path]
+    with zipfile.ZipFile(path) as archive:
+        assert "存在しないシート" not in sheet_parts(archive)
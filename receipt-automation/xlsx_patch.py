@@ -0,0 +1,396 @@
+"""
+xlsxの部分書き換えモジュール
+変更したセルを含むワークシートのXMLだけを書き換え、その他のzipメンバーは圧縮済みのまま複製する
+（openpyxlでブック全体を再シリアライズしないため、保存時間がブックの大きさに依存しない）
+"""
+
+import os
+import re
+import stat
+import struct
+import tempfile
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Optional, Tuple, Union
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+# セルの値（文字列・数値・None=クリア）
+CellValue = Union[str, int, float, None]
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# zipのヘッダー（ZIP64は扱わない）
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+class XlsxPatchError(Exception):
+    """部分書き換えで扱えないブック（呼び出し側は通常の保存に切り替える）"""
+
+
+def replace_file(tmp_path: str, target: Path, mode_source: Path):
+    """
+    一時ファイルで置き換える（mkstempの0600ではなく元ファイルのパーミッションを引き継ぐ）
+
+    Args:
+        tmp_path: 書き込み済みの一時ファイル
+        target: 置き換え先
+        mode_source: 置き換え先がまだない場合にパーミッションを引き継ぐファイル
+    """
+    reference = target if target.exists() else mode_source
+    os.chmod(tmp_path, stat.S_IMODE(os.stat(reference).st_mode))
+    os.replace(tmp_path, target)
+
+
+def workbook_part(archive: zipfile.ZipFile) -> str:
+    """ブック本体（workbook.xml）のzip内のパス"""
+    root_rels = ET.fromstring(archive.read("_rels/.rels"))
+    for rel in root_rels.findall(f"{{{NS_PKG_REL}}}Relationship"):
+        if rel.get("Type", "").endswith("/officeDocument"):
+            return rel.get("Target").lstrip("/")
+    return "xl/workbook.xml"
+
+
+def sheet_parts(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """
+    シート名とワークシートXMLのパスの対応を取得
+
+    Args:
+        archive: xlsxのzip
+
+    Returns:
+        シート名 -> zip内のパス（例: xl/worksheets/sheet1.xml）
+    """
+    workbook_part_name = workbook_part(archive)
+    workbook_dir = PurePosixPath(workbook_part_name).parent
+    rels_part = str(workbook_dir / "_rels" / (PurePosixPath(workbook_part_name).name + ".rels"))
+    targets = {}
+    for rel in ET.fromstring(archive.read(rels_part)).findall(f"{{{NS_PKG_REL}}}Relationship"):
+        target = rel.get("Target")
+        if target.startswith("/"):
+            targets[rel.get("Id")] = target.lstrip("/")
+        else:
+            targets[rel.get("Id")] = os.path.normpath(str(workbook_dir / target)).replace(os.sep, "/")
+
+    parts = {}
+    workbook = ET.fromstring(archive.read(workbook_part_name))
+    for sheet in workbook.iter(f"{{{NS_MAIN}}}sheet"):
+        parts[sheet.get("name")] = targets[sheet.get(f"{{{NS_REL}}}id")]
+    return parts
+
+
+def _cell_xml(ref: str, attrs: str, value: CellValue) -> str:
+    """
+    セル要素を生成（スタイルなど既存の属性は維持）
+
+    文字列は共有文字列テーブルを書き換えずに済むようインライン文字列で書き込む
+
+    Args:
+        ref: 新しく挿入するセルの r 属性（例: ' r="D11"'。既存セルでは attrs に含まれるため空文字）
+        attrs: 既存セルの属性（t 属性は除いたもの）
+        value: 値
+    """
+    if value is None:
+        return f"<c{ref}{attrs}/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = int(value) if float(value).is_integer() else value
+        return f"<c{ref}{attrs}><v>{number}</v></c>"
+
+    text = str(value)
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c{ref}{attrs} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+
+def _column_index(ref: str) -> int:
+    """セル参照（例: AD11）の列番号"""
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index
+
+
+_CELL_PATTERN = re.compile(r'<c\b(?P<attrs>[^>]*?)(?:/>|>(?P<body>.*?)</c>)', re.S)
+_REF_PATTERN = re.compile(r'\br="([A-Z]+\d+)"')
+_TYPE_PATTERN = re.compile(r'\s+t="[^"]*"')
+
+
+def _patch_row(row_xml: str, row: int, cells: Dict[int, CellValue]) -> str:
+    """
+    1行分のXMLの指定セルを書き換える（存在しないセルは列順に挿入）
+
+    Args:
+        row_xml: <row> 要素の中身（子要素の部分）
+        row: 行番号
+        cells: 列番号 -> 値
+
+    Returns:
+        書き換え後の中身
+
+    Raises:
+        XlsxPatchError: 列位置（r属性）のないセルを含む行
+    """
+    remaining = dict(cells)
+    pieces = []
+    position = 0
+
+    for match in _CELL_PATTERN.finditer(row_xml):
+        ref_match = _REF_PATTERN.search(match.group("attrs"))
+        if ref_match is None:
+            # r 属性のないセルは位置を前のセルから数える必要があり、挿入位置を決められない
+            raise XlsxPatchError(f"{row}行目に列位置（r属性）のないセルがあります")
+        column = _column_index(ref_match.group(1))
+
+        # 手前に挿入すべきセル
+        for new_column in sorted(c for c in remaining if c < column):
+            pieces.append(row_xml[position:match.start()])
+            position = match.start()
+            pieces.append(_cell_xml(f' r="{get_column_letter(new_column)}{row}"', "", remaining.pop(new_column)))
+
+        if column in remaining:
+            attrs = _TYPE_PATTERN.sub("", match.group("attrs"))
+            pieces.append(row_xml[position:match.start()])
+            pieces.append(_cell_xml("", attrs, remaining.pop(column)))
+            position = match.end()
+
+    pieces.append(row_xml[position:])
+    for new_column in sorted(remaining):
+        pieces.append(_cell_xml(f' r="{get_column_letter(new_column)}{row}"', "", remaining[new_column]))
+    return "".join(pieces)
+
+
+def patch_sheet_xml(sheet_xml: str, cells: Dict[Tuple[int, int], CellValue]) -> str:
+    """
+    ワークシートXMLのセルを書き換える（変更のない行には触れない）
+
+    Args:
+        sheet_xml: ワークシートXML
+        cells: (行, 列) -> 値
+
+    Returns:
+        書き換え後のXML
+    """
+    by_row: Dict[int, Dict[int, CellValue]] = {}
+    for (row, column), value in cells.items():
+        by_row.setdefault(row, {})[column] = value
+
+    position = sheet_xml.find("<sheetData")
+    if position < 0:
+        raise XlsxPatchError("sheetData が見つかりません")
+
+    # 行番号順に前から1回だけ走査し、変更した行以外は元の文字列をそのまま使う
+    pieces = [sheet_xml[:position]]
+    for row in sorted(by_row):
+        match = re.compile(rf'<row\b[^>]*\br="{row}"[^>]*?(/>|>)').search(sheet_xml, position)
+        if match is None:
+            raise XlsxPatchError(f"{row}行目が見つかりません")
+
+        if match.group(1) == "/>":
+            # 空の行要素を開始・終了タグに展開
+            head = sheet_xml[match.start():match.end() - 2] + ">"
+            body_start = body_end = match.end()
+            tail = "</row>"
+        else:
+            head = sheet_xml[match.start():match.end()]
+            body_start = match.end()
+            body_end = sheet_xml.index("</row>", body_start)
+            tail = ""
+
+        pieces.append(sheet_xml[position:match.start()])
+        pieces.append(head + _patch_row(sheet_xml[body_start:body_end], row, by_row[row]) + tail)
+        position = body_end
+
+    pieces.append(sheet_xml[position:])
+    return "".join(pieces)
+
+
+def _request_full_calculation(workbook_xml: str) -> str:
+    """開いたときに数式を再計算するよう calcPr に fullCalcOnLoad を設定"""
+    if "fullCalcOnLoad" in workbook_xml:
+        return workbook_xml
+    if "<calcPr" in workbook_xml:
+        return re.sub(r"<calcPr\b", '<calcPr fullCalcOnLoad="1"', workbook_xml, count=1)
+    return workbook_xml.replace("</workbook>", '<calcPr fullCalcOnLoad="1"/></workbook>')
+
+
+def _raw_member(source, info: zipfile.ZipInfo) -> Tuple[bytes, bytes]:
+    """
+    zipメンバーのローカルヘッダー・圧縮済みデータ（・データディスクリプタ）をそのまま読み出す
+
+    Returns:
+        (ローカルヘッダーからデータ末尾までのバイト列, ファイル名のバイト列)
+    """
+    source.seek(info.header_offset)
+    header = source.read(LOCAL_HEADER.size)
+    fields = LOCAL_HEADER.unpack(header)
+    if fields[0] != b"PK\x03\x04":
+        raise XlsxPatchError(f"zipのローカルヘッダーが不正です: {info.filename}")
+
+    name_length, extra_length = fields[9], fields[10]
+    rest = source.read(name_length + extra_length + info.compress_size)
+    raw_name = rest[:name_length]
+
+    descriptor = b""
+    if info.flag_bits & FLAG_DATA_DESCRIPTOR:
+        descriptor = source.read(4)
+        if descriptor == DATA_DESCRIPTOR_SIGNATURE:
+            descriptor += source.read(12)
+        else:
+            descriptor += source.read(8)
+
+    return header + rest + descriptor, raw_name
+
+
+def _dos_datetime(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    """ZipInfo.date_time を (DOS時刻, DOS日付) に変換"""
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _central_entry(info: zipfile.ZipInfo, raw_name: bytes, flags: int, method: int,
+                   crc: int, compress_size: int, file_size: int, offset: int,
+                   date_time: Optional[Tuple[int, ...]] = None) -> bytes:
+    """セントラルディレクトリのエントリ（拡張フィールド・コメントなし）"""
+    dos_time, dos_date = _dos_datetime(date_time or info.date_time)
+    return CENTRAL_HEADER.pack(
+        b"PK\x01\x02", (info.create_system << 8) | info.create_version, info.extract_version,
+        flags, method, dos_time, dos_date, crc, compress_size, file_size,
+        len(raw_name), 0, 0, 0, info.internal_attr, info.external_attr, offset
+    ) + raw_name
+
+
+def rewrite_archive(
+    source_path: str,
+    output_path: str,
+    replace: Callable[[zipfile.ZipFile], Dict[str, bytes]],
+    date_time: Optional[Tuple[int, ...]] = None
+):
+    """
+    zipの指定メンバーだけを差し替えて保存
+
+    差し替えるメンバーだけを再圧縮し、その他のメンバーは圧縮済みのバイト列のまま複製する。
+    出力は一時ファイルに書いてから置き換えるため、途中で失敗しても元のファイルは壊れない
+
+    Args:
+        source_path: 元のzip（xlsx）
+        output_path: 出力先（source_path と同じでもよい）
+        replace: 元のzipを受け取り、差し替えるメンバー名 -> 新しい内容 を返す関数
+        date_time: 指定した場合は全メンバーの更新日時をこの値にする（ヘッダーだけを書き換える）
+
+    Raises:
+        XlsxPatchError: 扱えないzip（ZIP64・ヘッダーの不正）、または replace が送出したもの
+    """
+    output_path = Path(output_path)
+    dos_stamp = _dos_datetime(date_time) if date_time else None
+
+    fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix=".", suffix=".xlsx.tmp")
+    try:
+        with os.fdopen(fd, "wb") as out, open(source_path, "rb") as source, zipfile.ZipFile(source) as archive:
+            infos = archive.infolist()
+            if len(infos) >= 0xFFFF or any(
+                max(info.header_offset, info.compress_size, info.file_size) >= 0xFFFFFFFF for info in infos
+            ):
+                raise XlsxPatchError("ZIP64形式のブックには対応していません")
+
+            replaced = replace(archive)
+
+            central = []
+            for info in infos:
+                offset = out.tell()
+                raw, raw_name = _raw_member(source, info)
+
+                if info.filename not in replaced:
+                    # 変更のないメンバーは圧縮済みのバイト列をそのまま複製（時刻を揃える場合もヘッダーだけ書き換える）
+                    if dos_stamp is not None:
+                        fields = LOCAL_HEADER.unpack(raw[:LOCAL_HEADER.size])
+                        raw = LOCAL_HEADER.pack(*fields[:4], *dos_stamp, *fields[6:]) + raw[LOCAL_HEADER.size:]
+                    out.write(raw)
+                    central.append(_central_entry(
+                        info, raw_name, info.flag_bits, info.compress_type,
+                        info.CRC, info.compress_size, info.file_size, offset, date_time
+                    ))
+                    continue
+
+                data = replaced[info.filename]
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+                compressed = compressor.compress(data) + compressor.flush()
+                crc = zlib.crc32(data)
+                flags = info.flag_bits & FLAG_UTF8
+                dos_time, dos_date = dos_stamp or _dos_datetime(info.date_time)
+                out.write(LOCAL_HEADER.pack(
+                    b"PK\x03\x04", info.extract_version, flags, zipfile.ZIP_DEFLATED,
+                    dos_time, dos_date, crc, len(compressed), len(data), len(raw_name), 0
+                ))
+                out.write(raw_name)
+                out.write(compressed)
+                central.append(_central_entry(
+                    info, raw_name, flags, zipfile.ZIP_DEFLATED, crc, len(compressed), len(data), offset, date_time
+                ))
+
+            directory_offset = out.tell()
+            for entry in central:
+                out.write(entry)
+            directory_size = out.tell() - directory_offset
+            out.write(END_RECORD.pack(
+                b"PK\x05\x06", 0, 0, len(central), len(central), directory_size, directory_offset, 0
+            ))
+
+        # 元ファイルを閉じてから置き換える（Windowsでは開いたままのファイルを置き換えられない）
+        replace_file(tmp_path, output_path, Path(source_path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def patch_workbook(
+    source_path: str,
+    output_path: str,
+    edits: Dict[str, Dict[Tuple[int, int], CellValue]]
+):
+    """
+    ブック内の指定シートのセルだけを書き換えて保存
+
+    変更したワークシートのXMLだけを展開・再圧縮し、その他のメンバーは圧縮済みのバイト列のまま複製する。
+    出力は一時ファイルに書いてから置き換えるため、途中で失敗しても元のファイルは壊れない
+
+    Args:
+        source_path: 元のxlsx
+        output_path: 出力先（source_path と同じでもよい）
+        edits: シート名 -> {(行, 列): 値}
+
+    Raises:
+        XlsxPatchError: 部分書き換えで扱えないブック（ZIP64・シートが見つからない など）
+    """
+    def patched_parts(archive: zipfile.ZipFile) -> Dict[str, bytes]:
+        parts = sheet_parts(archive)
+        replaced: Dict[str, bytes] = {}
+        has_formulas = False
+        for title, cells in edits.items():
+            if title not in parts:
+                raise XlsxPatchError(f"シートが見つかりません: {title}")
+            if not cells:
+                continue
+            sheet_xml = archive.read(parts[title]).decode("utf-8")
+            has_formulas = has_formulas or "<f>" in sheet_xml or "<f " in sheet_xml
+            replaced[parts[title]] = patch_sheet_xml(sheet_xml, cells).encode("utf-8")
+
+        # 数式のキャッシュ値が古くならないよう、Excelで開いたときに再計算させる
+        if has_formulas:
+            book_part = workbook_part(archive)
+            workbook_xml = archive.read(book_part).decode("utf-8")
+            replaced[book_part] = _request_full_calculation(workbook_xml).encode("utf-8")
+        return replaced
+
+    rewrite_archive(source_path, output_path, patched_parts)
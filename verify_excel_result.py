@@ -15,7 +15,7 @@ print(f"📊 テスト結果の検証: {excel_path}")
 print("="*60)
 
 handler = ExpenseExcelHandler(excel_path)
-handler.load()
+handler.load(read_only=True)
 
 print("\n📋 登録されている明細:")
 print("-"*60)